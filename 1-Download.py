@@ -14,10 +14,17 @@ IceSat2 download script
 import icepyx as ipx
 import geopandas as gpd
 import fiona
+import os
+import shapely
 from pprint import pprint
 
+import order_planner
+from run_pipeline import stage_params
+import stage_metrics
+
 # !!! Modify this line for different computers
-working_dir = "/Users/jmaze/Documents/projects/IceSat2-Lakes/"
+# run_pipeline.py sets ICESAT2_LAKES_DIR, otherwise the path below is used
+working_dir = os.environ.get('ICESAT2_LAKES_DIR', "/Users/jmaze/Documents/projects/IceSat2-Lakes") + '/'
 download_path = working_dir + 'data_raw/'
 
 # %% 2. Download the IceSat2 data
@@ -49,37 +56,92 @@ time = [begining, end]
 
 # %%% 2.3 Create a ipx.Query object and subset the variables
 
-# Pick spatial and temporal attributes
-ATL06_identifier = ipx.Query(product = 'ATL06', 
-                             spatial_extent = coords_list,
-                             date_range = time)
-
-# !!! You will need to enter Earth Data username and password here 
-# See a list of potential inputs
-ATL06_identifier.order_vars.avail(options = True)
-
-pprint(ATL06_identifier.order_vars.avail())
-
-# Make a wanted variable list
-ATL06_identifier.order_vars.wanted
-# Add variables of interest to wanted list
-ATL06_identifier.order_vars.append(var_list = ['h_li', 'delta_time',
-                                               'latitude', 'longitude'])
-# Look the wanted vars
-pprint(ATL06_identifier.order_vars.wanted)
-
-# %%% 2.4 Download IceSat2
-
-# Get the granuales based on the variables of interest. 
-ATL06_identifier.order_granules(Coverage = ATL06_identifier.order_vars.wanted)
-# The coverage argument subsets the granuals based on the variables wanted
-
-# Download the data into folder on local machine
-ATL06_identifier.download_granules(path = download_path + 'ATL06/')
-
-
-
-
-
-
-
+# !!! Flip this to actually place the orders (or pass download.dry_run=false to run_pipeline.py)
+params = stage_params({'dry_run': True, 'include_atl03': False})
+dry_run = params['dry_run']
+
+# Listing the variables needs an Earthdata login, so a dry run skips it and
+# plans offline from the cached granule list
+if not dry_run:
+    # Pick spatial and temporal attributes
+    ATL06_identifier = ipx.Query(product = 'ATL06', 
+                                 spatial_extent = coords_list,
+                                 date_range = time)
+
+    # !!! You will need to enter Earth Data username and password here 
+    # See a list of potential inputs
+    ATL06_identifier.order_vars.avail(options = True)
+
+    pprint(ATL06_identifier.order_vars.avail())
+
+# Variables of interest, each planned order asks for the same list
+# atl06_quality_summary and h_li_sigma let stage 2 drop bad segments up front
+var_list = ['h_li', 'delta_time', 'latitude', 'longitude', 'atl06_quality_summary', 'h_li_sigma']
+
+# %%% 2.4 Plan tiled and chunked orders
+
+# One order for the whole box and 5 years is slow and all-or-nothing. 
+# Split it into tiles (degrees) and time chunks (days) instead.
+tile_deg = 1.0
+chunk_days = 91
+study_polygon = shapely.Polygon(coords_list)
+
+# Cache the granule list so re-planning (and dry runs) can happen offline
+granule_cache = download_path + 'ATL06_granules.json'
+if os.path.exists(granule_cache):
+    granules = order_planner.load_granule_list(granule_cache)
+else:
+    granules = order_planner.fetch_granule_list('ATL06', coords_list, time,
+                                                cache_path = granule_cache)
+
+plan, n_duplicates = order_planner.plan_orders(granules, study_polygon, time,
+                                               tile_deg = tile_deg,
+                                               chunk_days = chunk_days)
+
+# Dry run: look at the counts and volume before submitting anything
+pprint(order_planner.summarize_plan(plan, n_duplicates))
+
+# %%% 2.5 Download IceSat2
+
+if not dry_run:
+    # Orders are submitted and downloaded in parallel into ATL06/
+    metrics = stage_metrics.RunReport('stage1', report_dir = download_path + 'run_reports/')
+    with metrics.stage('download', rows_in = len(plan)) as m:
+        results = order_planner.submit_orders(plan, 'ATL06', var_list,
+                                              download_path + 'ATL06/',
+                                              max_workers = 4)
+        m.rows_out = sum(n for n in results.values() if n)
+    pprint(results)
+    metrics.write()
+
+# %%% 2.6 ATL03 photons over the lakes (optional)
+
+# ATL06 segments are 40 m averages, small lakes only get a few of them. The 
+# ATL03 photons are binned per lake in stage 2 (see atl03_reader.py). Same 
+# tiles and chunks, just a different product and variable list.
+# !!! ATL03 granules are large (GBs), leave this off unless you need them
+if params['include_atl03']:
+    # Only needed for the ATL03 variable list
+    import atl03_reader
+
+    ATL03_cache = download_path + 'ATL03_granules.json'
+    if os.path.exists(ATL03_cache):
+        ATL03_granules = order_planner.load_granule_list(ATL03_cache)
+    else:
+        ATL03_granules = order_planner.fetch_granule_list('ATL03', coords_list, time,
+                                                          cache_path = ATL03_cache)
+    ATL03_plan, ATL03_duplicates = order_planner.plan_orders(ATL03_granules, study_polygon, time,
+                                                             tile_deg = tile_deg,
+                                                             chunk_days = chunk_days)
+    pprint(order_planner.summarize_plan(ATL03_plan, ATL03_duplicates))
+
+    if not dry_run:
+        metrics = stage_metrics.RunReport('stage1_ATL03', report_dir = download_path + 'run_reports/')
+        with metrics.stage('download', rows_in = len(ATL03_plan)) as m:
+            results = order_planner.submit_orders(ATL03_plan, 'ATL03',
+                                                  atl03_reader.ATL03_vars,
+                                                  download_path + 'ATL03/',
+                                                  max_workers = 2)
+            m.rows_out = sum(n for n in results.values() if n)
+        pprint(results)
+        metrics.write()
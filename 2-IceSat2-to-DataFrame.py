@@ -12,15 +12,20 @@ Generates a pandas csv from HDF5 files
 # ----------------------------------------------------------------------------
 # ============================================================================
 
-import icepyx as ipx
 from pprint import pprint
 import glob
 import os
-import h5py
+
 import pandas as pd
 
+import atl06_reader
+import projection
+from run_pipeline import stage_params
+import stage_metrics
+
 # !!! Change this line for different local machines
-working_dir = '/Users/jmaze/Documents/projects/IceSat2-Lakes'
+# run_pipeline.py sets ICESAT2_LAKES_DIR, otherwise the path below is used
+working_dir = os.environ.get('ICESAT2_LAKES_DIR', '/Users/jmaze/Documents/projects/IceSat2-Lakes')
 
 #Sub folders in larger project. 
 data_raw = working_dir + '/data_raw/'
@@ -38,13 +43,20 @@ ATL06_path = data_raw + 'ATL06'
 # Since data was downloaded directly from NSIDC it has the following file name convention 
 pattern = "processed_ATL{product:2}_{datetime:%Y%m%d%H%M%S}_{rgt:4}{cycle:2}{orbitsegment:2}_{version:3}_{revision:2}.h5"
 
-# Create a reader object for accessing the files locally
-ATL06_reader = ipx.Read(ATL06_path, # Path to data
-                        'ATL06', # product 
-                         pattern) # Pattern for file detection
+# !!! Only needed to look at the variables, icepyx is slow to import so it's 
+# off for batch runs
+inspect_vars = False
 
-# Check out the long list of all variables available.
-pprint(ATL06_reader.vars.avail())
+if inspect_vars:
+    import icepyx as ipx
+    
+    # Create a reader object for accessing the files locally
+    ATL06_reader = ipx.Read(ATL06_path, # Path to data
+                            'ATL06', # product 
+                             pattern) # Pattern for file detection
+    
+    # Check out the long list of all variables available.
+    pprint(ATL06_reader.vars.avail())
 
 # %%%% * icepyx .load is meh...
 # Orginally tried icepyx load function, but it does not work. Left for reference. 
@@ -62,76 +74,109 @@ pprint(ATL06_reader.vars.avail())
 # Bootlegged this code from @jomey on github and adopted it for my own use and variables. 
 # https://github.com/ICESAT-2HackWeek/ICESat-2-Hackweek-2023/blob/main/book/tutorials/Hydrology/Hackweek.ipynb
 
-# This nested loop gets very slow if I crank up the dataset size, can I parallelize?
-# Might be a way to paralellize this with by turning it into a function
+# The old nested loop opened the next granule only after the previous one was 
+# converted and concatenated. Now a few reader threads prefetch granules while 
+# the DataFrames get built, and a writer thread appends them to the csv. 
+# See atl06_reader.py for the pieces.
 
 # Use the glob library to match all the file paths into a list. 
-file_list = glob.glob(os.path.join(ATL06_path, 'processed_ATL06*.h5'))
-
-# Subset each of the lasers as a group with associated variables. 
-file_list_subset = ['gt1l/land_ice_segments/', 'gt1r/land_ice_segments/',
-                    'gt2l/land_ice_segments/', 'gt2r/land_ice_segments/',
-                    'gt3l/land_ice_segments/', 'gt3r/land_ice_segments/']
-
-# Pull and combine relevant data. 
-for index, file_path in enumerate(file_list):
-    # Read the data for each file in the larger list. 
-    data = h5py.File(file_path, mode = 'r')
-    # enumerate will tell how far a long through the loop we are. 
-    print(f'File #{index +1}')
-    for subgroup in file_list_subset:
-        if subgroup in data:
-            # Extract the variables of interest from the data for each subgroup and file.
-            lat = data.get(os.path.join(subgroup, 'latitude'))
-            lon = data.get(os.path.join(subgroup, 'longitude'))
-            height = data.get(os.path.join(subgroup, 'h_li'))
-            delta_time = data.get(os.path.join(subgroup, 'delta_time'))
-            
-            # Only keeps subgroups with data
-            if all(x is not None for x in [lat, lon, height, delta_time]):
-                df = pd.DataFrame(data ={
-                    'lat': lat[:],
-                    'lon': lon[:],
-                    'height': height[:],
-                    'delta_time': delta_time[:]})
-                # Designate the laser number
-                df['laser_id'] = subgroup[:5]
-                # Concat the new data frames
-                if 'combined_data' not in locals():
-                    combined_data = df
-                else:
-                    combined_data = pd.concat([combined_data, df])    
-    # Close the files
-    data.close()
-
-# Clean up the environment
-del(data, df, lat, lon, delta_time, height, file_list_subset, file_list, pattern, subgroup, 
-    ATL06_path, ATL06_reader, index)
-    
+file_list = sorted(glob.glob(os.path.join(ATL06_path, 'processed_ATL06*.h5')))
+
+# %%% 2.3 Pick the project CRS and project the points once
+
+# x/y in the project CRS and x_web/y_web in EPSG:3857 get added to every row 
+# here, so stage 3 and the QGIS exports never reproject the points again. 
+# The CRS comes from the study bounds (projection.pick_crs) unless crs_proj is 
+# given, and goes to data_intermediate/projection.json for the later stages.
+params = stage_params({'ingest_atl03': False, 'bin_m': 5.0, 'crs_proj': None,
+                       'quality_filter': True, 'max_sigma': None, 'z_max': 10000})
+
+crs_proj = params['crs_proj']
+if crs_proj is None:
+    import fiona
+    import geopandas as gpd
+    fiona.drvsupport.supported_drivers['LIBKML'] = 'r'
+    crs_proj = projection.pick_crs(*gpd.read_file(data_raw + 'study_bounds.kml').total_bounds)
+projection.save_crs(data_intermediate, crs_proj)
+print(f'Project CRS: {crs_proj}')
 
 # %% 3. Write a .csv
 # ----------------------------------------------------------------------------
 # ============================================================================
 
-combined_data.to_csv(data_intermediate + 'IceSat2_Dataframe_v1.csv')
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+# Run report with time/memory per stage goes to data_intermediate/run_reports/
+metrics = stage_metrics.RunReport('stage2', report_dir = data_intermediate + 'run_reports/')
+
+# Segments with a quality flag, fill values or h_li >= z_max (the junk 4.2 used 
+# to drop only after the join) are rejected here, before any rows are built. 
+# Set quality_filter False to keep everything.
+# !!! max_sigma (m) also drops segments with a large h_li_sigma, off by default
+quality = None
+if params['quality_filter']:
+    quality = {'max_sigma': params['max_sigma'], 'z_max': params['z_max']}
+# Stage 3 cuts the joined points (and ATL03 bins) at the same z_max
+atl06_reader.save_settings(data_intermediate, params['z_max'], params['quality_filter'],
+                           params['max_sigma'])
+
+# !!! prefetch bounds how many granules sit in memory at once
+# Reading, building and writing overlap, so hdf5_read covers all three and 
+# dataframe_build is the conversion share of it.
+with metrics.stage('hdf5_read', rows_in = len(file_list)) as m:
+    n_files, n_rows = atl06_reader.granules_to_csv(file_list, 
+                                                   data_intermediate + 'IceSat2_Dataframe_v1.csv',
+                                                   n_readers = 4,
+                                                   prefetch = 8,
+                                                   metrics = metrics,
+                                                   projections = projection.ingest_targets(crs_proj),
+                                                   quality = quality)
+    for file_path in file_list:
+        m.add_file_read(file_path)
+    m.add_file_written(data_intermediate + 'IceSat2_Dataframe_v1.csv')
+    m.rows_out = n_rows
+print(f'{n_files} granules, {n_rows} segments written')
+
+if quality is not None:
+    # Rejections per beam and rule, written next to the run reports. Segments
+    # from older granules without the quality variables show up under
+    # missing_quality_vars (kept, only the fill/z_max rules applied).
+    Rejections = pd.DataFrame.from_dict(quality['rejections'], orient = 'index').fillna(0).astype(int)
+    pprint(Rejections)
+    os.makedirs(data_intermediate + 'run_reports/', exist_ok = True)
+    Rejections.to_csv(data_intermediate + 'run_reports/stage2_rejections.csv', index_label = 'beam')
+
+# %% 4. ATL03 photons binned per lake (optional)
+# ----------------------------------------------------------------------------
+# ============================================================================
 
+# Photons are streamed per beam in chunks, only the ones inside a GSWO lake 
+# are kept and they're averaged into short along-track bins right away. 
+# The csv has the ATL06 columns (lat, lon, height, delta_time, laser_id, rgt, 
+# cycle) plus n_photons, h_std and area_rank_id. Stage 3 adds the bins to the 
+# GSWO points (source = 'ATL03') whenever this csv is there.
+if params['ingest_atl03']:
+    import lake_layers
+    import atl03_reader
+
+    ATL03_file_list = sorted(glob.glob(os.path.join(data_raw, 'ATL03', 'processed_ATL03*.h5')))
+    cache = lake_layers.LayerCache(data_intermediate + 'lake_cache/')
+    GSWO_src = data_raw + 'GSWO_raw_lakes.shp'
+    LakesGSWO, _ = cache.get('LakesGSWO', [GSWO_src], {'crs': crs_proj},
+                             lake_layers.prepare_gswo, GSWO_src, crs_proj)
+
+    with metrics.stage('atl03_bins', rows_in = len(ATL03_file_list)) as m:
+        n_files, n_bins = atl03_reader.granules_to_csv(ATL03_file_list,
+                                                       data_intermediate + 'IceSat2_ATL03_bins_v1.csv',
+                                                       LakesGSWO, 'area_rank_id',
+                                                       bin_m = params['bin_m'],
+                                                       projections = projection.ingest_targets(crs_proj))
+        m.rows_out = n_bins
+    print(f'{n_files} ATL03 granules, {n_bins} lake bins written')
+    del(LakesGSWO, ATL03_file_list)
+elif os.path.exists(data_intermediate + 'IceSat2_ATL03_bins_v1.csv'):
+    # Left over from an earlier run with ATL03 on, stage 3 would still use it
+    os.remove(data_intermediate + 'IceSat2_ATL03_bins_v1.csv')
+
+metrics.write()
 
-                
\ No newline at end of file
+# Clean up the environment
+del(file_list, pattern, ATL06_path)
@@ -10,149 +10,69 @@ Created on Wed Nov  8 08:56:33 2023
 # ----------------------------------------------------------------------------
 # ============================================================================
 
-import geopandas as gpd
-import pandas as pd
-import fiona
-import shapely
 import matplotlib.pyplot as plt
+import os
+
+import lake_join
+import projection
+from run_pipeline import stage_params
+import stage_metrics
 
 # !!! Change this line for different local machines
-working_dir = '/Users/jmaze/Documents/projects/IceSat2-Lakes'
+# run_pipeline.py sets ICESAT2_LAKES_DIR, otherwise the path below is used
+working_dir = os.environ.get('ICESAT2_LAKES_DIR', '/Users/jmaze/Documents/projects/IceSat2-Lakes')
 
 # Subfolders
 data_raw = working_dir + '/data_raw/'
 data_intermediate = working_dir + '/data_intermediate/'
 data_output = working_dir + '/data_output/'
 
-# Define CRS for project 
-crs_proj = 'EPSG:32624'
-
-# %% 2. Import Lakes data and filter based IceSat2 bouding box
-# ----------------------------------------------------------------------------
-# ============================================================================
-
-# %%% 2.1 Import the Lakes
-LakesIIML = gpd.read_file(data_raw + 'IIML_raw_lakes2017.shp')
-
-LakesGSWO = gpd.read_file(data_raw + 'GSWO_raw_lakes.shp')
-
-# %%%% 2.1.1 Reformat GSWE Lakes
-
-# Assinging CRS from documentation and reproject
-crs_LakesGSWO = 'EPSG:4326'
-LakesGSWO = LakesGSWO.set_crs(crs = crs_LakesGSWO)
-LakesGSWO = LakesGSWO.to_crs(crs = crs_proj)
-                             
-# Make a new area column old one was in decimal degrees
-LakesGSWO['area_m2'] = LakesGSWO.geometry.area
-
-# Make a id column from ranking lake area
-LakesGSWO['area_rank_id'] = LakesGSWO['area_m2'].rank(method = 'first', ascending = False).astype(int)
-LakesGSWO['area_rank_id'] = 'ID_' + LakesGSWO['area_rank_id'].astype(str)
-
-# Drop the original degrees area column
-LakesGSWO = LakesGSWO.drop(columns = 'area')
-
-# %%%% 2.1.2 Reformat the IIML lakes
+# Define CRS for project, picked in stage 2 from the study bounds (UTM 24N
+# before that). xy_crs is what stage 2 wrote the x/y columns in, if crs_proj
+# gets set to something else here the points are projected from lat/lon.
+crs_proj = projection.load_crs(data_intermediate)
+xy_crs = projection.load_xy_crs(data_intermediate)
 
-# Designate the crs for LakesIIML
-LakesIIML = LakesIIML.set_crs(crs = crs_proj)
-LakesIIML = LakesIIML.drop(columns = ['LakeName', 'Source', 'NumOfSate', 'Certainty', 'Satellites'])
-LakesIIML.rename(columns = {'Area':'area_m2', 'Length':'length_m', 'LakeID':'lake_id'}, inplace = True)
+# run_pipeline.py runs this once per layer (merge_GSWO, merge_IIML), by hand
+# it does both
+params = stage_params({'layers': ['GSWO', 'IIML'], 'chunk_size': 1_000_000})
+layers = params['layers']
 
-# %%% 2.2 Write the reformatted lake files to output
-LakesGSWO.to_file(data_intermediate + 'LakesGSWO_v2.shp', index = False)
-LakesIIML.to_file(data_intermediate + 'LakesIIML_v2.shp', index = False)
+# Time/memory per stage, written to data_intermediate/run_reports/ at the end
+metrics = stage_metrics.RunReport('stage3_' + '_'.join(layers), 
+                                  report_dir = data_intermediate + 'run_reports/')
 
-# %%% 2.3 Import the project boundary
-
-# Have to modify the supported drivers for GeoPandas to read ('r') .kml files
-# !!! Read this line for MacOS
-# gpd.io.file.fiona.drvsupport.supported_drivers['LIBKML'] = 'r'
-# !!! read this line for Windows
-fiona.drvsupport.supported_drivers['LIBKML'] = 'r'
-
-# Study bounds came from going to Google Earth and drawing an arbitrary box
-bound_box = gpd.read_file(data_raw + 'study_bounds.kml')
-
-# Bound box was imported with EPSG:4326, need to reassign
-bound_box = bound_box.to_crs(crs = crs_proj)
-bound_box = bound_box['geometry']
-
-# %%% 2.4 Filter the lakes dataset based on the project boundary
-
-# Using using the geopandas.clip(), documentation is incorrect online
-LakesIIML = gpd.clip(LakesIIML, bound_box)
-LakesGSWO = gpd.clip(LakesGSWO, bound_box)
-
-# Check out the area distribution of different lake datasets
-# IIML lakes
-plt.hist(LakesIIML['area_m2'], bins = 50)
-plt.show()
-
-# GSWE lakes
-plt.hist(LakesGSWO['area_m2'], bins = 50)
-plt.show()
-
-# %% 3. Import the IceSat2 data & make them gpd object
+# %% 2. Lakes, IceSat2 points and the spatial join
 # ----------------------------------------------------------------------------
 # ============================================================================
 
-# Read the IceSat2 data
-IceSat = pd.read_csv(data_intermediate + 'IceSat2_DataFrame_v1.csv')
-
-# Convert the dataframes lat and long to a GDF with point geometry. 
-geometry = [shapely.Point(lon, lat) for lon, lat in zip(IceSat['lon'], IceSat['lat'])]
-IceSatPts = gpd.GeoDataFrame(IceSat, geometry = geometry)
-
-# Reproject the icesat data to match the gr_lakes
-IceSatPts = IceSatPts.set_crs(crs = 'EPSG:4326')
-IceSatPts = IceSatPts.to_crs(crs = crs_proj)
-     
-        
-# %% 4. Spatial join the IceSat2 data to the GR lakes
+# The whole stage lives in lake_join.join_layers(), `cli.py join` runs the 
+# same thing. Per layer it:
+#   - prepares the lakes (crs, area_m2, area_rank_id, dropped cols, see 
+#     lake_layers.py), cached by source files + crs, and writes Lakes*_v2.shp
+#   - clips them to study_bounds.kml (cached too)
+#   - joins the IceSat2 points chunk by chunk, eliminating points that don't 
+#     fall within a lake. The lake-year stats (and the GSWO quantile sketches 
+#     per lake-year-date) are accumulated as each chunk gets labelled, heights
+#     at or above stage 2's z_max (ingest_settings.json) left out.
+#   - adds stage 2's ATL03 lake bins to GSWO (source column) when present
+#   - writes ICESat2_pts_*.shp and the stats/sketch pickles 4.2 reads
+# Points are joined in chunks of chunk_size.
+Layers = lake_join.join_layers(data_raw, data_intermediate, 
+                               layers = layers,
+                               crs_proj = crs_proj,
+                               xy_crs = xy_crs,
+                               chunk_size = params['chunk_size'],
+                               metrics = metrics)
+
+# %% 3. Check out the area distribution of different lake datasets
 # ----------------------------------------------------------------------------
 # ============================================================================
-        
-# Spatially join the IceSat points to the IMLL lakes
-IceSatJoinedIIML = gpd.sjoin(IceSatPts, 
-                             LakesIIML, # Elimnates Icesat points that don't fall within a lake. 
-                             how = 'inner', # Eliminates IceSat points not matched with a Lake
-                             op = 'within') # Icesat points need to be inside a lake
-
-#Spatially join the IceSat points to the GSWO lakes
-IceSatJoinedGSWO = gpd.sjoin(IceSatPts, 
-                             LakesGSWO, 
-                              how = 'inner',
-                              op = 'within')
-
-# Reformat the columns for IIML
-IceSatJoinedIIML = IceSatJoinedIIML.drop(columns = ['index_right', 'Unnamed: 0', 'lat', 'lon'])
-
-# Reformat the columns for GSWE
-IceSatJoinedGSWO.drop(columns = ['Unnamed: 0', 'lat', 'lon', 'index_right'], inplace = True)
-
-# %% 5. Write the files to intermediate folder
-# ----------------------------------------------------------------------------
-# ============================================================================
-
-# Write the spatially joined file to output
-IceSatJoinedIIML.to_file(data_intermediate + 'ICESat2_pts_IIML.shp', index = False) 
-                                       
-# Write the spatially joined file to output
-IceSatJoinedGSWO.to_file(data_intermediate + 'ICESat2_pts_GSWO.shp', index = False) 
-
-
-
-
-
-
-
-
-
-
-
-
-
 
+# IIML and GSWE lakes
+for name, (Lakes, IceSatJoined) in Layers.items():
+    plt.hist(Lakes['area_m2'], bins = 50)
+    plt.title(f'{name} lakes')
+    plt.show()
 
+metrics.write()
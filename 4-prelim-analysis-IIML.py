@@ -11,13 +11,15 @@ Created on Sun Nov 12 16:34:39 2023
 # ============================================================================
 
 import geopandas as gpd
+import os
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
 import datetime as dt
 
 # !!! Change this for different local machines
-working_dir = '/Users/jmaze/Documents/projects/IceSat2-Lakes'
+# run_pipeline.py sets ICESAT2_LAKES_DIR, otherwise the path below is used
+working_dir = os.environ.get('ICESAT2_LAKES_DIR', '/Users/jmaze/Documents/projects/IceSat2-Lakes')
 data_output = working_dir + '/data_output/'
 data_raw = working_dir + '/data_raw/'
 
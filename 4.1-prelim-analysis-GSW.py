@@ -11,13 +11,19 @@ Created on Sun Nov 12 16:34:39 2023
 # ============================================================================
 
 import geopandas as gpd
+import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime as dt
 import seaborn as sns
 
+import lake_maps
+import projection
+import robust_sweep
+
 # !!! Change this for different local machines
-working_dir = '/Users/jmaze/Documents/projects/IceSat2-Lakes'
+# run_pipeline.py sets ICESAT2_LAKES_DIR, otherwise the path below is used
+working_dir = os.environ.get('ICESAT2_LAKES_DIR', '/Users/jmaze/Documents/projects/IceSat2-Lakes')
 data_output = working_dir + '/data_output/'
 data_raw = working_dir + '/data_raw/'
 
@@ -125,6 +131,16 @@ summary1_robust = summary1.query('lake_height_std < 30 & lake_observation_count
 # Make a is_robust column for summary1
 summary1['is_robust'] = summary1['area_rank_id'].isin(summary1_robust['area_rank_id'])
 
+# Same cut-offs over a grid, to see how sensitive the robust set is to them
+threshold_grid = {'lake_height_std': ('<', [10, 20, 30, 50, 100]),
+                  'lake_observation_count': ('>', [25, 50, 100, 200, 500]),
+                  'unique_dates_count': ('>', [2, 4, 6, 8, 12])}
+threshold_sweep = robust_sweep.sweep_thresholds(summary1, threshold_grid, 
+                                                count_col = 'lake_observation_count',
+                                                std_col = 'lake_height_std', 
+                                                mean_col = 'lake_height_mean')
+threshold_sweep.to_csv(data_output + 'GSW_threshold_sweep.csv', index = False)
+
 # %%% 2.6 Visualize summary stats for 'robust' and original datasets
 
 # Relationship between observation count and height_std?
@@ -260,18 +276,9 @@ points = robust_lake_pts.query("area_rank_id == 'ID_1174'")
 obs_dates = points['lake_obs_dates'].iloc[0]
 marker_styles = ['o', 's', '^', 'D', 'v', 'p', '>', '<', '*', 'h', '+', 'x']
 
-for i, date in enumerate(obs_dates):
-    date_pts = points[points['obs_date'] == date] 
-    plt.scatter(
-        points['geometry'].x,
-        points['geometry'].y,
-        c = points['height'],
-        cmap = 'seismic', 
-        label = f'Obs Date: {date}',
-        marker = marker_styles[i % len(marker_styles)]
-                )
-plt.legend(bbox_to_anchor = (1.05, 1), loc = 'upper left')    
-plt.colorbar(label = 'Elevation_m')
+# Each date drawn once (this used to draw every point for every date), dense 
+# dates get averaged into 2 pixel cells
+lake_maps.plot_lake_map(points, 'height', dates = obs_dates, markers = marker_styles)
 
 plt.show()
 
@@ -284,7 +291,8 @@ plt.show()
 qgis_lakes_out = gsw_lakes[gsw_lakes['area_rank_'].isin(summary1_robust['area_rank_id'])]
 qgis_lakes_out = qgis_lakes_out.to_crs('EPSG:3857')
 
-qgis_points_out = robust_lake_pts.to_crs('EPSG:3857')
+# Uses x_web/y_web from ingest when the points have them
+qgis_points_out = projection.to_web(robust_lake_pts)
 qgis_points_out['obs_date'] = qgis_points_out['obs_date'].astype(str)
 qgis_points_out = qgis_points_out.drop(columns = ['lake_obs_dates'])
 
@@ -15,13 +15,37 @@ import geopandas as gpd
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime as dt
+import glob
 import seaborn as sns
+import os
+
+import dem_sampler
+import lake_maps
+import lake_series
+import lake_stats
+import outlier_filter
+import projection
+import quantile_sketch
+import repeat_tracks
+import robust_sweep
+import shoreline
+import snow_bootstrap
+import stage_metrics
+import vector_tiles
+from run_pipeline import stage_params
 
 # !!! Change this for different local machines
-working_dir = '/Users/jtmaz/Documents/projects/IceSat2-Lakes'
+# run_pipeline.py sets ICESAT2_LAKES_DIR, otherwise the path below is used
+working_dir = os.environ.get('ICESAT2_LAKES_DIR', '/Users/jtmaz/Documents/projects/IceSat2-Lakes')
 data_output = working_dir + '/data_output/'
 data_intermediate = working_dir + '/data_intermediate/'
 
+# Switches run_pipeline.py can override, e.g. analysis_GSWO.interior_only=true
+params = stage_params({'use_robust_filter': False, 'interior_only': False, 'dem_glob': None})
+
+# Time/memory per stage, written to data_output/run_reports/ at the end
+metrics = stage_metrics.RunReport('analysis_GSWO', report_dir = data_output + 'run_reports/')
+
 # %% 2. Read IceSatPts and LakesGSWO
 # ----------------------------------------------------------------------------
 # ============================================================================
@@ -30,7 +54,7 @@ data_intermediate = working_dir + '/data_intermediate/'
 LakesGSWO = gpd.read_file(data_intermediate + 'LakesGSWO_v2.shp')
 
 # Read the IceSat-2 points associated with GSWO lakes
-IceSatPts = gpd.read_file(data_intermediate + 'IceSat2_pts_GSWO.shp')
+IceSatPts = gpd.read_file(data_intermediate + 'ICESat2_pts_GSWO.shp')
 
 # Since shapefile format truncates at 10 characters, rename the column. 
 # Also calling height 'z'
@@ -63,6 +87,7 @@ def calendar_from_delta (delta_time):
 
 
 # Run the function on the DataFrame. 
+metrics.start('temporal_annotation', rows_in = len(IceSatPts))
 IceSatPts = IceSatPts.assign(obs_date = IceSatPts['delta_time'].apply(calendar_from_delta))
 
 # %%% 3.2 Create a wtr_yr from obs_date
@@ -79,6 +104,21 @@ def wtr_yr_from_calendar (obs_date):
 
 # Run the function
 IceSatPts = IceSatPts.assign(wtr_yr = IceSatPts['obs_date'].apply(wtr_yr_from_calendar))
+metrics.stop('temporal_annotation', rows_out = len(IceSatPts))
+
+# %%% 3.3 Distance to shore and interior-only filter
+
+# Segments near the lake edge pick up shoreline terrain, flag them by their 
+# distance to their own lake's exterior.
+IceSatPts['shore_dist_m'] = shoreline.distance_to_shore(IceSatPts, LakesGSWO, 
+                                                        lake_col = 'area_rank_id')
+IceSatPts['is_interior'] = shoreline.edge_flags(IceSatPts['shore_dist_m'], min_dist = 30.0)
+
+# !!! Set True to drop the edge points. Off by default, the published lake-year
+# numbers include them and turning this on changes every summary below.
+interior_only = params['interior_only']
+if interior_only:
+    IceSatPts = IceSatPts[IceSatPts['is_interior']].copy()
 
 # %% 4. Group by area_rank_id and wtr_yr
 # ----------------------------------------------------------------------------
@@ -88,25 +128,72 @@ IceSatPts = IceSatPts.assign(wtr_yr = IceSatPts['obs_date'].apply(wtr_yr_from_ca
 # plt.xscale('log')
 # plt.show()
 
-# Remove the worst IceSat2 points there's pts with elevation above Greenland's 
-# maximum, almost 170,239 of these.
-n = len(IceSatPts.query('z > 10000'))
-del(n)
-IceSatPts.query('z < 10000', inplace = True)
-
-Summary = IceSatPts.groupby(['area_rank_id', 'wtr_yr'], as_index = False).agg(
-    z_mean = ('z', 'mean'),
-    z_std = ('z', 'std'),
-    obs_count = ('z', 'count'),
-    area_m2 = ('area_m2', 'first'),
-    obs_dates_list = ('obs_date', lambda x: x.unique().astype(str).tolist()),
-    obs_date_unique = ('obs_date', lambda x: len(x.unique().astype(str).tolist()))
-    )
+metrics.start('summary', rows_in = len(IceSatPts))
+
+# !!! Robust filter per lake-year/lake-date instead of the global z < 10000 
+# cut. Off by default like interior_only: it changes every summary below and 
+# skips the lake-year stats and sketches stage 3 accumulated.
+use_robust_filter = params['use_robust_filter']
+rejections_path = data_output + 'GSWO_outlier_rejections.csv'
+
+if use_robust_filter:
+    # Rules live in outlier_filter.DEFAULT_RULES, copy and tweak them to experiment
+    AllPts = IceSatPts
+    IceSatPts, RejectReason = outlier_filter.robust_filter(AllPts, outlier_filter.DEFAULT_RULES)
+    print(outlier_filter.rejection_counts(RejectReason))
+    # Points kept and rejected per lake-year and rule, to audit the filter
+    outlier_filter.rejection_table(AllPts, RejectReason, ['area_rank_id', 'wtr_yr']).to_csv(
+        rejections_path, index = False)
+    del(AllPts, RejectReason)
+    
+    # Means/stds from the filtered points, outliers no longer skew them
+    StatsGSWO = lake_stats.LakeYearStats(keys = ('area_rank_id', 'wtr_yr'), value = 'z')
+    Summary = StatsGSWO.update(IceSatPts).summary()
+    del(StatsGSWO)
+else:
+    # Remove the worst IceSat2 points there's pts with elevation above Greenland's 
+    # maximum, almost 170,239 of these.
+    IceSatPts.query('z < 10000', inplace = True)
+    # Left over from a run with the filter on, it would describe other numbers
+    if os.path.exists(rejections_path):
+        os.remove(rejections_path)
+    
+    # Stage 3 accumulates the lake-year stats while joining, use those if present.
+    # They come from every joined point, so not once the edge points are gone.
+    stats_path = data_intermediate + 'lake_year_stats_GSWO.pkl'
+    if not interior_only and os.path.exists(stats_path):
+        Summary = lake_stats.LakeYearStats.load(stats_path).summary()
+    else:
+        StatsGSWO = lake_stats.LakeYearStats(keys = ('area_rank_id', 'wtr_yr'), value = 'z')
+        Summary = StatsGSWO.update(IceSatPts).summary()
+        del(StatsGSWO)
+
+# Medians and IQRs next to the means/stds, from t-digest sketches. Stage 3 
+# builds them per lake-year-date during the join, roll those up to lake-years
+# (only when the points haven't been filtered since).
+sketch_path = data_intermediate + 'lake_date_sketches_GSWO.pkl'
+if not use_robust_filter and not interior_only and os.path.exists(sketch_path):
+    SketchGSWO = quantile_sketch.GroupSketches.load(sketch_path).rollup(['area_rank_id', 'wtr_yr'])
+else:
+    SketchGSWO = quantile_sketch.GroupSketches(keys = ('area_rank_id', 'wtr_yr'), value = 'z')
+    SketchGSWO.update(IceSatPts)
+Summary = Summary.merge(SketchGSWO.summary(), on = ['area_rank_id', 'wtr_yr'], how = 'left')
+del(SketchGSWO)
+
+metrics.stop('summary', rows_out = len(Summary))
 
 # %% 5. Visualize Summary Stats and Apply Thresholding
 # ----------------------------------------------------------------------------
 # ============================================================================
 
+# How much the cut-offs below matter: every combination of this grid checked 
+# in one vectorized pass. Retained lakes, points and spread per combination.
+threshold_grid = {'z_std': ('<', [10, 20, 30, 50, 75, 100]),
+                  'obs_count': ('>', [10, 25, 50, 100, 200]),
+                  'obs_date_unique': ('>', [1, 2, 3, 5, 8])}
+ThresholdSweep = robust_sweep.sweep_thresholds(Summary, threshold_grid)
+ThresholdSweep.to_csv(data_output + 'GSWO_threshold_sweep.csv', index = False)
+
 # Set thresholding to balance variability and amount of observations
 SummaryRobust = Summary.query('z_std < 50 & obs_count > 25 & obs_date_unique > 3')
 
@@ -135,16 +222,66 @@ del(is_robust, scatter)
 # ----------------------------------------------------------------------------
 # ============================================================================
 
+# area_m2 is already on the points, and the shapefile round trip can change its 
+# last digits, so don't join on it
 IceSatPtsRobust = pd.merge(IceSatPts, 
-                            SummaryRobust, 
+                            SummaryRobust.drop(columns = 'area_m2'), 
                             how = 'inner', 
-                            on = ['area_rank_id', 'wtr_yr', 'area_m2'])
+                            on = ['area_rank_id', 'wtr_yr'])
 
 # %%% 6.1 Make a difference from lake mean column to improve plotting
 
 # Create diff from mean column
 IceSatPtsRobust['z_diff_from_lake_mean'] = IceSatPtsRobust['z'] - IceSatPtsRobust['z_mean']
 
+# %%% 6.1.1 Reference DEM under every segment
+
+# !!! Point dem_glob at local DEM tiles, e.g. ArcticDEM mosaics:
+# analysis_GSWO.dem_glob=/path/to/arcticdem/*_dem.tif. Each raster block is 
+# read once for all the points on it. Adds dem_z and z_minus_dem.
+if params['dem_glob']:
+    metrics.start('dem_sampling', rows_in = len(IceSatPtsRobust))
+    dem_paths = sorted(glob.glob(params['dem_glob']))
+    IceSatPtsRobust = dem_sampler.add_dem_z(IceSatPtsRobust, dem_paths)
+    IceSatPtsRobust['z_minus_dem'] = IceSatPtsRobust['z'] - IceSatPtsRobust['dem_z']
+    metrics.stop('dem_sampling', rows_out = int(IceSatPtsRobust['dem_z'].notna().sum()))
+
+# %%% 6.2 Bootstrap frozen minus liquid surface change for every robust lake
+
+# Lake phase from the same month ranges as lake_phaser() in 4.1
+IceSatPtsRobust['lake_phase_est'] = lake_stats.lake_phase_from_date(IceSatPtsRobust['obs_date'])
+
+# Median frozen surface minus median liquid surface, per lake and water year. 
+# Resampling is spread across a process pool.
+SnowEstimates = snow_bootstrap.bootstrap_snow(IceSatPtsRobust, 
+                                              keys = ('area_rank_id', 'wtr_yr'),
+                                              n_boot = 1000, 
+                                              ci = 0.95)
+
+SnowEstimates.to_csv(data_output + 'GSWO_snow_bootstrap.csv', index = False)
+
+# %%% 6.3 Pair repeat-track segments between passes
+
+# Segments from different dates on the same RGT within 20 m along-track and 
+# 10 m cross-track of each other. dz is later minus earlier elevation.
+RepeatPairs = repeat_tracks.pair_repeat_tracks(IceSatPtsRobust, 
+                                               lake_col = 'area_rank_id',
+                                               max_along = 20.0,
+                                               max_cross = 10.0)
+
+RepeatPairs.to_csv(data_output + 'GSWO_repeat_track_pairs.csv', index = False)
+
+# %%% 6.4 Per-lake time series store
+
+# Every lake's passes (date + beam) reduced to count/mean/median/std, saved as 
+# arrays. Multi-year comparisons load this instead of the points, e.g. 
+# lake_series.LakeSeries.load(path).frozen_liquid_anomaly()
+SeriesGSWO = lake_series.LakeSeries.from_points(IceSatPtsRobust, lake_col = 'area_rank_id')
+SeriesGSWO.save(data_intermediate + 'GSWO_lake_series.npz')
+
+SeriesGSWO.year_over_year(phase = 'liquid').to_csv(data_output + 'GSWO_liquid_year_over_year.csv', 
+                                                   index = False)
+
 # %% 7. Subset IceSat2 Points for Plotting
 # ----------------------------------------------------------------------------
 # ============================================================================
@@ -164,6 +301,9 @@ SubsetPts = SubsetPts[SubsetPts['area_rank_id'].isin(shuffled_summary)]
 
 # %%% Manipulate data for plotting
 
+# Sections 8 to 10 are all timed as plotting
+metrics.start('plotting', rows_in = len(IceSatPtsRobust))
+
 # Eliminate outlier points for plot scales
 SubsetPts = SubsetPts.query('-5 < z_diff_from_lake_mean < 5').copy()
 
@@ -215,7 +355,7 @@ fig.colorbar(sm, cax=cax, orientation= 'vertical').set_ticks([])  # Add colorbar
 plt.show()
 
 # Clean up loose vars
-del(i, n, rows, cols, sm, SubsetPts, wy_end, wy_start, wy_total, lake_id, fig,
+del(i, rows, cols, sm, SubsetPts, wy_end, wy_start, wy_total, lake_id, fig,
     date_range, cax, DataPlot, shuffled_summary)
 
 # %% 9. Plot histograms for a single lake
@@ -243,28 +383,21 @@ lake_geometry = Lake['geometry'].iloc[0]
 Points = IceSatPtsRobust.query("area_rank_id == 'ID_230'")
 
 obs_dates = Points['obs_dates_list'].iloc[0]
-marker_styles = ['*', 's', '+', 'X', 'O']
+marker_styles = ['*', 's', '+', 'X', 'o']
 # Points = Points.query('obs_date == ""')
 
-for i, date in enumerate(obs_dates):
-    date_pts = Points[Points['obs_date'] == date] 
-    plt.scatter(
-        Points['geometry'].x,
-        Points['geometry'].y,
-        c = Points['z_diff_from_lake_mean'],
-        cmap = 'seismic',
-        label = f'Obs Date: {date}',
-        s = 5,
-        marker = marker_styles[i % len(marker_styles)])
-    plt.fill(lake_geometry.exterior.xy[0], lake_geometry.exterior.xy[1], 
-             facecolor='none', edgecolor='purple')
-plt.legend(bbox_to_anchor = (1.05, 1), loc = 'upper left')    
-plt.colorbar(label = 'Elevation_m')
+# Each date drawn once, dates with more than max_points get averaged into 
+# 2 pixel cells so dense tracks don't slow the map down
+lake_maps.plot_lake_map(Points, 'z_diff_from_lake_mean', dates = obs_dates,
+                        lake_geometry = lake_geometry, markers = marker_styles,
+                        max_points = 5000)
 
 plt.show()
 
 # Clean up variables
-del(Lake, Points, obs_dates, i, lake_geometry, date_pts, date)
+del(Lake, Points, obs_dates, lake_geometry)
+
+metrics.stop('plotting')
 
 # %% 11. Write robust lakes and points to output folder. 
 # ----------------------------------------------------------------------------
@@ -272,20 +405,42 @@ del(Lake, Points, obs_dates, i, lake_geometry, date_pts, date)
 
 # %%% Reproject and points and reformat cols to be shapefile compatible
 
+metrics.start('reproject', rows_in = len(IceSatPtsRobust))
+
 LakesOut = LakesGSWO[LakesGSWO['area_rank_id'].isin(SummaryRobust['area_rank_id'])]
 LakesOut = LakesOut.to_crs('EPSG:3857')
 
-PtsOut = IceSatPtsRobust.to_crs('EPSG:3857')
+# x_web/y_web were computed at ingest, no reprojection of the points here
+PtsOut = projection.to_web(IceSatPtsRobust)
+metrics.stop('reproject', rows_out = len(PtsOut))
 PtsOut['obs_date'] = PtsOut['obs_date'].astype(str)
 PtsOut = PtsOut.drop(columns = ['obs_dates_list'])
 
 # %%% Write to output directory
+m = metrics.start('write', rows_in = len(LakesOut) + len(PtsOut))
+
 LakesOut.to_file(data_output + 'GSWO_robust_lakes.shp',
                        index = False)
 
 PtsOut.to_file(data_output + 'GSWO_robust_points.shp',
                         index = False)
 
+# %%% Vector tiles for smooth panning in QGIS
+
+# Full res shapefiles get sluggish with millions of segments. The .mbtiles has 
+# simplified lakes and binned points at low zooms, every point when zoomed in.
+vector_tiles.export_mbtiles(LakesOut, PtsOut, data_output + 'GSWO_robust.mbtiles',
+                            lake_col = 'area_rank_id',
+                            value = 'z_diff_from_lake_mean',
+                            label = 'obs_date')
+
+m.add_file_written(data_output + 'GSWO_robust_lakes.shp')
+m.add_file_written(data_output + 'GSWO_robust_points.shp')
+m.add_file_written(data_output + 'GSWO_robust.mbtiles')
+metrics.stop('write')
+
+metrics.write()
+
 # %% ** Scratch work
 # ----------------------------------------------------------------------------
 # ============================================================================
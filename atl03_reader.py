@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ATL03 photon path alongside the ATL06 one. Photons are read per beam in
+chunks, everything outside a lake is thrown away right away, and what's left
+is averaged into short along-track bins. Only the bins are kept, the raw
+photons never sit in memory all at once.
+"""
+
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+import atl06_reader
+import projection
+
+beams = atl06_reader.beams
+
+# signal_conf_ph has one column per surface type:
+# 0 land, 1 ocean, 2 sea ice, 3 land ice, 4 inland water
+inland_water = 4
+
+# Variables to order in stage 1 for this path
+ATL03_vars = ['lat_ph', 'lon_ph', 'h_ph', 'delta_time', 'signal_conf_ph', 'dist_ph_along',
+              'segment_dist_x', 'ph_index_beg', 'segment_ph_cnt']
+
+# %% 1. Lakes lookup
+
+
+class LakeIndex:
+
+    # Spatial index over one lake layer, used to drop photons outside lakes
+    def __init__ (self, lakes, lake_col):
+        self.crs = lakes.crs
+        self.geoms = np.asarray(lakes.geometry)
+        self.ids = lakes[lake_col].to_numpy()
+        self.tree = shapely.STRtree(self.geoms)
+        self.bounds = lakes.total_bounds
+        self.to_proj = Transformer.from_crs('EPSG:4326', self.crs, always_xy = True)
+
+    def locate (self, lon, lat):
+        # Returns (photon index, lake id, x, y) for photons inside a lake
+        x, y = self.to_proj.transform(lon, lat)
+        minx, miny, maxx, maxy = self.bounds
+        # Cheap box test first, most of a track is nowhere near a lake
+        near = np.flatnonzero((x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy))
+        if len(near) == 0:
+            empty = np.array([], dtype = np.int64)
+            return(empty, self.ids[:0], x[:0], y[:0])
+        pt_idx, lake_idx = self.tree.query(shapely.points(x[near], y[near]), predicate = 'within')
+        # A photon in overlapping lakes is kept once
+        pt_idx, first = np.unique(pt_idx, return_index = True)
+        lake_idx = lake_idx[first]
+        photon = near[pt_idx]
+
+        return(photon, self.ids[lake_idx], x[photon], y[photon])
+
+# %% 2. Streaming one beam
+
+
+def _segment_starts (geo):
+    # Each ~20 m geolocation segment knows its along-track distance and the
+    # (1-based) index of its first photon. These are small, read them once.
+    has = geo['segment_ph_cnt'][:] > 0
+
+    return(geo['ph_index_beg'][:][has] - 1, geo['segment_dist_x'][:][has])
+
+
+def _photon_along_track (ph_beg, seg_x, photon):
+    # Along-track distance of the segment each photon belongs to
+    seg = np.searchsorted(ph_beg, photon, side = 'right') - 1
+
+    return(seg_x[np.clip(seg, 0, len(seg_x) - 1)])
+
+
+def stream_beam (heights, geo, index, bin_m = 5.0, chunk = 2_000_000,
+                 min_conf = 3, conf_type = inland_water):
+    # Yields partial bin sums for one beam, one chunk of photons at a time
+    n_photons = heights['h_ph'].shape[0]
+    ph_beg, seg_x = _segment_starts(geo)
+    for start in range(0, n_photons, chunk):
+        stop = min(start + chunk, n_photons)
+        conf = heights['signal_conf_ph'][start:stop, conf_type]
+        good = np.flatnonzero(conf >= min_conf)
+        if len(good) == 0:
+            continue
+        lon = heights['lon_ph'][start:stop][good]
+        lat = heights['lat_ph'][start:stop][good]
+        photon, lake_id, _, _ = index.locate(lon, lat)
+        if len(photon) == 0:
+            continue
+        keep = good[photon]
+        h = heights['h_ph'][start:stop][keep].astype('float64')
+        t = heights['delta_time'][start:stop][keep]
+        along = (_photon_along_track(ph_beg, seg_x, start + keep)
+                 + heights['dist_ph_along'][start:stop][keep])
+
+        # Sums so bins split across chunks can simply be added up later
+        part = pd.DataFrame({'lake': lake_id, 'bin': np.floor(along / bin_m).astype(np.int64),
+                             'n': 1, 'h': h, 'h2': h * h, 't': t,
+                             'lon': lon[photon], 'lat': lat[photon]})
+        yield(part.groupby(['lake', 'bin'], sort = False).sum())
+
+
+def _finish_bins (parts, min_photons):
+    sums = pd.concat(parts).groupby(level = ['lake', 'bin']).sum()
+    sums = sums[sums['n'] >= min_photons]
+    n = sums['n']
+    bins = pd.DataFrame({'lat': sums['lat'] / n, 'lon': sums['lon'] / n,
+                         'height': sums['h'] / n,
+                         'delta_time': sums['t'] / n,
+                         'h_std': np.sqrt(np.maximum(sums['h2'] / n - (sums['h'] / n) ** 2, 0)),
+                         'n_photons': n.astype(np.int64)})
+
+    return(bins.reset_index())
+
+# %% 3. Granules
+
+
+def bin_granule (file_path, index, bin_m = 5.0, chunk = 2_000_000, min_conf = 3,
+                 min_photons = 5):
+    # One DataFrame of lake bins for a whole ATL03 granule, with the same
+    # columns as the ATL06 rows plus n_photons, h_std and the lake id
+    rgt, cycle = atl06_reader.granule_tracks(file_path)
+    frames = []
+    with h5py.File(file_path, mode = 'r') as data:
+        for beam in beams:
+            heights = data.get(f'{beam}/heights')
+            geo = data.get(f'{beam}/geolocation')
+            if heights is None or geo is None:
+                continue
+            parts = list(stream_beam(heights, geo, index, bin_m, chunk, min_conf))
+            if not parts:
+                continue
+            bins = _finish_bins(parts, min_photons)
+            bins['laser_id'] = beam + '/'
+            bins['rgt'] = rgt
+            bins['cycle'] = cycle
+            frames.append(bins)
+
+    if not frames:
+        return(None)
+
+    return(pd.concat(frames, ignore_index = True))
+
+
+def granules_to_csv (file_list, out_path, lakes, lake_col, bin_m = 5.0, chunk = 2_000_000,
+                     min_conf = 3, min_photons = 5, progress = True, projections = None):
+    # Same csv writer as the ATL06 path, one granule's bins at a time
+    index = LakeIndex(lakes, lake_col)
+    writer = atl06_reader.CsvWriter(out_path)
+    n_files = 0
+    try:
+        for i, file_path in enumerate(file_list):
+            if progress:
+                print(f'ATL03 file #{i +1}: {os.path.basename(file_path)}')
+            bins = bin_granule(file_path, index, bin_m, chunk, min_conf, min_photons)
+            if bins is not None:
+                if projections:
+                    projection.add_projected(bins, projections)
+                writer.write(bins.rename(columns = {'lake': lake_col}))
+            n_files += 1
+    except BaseException:
+        # Same as the ATL06 path, the original error is the one raised
+        try:
+            writer.close()
+        except Exception:
+            pass
+        raise
+    rows = writer.close()
+
+    return(n_files, rows)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ATL06 granule reading for stage 2. Granules are read by a small pool of
+threads a few files ahead of the conversion, and the csv is written by its
+own thread, so disk/network and CPU are busy at the same time.
+"""
+
+import io
+import json
+import os
+import queue
+import threading
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+import pandas as pd
+
+import projection
+
+# Subset each of the lasers as a group with associated variables.
+beams = ['gt1l', 'gt1r', 'gt2l', 'gt2r', 'gt3l', 'gt3r']
+variables = ['latitude', 'longitude', 'h_li', 'delta_time']
+# Read as well when quality filtering, used only if the granule has them
+quality_variables = ['atl06_quality_summary', 'h_li_sigma']
+
+# h_li, h_li_sigma etc. are float32 with _FillValue 3.4028235e+38
+fill_threshold = 1e38
+
+# Ingest settings later stages need (z_max), next to projection.json
+settings_file = 'ingest_settings.json'
+
+# %% 1. Reading one granule
+
+
+def granule_tracks (file_path):
+    # RGT and cycle from the file name
+    track_block = os.path.basename(file_path).split('_')[3]
+
+    return(track_block[0:4], track_block[4:6])
+
+
+def read_granule (file_path, in_memory = True, quality = False):
+    # Returns {beam: {variable: array}} for every beam that has all variables,
+    # plus whichever quality_variables exist when quality is on.
+    # in_memory pulls the whole file in one read() first. That read releases
+    # the GIL, so several readers can wait on network storage at once, while
+    # h5py itself only works on one file at a time. The cost is that the
+    # whole file sits in memory until its arrays are pulled out.
+    if in_memory:
+        with open(file_path, 'rb') as f:
+            source = io.BytesIO(f.read())
+    else:
+        source = file_path
+
+    arrays = {}
+    with h5py.File(source, mode = 'r') as data:
+        for beam in beams:
+            group = data.get(f'{beam}/land_ice_segments')
+            # Only keeps subgroups with data
+            if group is None or not all(v in group for v in variables):
+                continue
+            arrays[beam] = {v: group[v][:] for v in variables}
+            if quality:
+                arrays[beam].update({v: group[v][:] for v in quality_variables if v in group})
+
+    return(arrays)
+
+
+def segment_mask (beam_arrays, max_sigma = None, z_max = None):
+    # Vectorized keep mask for one beam, and how many segments each rule
+    # rejected (a segment counts under the first rule that catches it).
+    # Older granules lack some quality_variables, their rules can't run, so
+    # those segments are kept and counted under 'missing_quality_vars'.
+    h_li = beam_arrays['h_li']
+    rules = [('fill', ~np.isfinite(h_li) | (np.abs(h_li) >= fill_threshold))]
+    if 'atl06_quality_summary' in beam_arrays:
+        # 0 is best quality, anything else is flagged
+        rules.append(('quality_flag', beam_arrays['atl06_quality_summary'] != 0))
+    if 'h_li_sigma' in beam_arrays:
+        sigma = beam_arrays['h_li_sigma']
+        bad_sigma = ~np.isfinite(sigma) | (sigma >= fill_threshold)
+        if max_sigma is not None:
+            bad_sigma |= sigma > max_sigma
+        rules.append(('sigma', bad_sigma))
+    if z_max is not None:
+        rules.append(('z_max', h_li >= z_max))
+
+    keep = np.ones(len(h_li), dtype = bool)
+    counts = {}
+    for name, reject in rules:
+        counts[name] = int(np.count_nonzero(reject & keep))
+        keep &= ~reject
+    if not all(v in beam_arrays for v in quality_variables):
+        counts['missing_quality_vars'] = len(h_li)
+
+    return(keep, counts)
+
+
+def granule_frame (file_path, arrays, max_sigma = None, z_max = None, rejections = None):
+    # Turn one granule's beam arrays into a single DataFrame. If arrays came
+    # from read_granule(quality = True) or rejections is given, flagged and
+    # fill-value segments are dropped before any rows are built, and the
+    # counts per beam and rule are added to rejections.
+    rgt, cycle = granule_tracks(file_path)
+    frames = []
+    for beam, beam_arrays in arrays.items():
+        filtering = rejections is not None or any(v in beam_arrays for v in quality_variables)
+        if filtering:
+            keep, counts = segment_mask(beam_arrays, max_sigma, z_max)
+            if rejections is not None:
+                beam_counts = rejections.setdefault(beam, {'read': 0})
+                beam_counts['read'] += len(keep)
+                for name, n in counts.items():
+                    beam_counts[name] = beam_counts.get(name, 0) + n
+            beam_arrays = {k: v[keep] for k, v in beam_arrays.items()}
+        df = pd.DataFrame(data = {
+            'lat': beam_arrays['latitude'],
+            'lon': beam_arrays['longitude'],
+            'height': beam_arrays['h_li'],
+            'delta_time': beam_arrays['delta_time']})
+        if 'h_li_sigma' in beam_arrays:
+            df['h_li_sigma'] = beam_arrays['h_li_sigma']
+        # Same laser_id as the original loop (beam group plus the slash)
+        df['laser_id'] = beam + '/'
+        df['rgt'] = rgt
+        df['cycle'] = cycle
+        frames.append(df)
+
+    if not frames:
+        return(None)
+
+    # Keep each beam's own 0..n index like the original concat did
+    return(pd.concat(frames))
+
+# %% 2. Prefetching reader
+
+
+def iter_granules (file_list, n_readers = 4, prefetch = 8, in_memory = True, quality = False):
+    # Yields (file_path, arrays) in file_list order. At most `prefetch`
+    # granules are read ahead of the consumer, that's the back-pressure.
+    pending = deque()
+    files = iter(file_list)
+    with ThreadPoolExecutor(max_workers = n_readers) as pool:
+        for file_path in files:
+            pending.append((file_path, pool.submit(read_granule, file_path, in_memory, quality)))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            file_path, future = pending.popleft()
+            arrays = future.result()
+            # Top the queue back up before handing this one over
+            next_path = next(files, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(read_granule, next_path, in_memory, quality)))
+            yield(file_path, arrays)
+
+# %% 3. Background csv writer
+
+
+class CsvWriter:
+
+    # Appends DataFrames to one csv from a background thread. The queue is
+    # bounded so a slow disk stalls the producer instead of piling up memory.
+    def __init__ (self, path, max_pending = 4):
+        self.path = path
+        self.queue = queue.Queue(maxsize = max_pending)
+        self.error = None
+        self.rows = 0
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def _run (self):
+        header = True
+        with open(self.path, 'w', newline = '') as f:
+            while True:
+                df = self.queue.get()
+                if df is None:
+                    break
+                if self.error is not None:
+                    continue
+                try:
+                    df.to_csv(f, header = header)
+                    header = False
+                    self.rows += len(df)
+                except Exception as err:
+                    self.error = err
+
+    def write (self, df):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(df)
+
+    def close (self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+        return(self.rows)
+
+
+def _build (file_path, arrays, projections, quality):
+    df = granule_frame(file_path, arrays, **quality)
+    if df is not None and projections:
+        projection.add_projected(df, projections)
+
+    return(df)
+
+
+def granules_to_csv (file_list, out_path, n_readers = 4, prefetch = 8, in_memory = True,
+                     progress = True, metrics = None, projections = None, quality = None):
+    # Read -> convert -> write, all three overlapping. With a
+    # stage_metrics.RunReport the DataFrame building is timed on its own,
+    # with the light per-call timer since it runs once per granule.
+    # projections is a list of (crs, x column, y column) added from lat/lon,
+    # see projection.ingest_targets(). quality turns on the segment filter,
+    # e.g. {'max_sigma': 1.0, 'z_max': 10000}, and gets a 'rejections' entry
+    # with the counts per beam and rule.
+    # Memory: with in_memory every prefetched granule is held whole as raw
+    # bytes, so expect up to about (prefetch + 1) x granule size on top of
+    # the DataFrames waiting for the writer. Lower prefetch for big granules.
+    if quality is not None:
+        quality.setdefault('rejections', {})
+        quality_args = {k: quality.get(k) for k in ('max_sigma', 'z_max', 'rejections')}
+    else:
+        quality_args = {}
+    writer = CsvWriter(out_path)
+    n_files = 0
+    try:
+        for index, (file_path, arrays) in enumerate(iter_granules(file_list, n_readers,
+                                                                  prefetch, in_memory,
+                                                                  quality is not None)):
+            if progress:
+                print(f'File #{index +1}')
+            if metrics is None:
+                df = _build(file_path, arrays, projections, quality_args)
+            else:
+                with metrics.timer('dataframe_build') as m:
+                    df = _build(file_path, arrays, projections, quality_args)
+                    m.rows_out = (m.rows_out or 0) + (0 if df is None else len(df))
+            if df is not None:
+                writer.write(df)
+            n_files += 1
+    except BaseException:
+        # Stop the writer thread, but it's the original error that gets raised
+        try:
+            writer.close()
+        except Exception:
+            pass
+        raise
+    rows = writer.close()
+    if quality is not None:
+        n_missing = sum(c.get('missing_quality_vars', 0) for c in quality['rejections'].values())
+        if n_missing:
+            warnings.warn(f'{n_missing} segments came from granules without '
+                          f'{" / ".join(quality_variables)}, the flag and sigma rules '
+                          'were skipped for them')
+
+    return(n_files, rows)
+
+# %% 4. Settings for the later stages
+
+
+def save_settings (directory, z_max = 10000, quality_filter = True, max_sigma = None):
+    # What the csv was written with. Stage 3 takes its z_max from here so the
+    # two cuts can't drift apart.
+    with open(os.path.join(directory, settings_file), 'w') as f:
+        json.dump({'z_max': z_max, 'quality_filter': quality_filter, 'max_sigma': max_sigma}, f)
+
+
+def load_z_max (directory, default = 10000):
+    # Stage 2's z_max, or the old fixed cut for csvs written before it was saved
+    path = os.path.join(directory, settings_file)
+    if not os.path.exists(path):
+        return(default)
+    with open(path) as f:
+        return(json.load(f).get('z_max', default))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Times the stage 2 ingestion paths on synthetic granules and reports
+granules/s, segments/s and peak memory as JSON.
+
+Peak memory is what tracemalloc sees: Python objects and numpy/pandas
+buffers. HDF5's own C buffers and chunk cache aren't traced, so the real
+resident peak is higher, compare with the stage reports' peak_rss_mb.
+
+python benchmarks/bench_ingest.py --granules 20 --segments 50000 --out bench_ingest.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+# The pipeline modules live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import atl06_reader
+import synthetic_atl06
+
+# %% 1. Ingestion paths
+
+
+def serial_concat (file_list, out_path):
+    # The original stage 2 approach: read, convert and concat one after another
+    combined = None
+    for file_path in file_list:
+        df = atl06_reader.granule_frame(file_path, atl06_reader.read_granule(file_path, False))
+        if df is not None:
+            combined = df if combined is None else pd.concat([combined, df])
+    # Every granule can come back empty, still leave a (blank) csv behind
+    if combined is None:
+        open(out_path, 'w').close()
+        return(0)
+    combined.to_csv(out_path)
+
+    return(len(combined))
+
+
+def pipelined (file_list, out_path):
+    n_files, rows = atl06_reader.granules_to_csv(file_list, out_path, progress = False)
+
+    return(rows)
+
+
+def pipelined_quality (file_list, out_path):
+    # Same, with flagged/fill segments dropped before the rows are built
+    n_files, rows = atl06_reader.granules_to_csv(file_list, out_path, progress = False,
+                                                 quality = {'z_max': 10000})
+
+    return(rows)
+
+
+paths = {'serial_concat': serial_concat, 'pipelined': pipelined,
+         'pipelined_quality': pipelined_quality}
+
+# %% 2. Harness
+
+
+def run_path (name, file_list, work_dir, repeats = 3):
+    # Best of `repeats` wall time, peak traced (Python-side) memory from the first run
+    out_path = os.path.join(work_dir, f'{name}.csv')
+    times = []
+    peak = None
+    rows = 0
+    for r in range(repeats):
+        if r == 0:
+            tracemalloc.start()
+        start = time.perf_counter()
+        rows = paths[name](file_list, out_path)
+        times.append(time.perf_counter() - start)
+        if r == 0:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    best = min(times)
+
+    return({'path': name, 'granules': len(file_list), 'segments': rows,
+            'seconds_best': round(best, 4),
+            'seconds_all': [round(t, 4) for t in times],
+            'granules_per_s': round(len(file_list) / best, 2),
+            'segments_per_s': round(rows / best, 1),
+            'peak_traced_mb': round(peak / 1024 ** 2, 1)})
+
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark stage 2 ingestion')
+    parser.add_argument('--data-dir', help = 'existing granules, otherwise synthetic ones are made')
+    parser.add_argument('--granules', type = int, default = 10)
+    parser.add_argument('--segments', type = int, default = 20000)
+    parser.add_argument('--missing-beam-prob', type = float, default = 0.1)
+    parser.add_argument('--repeats', type = int, default = 3)
+    parser.add_argument('--paths', nargs = '+', default = list(paths))
+    parser.add_argument('--out', help = 'write the JSON report here too')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.data_dir:
+            file_list = sorted(glob.glob(os.path.join(args.data_dir, 'processed_ATL06*.h5')))
+        else:
+            file_list = synthetic_atl06.make_granules(os.path.join(work_dir, 'ATL06'),
+                                                      args.granules, args.segments,
+                                                      args.missing_beam_prob)
+        results = [run_path(name, file_list, work_dir, args.repeats) for name in args.paths]
+
+    report = {'benchmark': 'ingest', 'results': results}
+    print(json.dumps(report, indent = 2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent = 2)
+
+    return(report)
+
+
+if __name__ == '__main__':
+    main()
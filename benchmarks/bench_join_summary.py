@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark for the stage 3 clip/sjoin and the 4.2 summary and
+robust-threshold steps, on synthetic lakes and points. Writes a JSON report
+with the time per step and size, plus a log-log scaling exponent per step.
+
+python benchmarks/bench_join_summary.py --lakes 1000 10000 --points 100000 1000000 --out scaling.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lake_stats
+
+crs_proj = 'EPSG:32624'
+
+# A 200 x 300 km box in UTM 24N, about the size of the current study area
+box_bounds = (400000.0, 7300000.0, 600000.0, 7600000.0)
+
+# %% 1. Synthetic data
+
+
+def synthetic_lakes (n_lakes, n_vertices = 32, seed = 42, bounds = box_bounds):
+    # Wobbly star-shaped polygons. Areas are lognormal, lots of small lakes and
+    # a long tail of big ones like GSWO.
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bounds
+    cx = rng.uniform(minx, maxx, n_lakes)
+    cy = rng.uniform(miny, maxy, n_lakes)
+    radius = np.sqrt(rng.lognormal(mean = 11, sigma = 1.5, size = n_lakes) / np.pi)
+    radius = np.minimum(radius, 5000)
+
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint = False)
+    wobble = rng.uniform(0.7, 1.3, (n_lakes, n_vertices))
+    xs = cx[:, None] + radius[:, None] * wobble * np.cos(angles)
+    ys = cy[:, None] + radius[:, None] * wobble * np.sin(angles)
+    coords = np.stack([xs, ys], axis = 2)
+    coords = np.concatenate([coords, coords[:, :1]], axis = 1)
+    geoms = shapely.make_valid(shapely.polygons(coords))
+
+    lakes = gpd.GeoDataFrame({'area_m2': shapely.area(geoms)}, geometry = geoms, crs = crs_proj)
+    lakes['area_rank_id'] = 'ID_' + lakes['area_m2'].rank(method = 'first', ascending = False).astype(int).astype(str)
+
+    return(lakes)
+
+
+def synthetic_points (n_points, n_tracks = 200, seed = 42, bounds = box_bounds):
+    # Points along north-south tracks, 20 m apart, spread over several years
+    rng = np.random.default_rng(seed + 1)
+    minx, miny, maxx, maxy = bounds
+    track = rng.integers(0, n_tracks, n_points)
+    track_x = rng.uniform(minx, maxx, n_tracks)
+    x = track_x[track] + rng.normal(0, 5, n_points)
+    y = rng.uniform(miny, maxy, n_points)
+    # delta_time over five years so there are several water years and dates
+    pass_time = rng.uniform(0.8e8, 1.8e8, n_tracks * 10)
+    delta_time = pass_time[track * 10 + rng.integers(0, 10, n_points)]
+    height = rng.normal(300, 5, n_points)
+    height[rng.random(n_points) < 0.01] = 3.4e38
+
+    pts = gpd.GeoDataFrame({'height': height, 'delta_time': delta_time},
+                           geometry = shapely.points(x, y), crs = crs_proj)
+
+    return(pts)
+
+# %% 2. Steps being timed
+
+
+def step_clip (lakes, clip_box):
+    return(gpd.clip(lakes, clip_box))
+
+
+def step_join (lakes, pts):
+    return(gpd.sjoin(pts, lakes, how = 'inner', predicate = 'within'))
+
+
+def step_summary_groupby (joined):
+    # The 4.2 Summary as it was written, with the lambdas
+    joined = joined.assign(obs_date = lake_stats.obs_date_from_delta(joined['delta_time']))
+    joined = joined.assign(wtr_yr = lake_stats.wtr_yr_from_date(joined['obs_date']))
+    joined = joined.rename(columns = {'height': 'z'}).query('z < 10000')
+
+    return(joined.groupby(['area_rank_id', 'wtr_yr'], as_index = False).agg(
+        z_mean = ('z', 'mean'),
+        z_std = ('z', 'std'),
+        obs_count = ('z', 'count'),
+        area_m2 = ('area_m2', 'first'),
+        obs_dates_list = ('obs_date', lambda x: x.unique().astype(str).tolist()),
+        obs_date_unique = ('obs_date', lambda x: len(x.unique().astype(str).tolist()))
+        ))
+
+
+def step_summary_stream (joined):
+    joined = joined.assign(obs_date = lake_stats.obs_date_from_delta(joined['delta_time']))
+    joined = joined.assign(wtr_yr = lake_stats.wtr_yr_from_date(joined['obs_date']))
+    joined = joined.rename(columns = {'height': 'z'}).query('z < 10000')
+    stats = lake_stats.LakeYearStats(keys = ('area_rank_id', 'wtr_yr'), value = 'z')
+
+    return(stats.update(joined).summary())
+
+
+def step_threshold (summary):
+    robust = summary.query('z_std < 50 & obs_count > 25 & obs_date_unique > 3')
+    is_robust = summary[['area_rank_id', 'wtr_yr']].isin(robust[['area_rank_id', 'wtr_yr']])
+
+    return(is_robust.all(axis = 1))
+
+# %% 3. Harness
+
+
+def _time (fn, *args, repeats = 1):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return(out, best)
+
+
+def run_case (n_lakes, n_points, n_vertices, repeats):
+    lakes = synthetic_lakes(n_lakes, n_vertices)
+    pts = synthetic_points(n_points)
+    minx, miny, maxx, maxy = box_bounds
+    clip_box = gpd.GeoSeries([shapely.box(minx + 10000, miny + 10000, maxx - 10000, maxy - 10000)],
+                             crs = crs_proj)
+
+    clipped, t_clip = _time(step_clip, lakes, clip_box, repeats = repeats)
+    joined, t_join = _time(step_join, clipped, pts, repeats = repeats)
+    summary, t_groupby = _time(step_summary_groupby, joined, repeats = repeats)
+    _, t_stream = _time(step_summary_stream, joined, repeats = repeats)
+    _, t_threshold = _time(step_threshold, summary, repeats = repeats)
+
+    return({'n_lakes': n_lakes, 'n_points': n_points, 'n_vertices': n_vertices,
+            'n_joined': len(joined), 'n_lake_years': len(summary),
+            'seconds': {'clip': t_clip, 'join': t_join,
+                        'summary_groupby': t_groupby, 'summary_stream': t_stream,
+                        'threshold': t_threshold}})
+
+
+def scaling_exponents (cases, size_key):
+    # Slope of log(time) against log(size) for each step. Around 1 is linear,
+    # anything well above 1 won't survive all of Greenland.
+    out = {}
+    sizes = np.array([c[size_key] for c in cases], dtype = float)
+    if len(np.unique(sizes)) < 2:
+        return(out)
+    for step in cases[0]['seconds']:
+        times = np.array([c['seconds'][step] for c in cases])
+        ok = times > 0
+        out[step] = round(float(np.polyfit(np.log(sizes[ok]), np.log(times[ok]), 1)[0]), 3)
+
+    return(out)
+
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = 'Scaling benchmark for join and summary')
+    parser.add_argument('--lakes', type = int, nargs = '+', default = [1000, 10000])
+    parser.add_argument('--points', type = int, nargs = '+', default = [100000, 1000000])
+    parser.add_argument('--vertices', type = int, nargs = '+', default = [32])
+    parser.add_argument('--repeats', type = int, default = 1)
+    parser.add_argument('--out', help = 'write the JSON report here too')
+    args = parser.parse_args(argv)
+
+    cases = []
+    for n_lakes, n_points, n_vertices in itertools.product(args.lakes, args.points, args.vertices):
+        case = run_case(n_lakes, n_points, n_vertices, args.repeats)
+        print(f"lakes={n_lakes} points={n_points} vertices={n_vertices} "
+              f"join={case['seconds']['join']:.2f}s")
+        cases.append(case)
+
+    report = {'benchmark': 'join_summary', 'cases': cases,
+              'exponent_vs_points': scaling_exponents(cases, 'n_points'),
+              'exponent_vs_lakes': scaling_exponents(cases, 'n_lakes')}
+    print(json.dumps(report, indent = 2, default = float))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent = 2, default = float)
+
+    return(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Writes fake processed_ATL06_*.h5 granules with the same layout and file
+names as the NSIDC subsets, so stage 2 can be timed without downloading.
+
+python benchmarks/synthetic_atl06.py out_dir --granules 20 --segments 50000
+"""
+
+import argparse
+import datetime as dt
+import os
+
+import h5py
+import numpy as np
+
+beams = ['gt1l', 'gt1r', 'gt2l', 'gt2r', 'gt3l', 'gt3r']
+
+# Roughly the study box in east Greenland
+default_bbox = (-30.0, 66.0, -26.0, 69.0)
+
+# ATL06 segments are posted every 20 m, ICESat-2 moves at about 7 km/s
+segment_m = 20.0
+ground_speed = 7000.0
+ATL06_epoch = dt.datetime(2018, 1, 1)
+
+
+def granule_name (when, rgt, cycle, segment):
+    # processed_ATL06_{datetime}_{rgt:4}{cycle:2}{orbitsegment:2}_{version:3}_{revision:2}.h5
+    stamp = when.strftime('%Y%m%d%H%M%S')
+
+    return(f'processed_ATL06_{stamp}_{rgt:04d}{cycle:02d}{segment:02d}_006_01.h5')
+
+
+def write_granule (path, when, n_segments, rng, bbox = default_bbox, missing_beams = ()):
+    lon_min, lat_min, lon_max, lat_max = bbox
+    # A roughly north-south track somewhere in the box
+    lon0 = rng.uniform(lon_min, lon_max)
+    lat = np.linspace(lat_min, lat_max, n_segments)
+    t0 = (when - ATL06_epoch).total_seconds()
+    delta_time = t0 + np.arange(n_segments) * segment_m / ground_speed
+
+    with h5py.File(path, mode = 'w') as f:
+        for k, beam in enumerate(beams):
+            if beam in missing_beams:
+                continue
+            # Beam pairs are ~3.3 km apart, the two beams of a pair ~90 m
+            offset = (k // 2) * 0.07 + (k % 2) * 0.002
+            group = f.create_group(f'{beam}/land_ice_segments')
+            group['latitude'] = lat
+            group['longitude'] = lon0 + offset + rng.normal(0, 1e-4, n_segments)
+            # Mostly lake-ish surfaces, with a sprinkle of the huge fill values
+            h_li = rng.normal(300, 15, n_segments).astype('float32')
+            h_li[rng.random(n_segments) < 0.01] = np.float32(3.4028235e38)
+            group['h_li'] = h_li
+            group['delta_time'] = delta_time
+            group['h_li_sigma'] = rng.gamma(2, 0.05, n_segments).astype('float32')
+            group['atl06_quality_summary'] = (rng.random(n_segments) < 0.05).astype('int8')
+
+    return(path)
+
+
+def make_granules (out_dir, n_granules = 10, n_segments = 20000, missing_beam_prob = 0.1,
+                   seed = 42, bbox = default_bbox):
+    # Returns the list of written file paths
+    os.makedirs(out_dir, exist_ok = True)
+    rng = np.random.default_rng(seed)
+    start = dt.datetime(2018, 10, 14)
+    paths = []
+    for i in range(n_granules):
+        when = start + dt.timedelta(days = 91 * (i // 20) + i % 20, hours = i % 24)
+        rgt = 1 + (i * 74) % 1387
+        cycle = 1 + i // 20
+        missing = [b for b in beams if rng.random() < missing_beam_prob]
+        path = os.path.join(out_dir, granule_name(when, rgt, cycle, 5))
+        paths.append(write_granule(path, when, n_segments, rng, bbox, missing))
+
+    return(paths)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Write synthetic ATL06 granules')
+    parser.add_argument('out_dir')
+    parser.add_argument('--granules', type = int, default = 10)
+    parser.add_argument('--segments', type = int, default = 20000,
+                        help = 'segments per beam')
+    parser.add_argument('--missing-beam-prob', type = float, default = 0.1)
+    parser.add_argument('--seed', type = int, default = 42)
+    args = parser.parse_args()
+
+    paths = make_granules(args.out_dir, args.granules, args.segments,
+                          args.missing_beam_prob, args.seed)
+    print(f'Wrote {len(paths)} granules to {args.out_dir}')
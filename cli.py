@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless command line for batch jobs: ingest (stage 2), join (stage 3),
+summary (the 4.2 lake-year table as 4.2 reports it by default,
+--robust-filter for the outlier-filtered one) and serve (lake_service.py). Nothing heavy is imported at the top,
+each command imports only what it uses and nothing here touches
+matplotlib, seaborn or icepyx, so startup is just the Python interpreter.
+
+python cli.py ingest --working-dir /path/to/IceSat2-Lakes
+python cli.py join --working-dir /path/to/IceSat2-Lakes --layers GSWO
+python cli.py summary --working-dir /path/to/IceSat2-Lakes --robust 'z_std < 50 & obs_count > 25 & obs_date_unique > 3'
+"""
+
+import argparse
+import os
+import sys
+
+# %% 1. Commands
+
+
+def cmd_ingest (args):
+    import glob
+    import atl06_reader
+    import projection
+
+    ATL06_path = os.path.join(args.working_dir, 'data_raw', 'ATL06')
+    data_intermediate = os.path.join(args.working_dir, 'data_intermediate', '')
+    out_path = data_intermediate + 'IceSat2_Dataframe_v1.csv'
+    file_list = sorted(glob.glob(os.path.join(ATL06_path, 'processed_ATL06*.h5')))
+    # Same x/y and x_web/y_web columns as stage 2
+    crs_proj = args.crs or projection.load_crs(data_intermediate)
+    projection.save_crs(data_intermediate, crs_proj)
+    quality = None if args.no_quality_filter else {'max_sigma': args.max_sigma, 'z_max': args.z_max}
+    atl06_reader.save_settings(data_intermediate, args.z_max, not args.no_quality_filter, args.max_sigma)
+    n_files, n_rows = atl06_reader.granules_to_csv(file_list, out_path,
+                                                   n_readers = args.readers,
+                                                   prefetch = args.prefetch,
+                                                   progress = not args.quiet,
+                                                   projections = projection.ingest_targets(crs_proj),
+                                                   quality = quality)
+    print(f'{n_files} granules, {n_rows} segments -> {out_path}')
+    if quality is not None:
+        for beam, counts in sorted(quality['rejections'].items()):
+            print(beam, counts)
+
+    return(0)
+
+
+def cmd_join (args):
+    import lake_join
+
+    data_raw = os.path.join(args.working_dir, 'data_raw', '')
+    data_intermediate = os.path.join(args.working_dir, 'data_intermediate', '')
+    # Same function, files and outputs as 3-Lakes-IceSat2-merge.py
+    layers = lake_join.join_layers(data_raw, data_intermediate, layers = args.layers,
+                                   chunk_size = args.chunk_size)
+    for name, (_, pts) in layers.items():
+        print(f'{name}: {len(pts)} points joined')
+
+    return(0)
+
+
+def cmd_summary (args):
+    import lake_stats
+    import quantile_sketch
+
+    data_intermediate = os.path.join(args.working_dir, 'data_intermediate', '')
+    data_output = os.path.join(args.working_dir, 'data_output', '')
+    key = {'GSWO': 'area_rank_id', 'IIML': 'lake_id'}[args.layer]
+    if args.robust_filter:
+        Summary = _filtered_summary(data_intermediate + f'ICESat2_pts_{args.layer}.shp', key)
+    else:
+        # What 4.2 reports by default: stage 3's stats (every joined point
+        # below z_max) plus the sketch medians/IQRs where stage 3 built them
+        Summary = lake_stats.LakeYearStats.load(data_intermediate + f'lake_year_stats_{args.layer}.pkl').summary()
+        sketch_path = data_intermediate + f'lake_date_sketches_{args.layer}.pkl'
+        if os.path.exists(sketch_path):
+            sketches = quantile_sketch.GroupSketches.load(sketch_path).rollup([key, 'wtr_yr'])
+            Summary = Summary.merge(sketches.summary(), on = [key, 'wtr_yr'], how = 'left')
+    if args.robust:
+        Summary['is_robust'] = Summary.eval(args.robust)
+
+    # Lists don't survive a csv, join the dates with ';'
+    Summary['obs_dates_list'] = Summary['obs_dates_list'].str.join(';')
+    suffix = '_filtered' if args.robust_filter else ''
+    out_path = args.out or data_output + f'{args.layer}_lake_year_summary{suffix}.csv'
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok = True)
+    Summary.to_csv(out_path, index = False)
+    print(f'{len(Summary)} lake-years{" (robust-filtered)" if args.robust_filter else ""} -> {out_path}')
+
+    return(0)
+
+
+def _filtered_summary (points_path, key):
+    # The 4.2 Summary with use_robust_filter on: robust outlier filter on the
+    # joined points, then lake-year stats plus the sketch medians/IQRs
+    import geopandas as gpd
+    import lake_join
+    import lake_stats
+    import outlier_filter
+    import quantile_sketch
+
+    points = gpd.read_file(points_path, ignore_geometry = True)
+    points = points.rename(columns = {'area_rank_': 'area_rank_id', 'height': 'z'})
+    points = lake_join.annotate_dates(points)
+    rules = [dict(rule, by = [key if k == 'area_rank_id' else k for k in rule['by']])
+             if 'by' in rule else rule for rule in outlier_filter.DEFAULT_RULES]
+    points, _ = outlier_filter.robust_filter(points, rules)
+
+    Summary = lake_stats.LakeYearStats(keys = (key, 'wtr_yr'), value = 'z').update(points).summary()
+    sketches = quantile_sketch.GroupSketches(keys = (key, 'wtr_yr'), value = 'z').update(points)
+
+    return(Summary.merge(sketches.summary(), on = [key, 'wtr_yr'], how = 'left'))
+
+
+def cmd_serve (args):
+    import lake_service
+
+    store = lake_service.LakeStore(args.working_dir, layer = args.layer)
+    print(lake_service.serve(store, args.host, args.port, args.cache_size))
+
+    return(0)
+
+# %% 2. Argument parsing
+
+
+def build_parser ():
+    parser = argparse.ArgumentParser(description = 'IceSat2-Lakes batch commands')
+    parser.add_argument('--working-dir', default = os.environ.get('ICESAT2_LAKES_DIR', '.'))
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    ingest = commands.add_parser('ingest', help = 'ATL06 granules to IceSat2_Dataframe_v1.csv')
+    ingest.add_argument('--readers', type = int, default = 4)
+    ingest.add_argument('--prefetch', type = int, default = 8)
+    ingest.add_argument('--quiet', action = 'store_true')
+    ingest.add_argument('--crs', help = 'project CRS for x/y, default the one stage 2 recorded')
+    ingest.add_argument('--no-quality-filter', action = 'store_true',
+                        help = 'keep flagged and fill-value segments')
+    ingest.add_argument('--max-sigma', type = float, help = 'also drop segments with h_li_sigma above this')
+    ingest.add_argument('--z-max', type = float, default = 10000,
+                        help = 'drop heights at or above this, the join uses the same cut')
+    ingest.set_defaults(func = cmd_ingest)
+
+    join = commands.add_parser('join', help = 'join points to lakes and build lake-year stats')
+    join.add_argument('--layers', nargs = '+', choices = ['GSWO', 'IIML'], default = ['GSWO', 'IIML'])
+    join.add_argument('--chunk-size', type = int, default = 1_000_000)
+    join.set_defaults(func = cmd_join)
+
+    summary = commands.add_parser('summary', help = 'lake-year summary table as csv')
+    summary.add_argument('--layer', choices = ['GSWO', 'IIML'], default = 'GSWO')
+    summary.add_argument('--robust', help = 'query flagging robust lake-years, adds is_robust')
+    summary.add_argument('--robust-filter', action = 'store_true',
+                         help = "outlier-filter the points first, like 4.2's use_robust_filter")
+    summary.add_argument('--out')
+    summary.set_defaults(func = cmd_summary)
+
+    serve = commands.add_parser('serve', help = 'local HTTP queries over lakes, series and histograms')
+    serve.add_argument('--layer', choices = ['GSWO'], default = 'GSWO')
+    serve.add_argument('--host', default = '127.0.0.1')
+    serve.add_argument('--port', type = int, default = 8765)
+    serve.add_argument('--cache-size', type = int, default = 1024)
+    serve.set_defaults(func = cmd_serve)
+
+    return(parser)
+
+
+def main (argv = None):
+    args = build_parser().parse_args(argv)
+
+    return(args.func(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
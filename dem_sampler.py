@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reference DEM elevation under every point (dem_z), e.g. from ArcticDEM
+mosaic tiles on disk (GeoTIFF/COG). Points are grouped by the raster block
+they fall in and each block is read once as a window, so neither the
+raster nor a per-point read is ever needed. The block reads of every tile
+go to one thread pool (GDAL releases the GIL while it reads), so a mosaic
+of many small tiles keeps all the workers busy too. Every task opens its
+own dataset handle and closes it when done.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import projection
+
+# %% 1. Planning the block reads
+
+
+def plan_blocks (ds, x, y, todo):
+    # For the points in todo (indices, x/y already in the raster's CRS) that
+    # fall on this raster, returns a list of (block window, point indices,
+    # rows, cols), one per block hit
+    # Cheap bounds check first, only points on the tile get the inverse affine
+    left, bottom, right, top = ds.bounds
+    xt, yt = x[todo], y[todo]
+    on_tile = (xt >= left) & (xt <= right) & (yt >= bottom) & (yt <= top)
+    todo = todo[on_tile]
+    if len(todo) == 0:
+        return([])
+
+    cols, rows = ~ds.transform * (xt[on_tile], yt[on_tile])
+    rows = np.floor(rows).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    inside = (rows >= 0) & (rows < ds.height) & (cols >= 0) & (cols < ds.width)
+    idx, rows, cols = todo[inside], rows[inside], cols[inside]
+    if len(idx) == 0:
+        return([])
+
+    block_h, block_w = ds.block_shapes[0]
+    block_row, block_col = rows // block_h, cols // block_w
+    key = block_row * (ds.width // block_w + 1) + block_col
+    order = np.argsort(key, kind = 'stable')
+    key, idx, rows, cols = key[order], idx[order], rows[order], cols[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    bounds = np.append(starts, len(key))
+
+    blocks = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        r0 = (rows[start] // block_h) * block_h
+        c0 = (cols[start] // block_w) * block_w
+        window = (r0, c0, min(block_h, ds.height - r0), min(block_w, ds.width - c0))
+        blocks.append((window, idx[start:stop], rows[start:stop] - r0, cols[start:stop] - c0))
+
+    return(blocks)
+
+# %% 2. Reading
+
+
+def _read_blocks (path, band, blocks):
+    # One task: a batch of blocks from one raster, on its own handle
+    import rasterio
+    from rasterio.windows import Window
+
+    out = []
+    with rasterio.open(path) as ds:
+        nodata = ds.nodatavals[band - 1]
+        for (r0, c0, h, w), idx, rows, cols in blocks:
+            values = ds.read(band, window = Window(c0, r0, w, h))[rows, cols].astype('float64')
+            if nodata is not None:
+                values[values == nodata] = np.nan
+            out.append((idx, values))
+
+    return(out)
+
+
+def sample_dem (x, y, crs, paths, band = 1, n_workers = 4, blocks_per_task = 16):
+    # dem_z for points x, y (in crs). paths is one DEM or a list of tiles,
+    # a point takes the value of the first tile that has data for it.
+    # Points off every tile, or on nodata, get NaN. Tiles are read in
+    # parallel, so points where tiles overlap get read from each of them.
+    import rasterio
+
+    if isinstance(paths, str):
+        paths = [paths]
+    x = np.asarray(x, dtype = 'float64')
+    y = np.asarray(y, dtype = 'float64')
+    dem_z = np.full(len(x), np.nan)
+    everything = np.arange(len(x))
+    # Tiles of one mosaic share a CRS, project the points once per CRS
+    in_crs = {}
+
+    with ThreadPoolExecutor(max_workers = n_workers) as pool:
+        futures = []
+        for path in paths:
+            # Only the metadata here, the handle is closed before any reads
+            with rasterio.open(path) as ds:
+                dem_crs = ds.crs.to_wkt() if ds.crs is not None else None
+                if dem_crs not in in_crs:
+                    in_crs[dem_crs] = ((x, y) if dem_crs is None
+                                       else projection.transform_xy(x, y, crs, dem_crs))
+                blocks = plan_blocks(ds, *in_crs[dem_crs], everything)
+            futures.append([pool.submit(_read_blocks, path, band, blocks[i:i + blocks_per_task])
+                            for i in range(0, len(blocks), blocks_per_task)])
+
+        # Tile order decides who wins, a later tile only fills what's still NaN
+        for tile_futures in futures:
+            for future in tile_futures:
+                for idx, values in future.result():
+                    fill = np.isnan(dem_z[idx])
+                    dem_z[idx[fill]] = values[fill]
+
+    return(dem_z)
+
+
+def add_dem_z (points, paths, column = 'dem_z', **kwargs):
+    # Adds the column to a projected GeoDataFrame of points
+    points[column] = sample_dem(points.geometry.x.to_numpy(), points.geometry.y.to_numpy(),
+                                points.crs, paths, **kwargs)
+
+    return(points)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stage 3 point-to-lake join as functions. join_layers() is the whole stage,
+3-Lakes-IceSat2-merge.py and the `cli.py join` command both call it.
+"""
+
+import os
+
+import geopandas as gpd
+import pandas as pd
+
+import atl06_reader
+import lake_layers
+import lake_stats
+import projection
+import quantile_sketch
+import stage_metrics
+
+# Raw source file, preparation step and lake key per layer
+layer_sources = {'GSWO': ('GSWO_raw_lakes.shp', lake_layers.prepare_gswo, 'area_rank_id'),
+                 'IIML': ('IIML_raw_lakes2017.shp', lake_layers.prepare_iiml, 'lake_id')}
+
+# Columns the joined points don't keep
+drop_columns = ['index_right', 'Unnamed: 0', 'lat', 'lon', 'obs_date', 'wtr_yr']
+
+
+def points_from_frame (IceSat, crs_proj, xy_crs = None):
+    # Projected GeoDataFrame. Stage 2 already stored x/y, xy_crs is the CRS
+    # it recorded for them (projection.load_xy_crs). Those are used when they
+    # are in crs_proj, otherwise lat/lon gets projected here, once.
+    if xy_crs == crs_proj and {'x', 'y'} <= set(IceSat.columns):
+        return(projection.points_in(IceSat, crs_proj, 'x', 'y'))
+    x, y = projection.transform_xy(IceSat['lon'].to_numpy(), IceSat['lat'].to_numpy(),
+                                   'EPSG:4326', crs_proj)
+
+    return(gpd.GeoDataFrame(IceSat, geometry = gpd.points_from_xy(x, y), crs = crs_proj))
+
+
+def annotate_dates (IceSatPts):
+    # obs_date and wtr_yr so the lake-year stats can key on them
+    IceSatPts['obs_date'] = lake_stats.obs_date_from_delta(IceSatPts['delta_time'])
+    IceSatPts['wtr_yr'] = lake_stats.wtr_yr_from_date(IceSatPts['obs_date'])
+
+    return(IceSatPts)
+
+
+def join_in_chunks (IceSatPts, layers, chunk_size = 1_000_000, z_max = 10000):
+    # layers is {name: (lakes, LakeYearStats, ...)}, anything after the lakes
+    # with an update(batch) method (e.g. quantile_sketch.GroupSketches) works.
+    # Each chunk of points is joined to every layer and the accumulators are
+    # updated right away, so the lake-year summaries are done when the join is.
+    # Returns {name: joined points}.
+    joined = {name: [] for name in layers}
+    for start in range(0, len(IceSatPts), chunk_size):
+        chunk = IceSatPts.iloc[start:start + chunk_size]
+        for name, (lakes, *accumulators) in layers.items():
+            chunk_joined = gpd.sjoin(chunk,
+                                     lakes,
+                                     how = 'inner', # Eliminates IceSat points not matched with a Lake
+                                     predicate = 'within') # Icesat points need to be inside a lake
+            # Same z < 10000 cut as the 4.2 Summary, points above Greenland's max are junk
+            kept = chunk_joined[chunk_joined['height'] < z_max]
+            for accumulator in accumulators:
+                accumulator.update(kept)
+            joined[name].append(chunk_joined)
+
+    out = {}
+    for name, pieces in joined.items():
+        out[name] = pd.concat(pieces) if pieces else IceSatPts.iloc[0:0]
+
+    return(out)
+
+
+def study_bounds (data_raw, crs_proj):
+    # Study bounds came from going to Google Earth and drawing an arbitrary box
+    import fiona
+
+    # Have to modify the supported drivers for GeoPandas to read ('r') .kml files
+    fiona.drvsupport.supported_drivers['LIBKML'] = 'r'
+    bound_box = gpd.read_file(data_raw + 'study_bounds.kml')
+
+    return(bound_box.to_crs(crs = crs_proj)['geometry'])
+
+
+def prepare_layer (name, data_raw, data_intermediate, crs_proj, bound_box, cache):
+    # Prepared lakes (cached by source files + crs), written to
+    # Lakes<name>_v2.shp when rebuilt, then clipped to the study bounds
+    source, prepare, _ = layer_sources[name]
+    src = data_raw + source
+    lakes, hit = cache.get(f'Lakes{name}', [src], {'crs': crs_proj}, prepare, src, crs_proj)
+    # Only rewrite when the layer was rebuilt (or someone deleted the file)
+    out_path = data_intermediate + f'Lakes{name}_v2.shp'
+    if not hit or not os.path.exists(out_path):
+        lakes.to_file(out_path, index = False)
+
+    # Clipped layers are cached too, keyed on the bounds as well
+    bounds_params = {'crs': crs_proj, 'bounds': [round(b, 3) for b in bound_box.total_bounds]}
+    lakes, _ = cache.get(f'Lakes{name}_clip', [src, data_raw + 'study_bounds.kml'],
+                         bounds_params, gpd.clip, lakes, bound_box)
+
+    return(lakes)
+
+
+def add_atl03_bins (bins_path, joined, lakes, stats, sketches, crs_proj, xy_crs, z_max = 10000):
+    # Stage 2's ATL03 lake bins already carry their GSWO lake, so there's no
+    # join: they go in next to the segments (source column) and count towards
+    # the same lake-year stats and sketches
+    Bins = pd.read_csv(bins_path)
+    Bins = annotate_dates(points_from_frame(Bins, crs_proj, xy_crs = xy_crs))
+    # Lake attributes as on the joined segments, bins of clipped-out lakes drop
+    Bins = Bins.merge(pd.DataFrame(lakes.drop(columns = 'geometry')), on = 'area_rank_id', how = 'inner')
+    kept = Bins[Bins['height'] < z_max]
+    stats.update(kept)
+    sketches.update(kept)
+    Bins = Bins.drop(columns = drop_columns, errors = 'ignore')
+    joined['source'] = 'ATL06'
+    Bins['source'] = 'ATL03'
+
+    return(pd.concat([joined, Bins], ignore_index = True))
+
+
+def join_layers (data_raw, data_intermediate, layers = ('GSWO', 'IIML'), crs_proj = None,
+                 xy_crs = None, chunk_size = 1_000_000, z_max = None, metrics = None):
+    # All of stage 3 for the given layers: prepare and clip the lakes, join
+    # the points chunk by chunk with the lake-year stats (and the GSWO
+    # sketches) built along the way, add the ATL03 bins to GSWO, and write
+    # ICESat2_pts_<name>.shp, lake_year_stats_<name>.pkl and
+    # lake_date_sketches_GSWO.pkl. crs_proj/xy_crs and the z_max cut for the
+    # stats default to what stage 2 recorded.
+    # Returns {name: (clipped lakes, joined points)}.
+    if z_max is None:
+        z_max = atl06_reader.load_z_max(data_intermediate)
+    if crs_proj is None:
+        crs_proj = projection.load_crs(data_intermediate)
+    if xy_crs is None:
+        xy_crs = projection.load_xy_crs(data_intermediate)
+    metrics = metrics or stage_metrics.RunReport('join')
+    cache = lake_layers.LayerCache(data_intermediate + 'lake_cache/')
+
+    with metrics.stage('clip') as m:
+        bound_box = study_bounds(data_raw, crs_proj)
+        lakes = {name: prepare_layer(name, data_raw, data_intermediate, crs_proj, bound_box, cache)
+                 for name in layers}
+        m.rows_out = sum(len(l) for l in lakes.values())
+
+    points_path = data_intermediate + 'IceSat2_Dataframe_v1.csv'
+    with metrics.stage('read_points') as m:
+        IceSat = pd.read_csv(points_path)
+        m.add_file_read(points_path)
+        m.rows_out = len(IceSat)
+
+    # x/y projected at ingest are used as is, older csvs get projected here
+    with metrics.stage('reproject', rows_in = len(IceSat)) as m:
+        IceSatPts = points_from_frame(IceSat, crs_proj, xy_crs = xy_crs)
+        m.rows_out = len(IceSatPts)
+    del(IceSat)
+
+    # obs_date and wtr_yr up front, vectorized, so the stats can key on them
+    with metrics.stage('temporal_annotation', rows_in = len(IceSatPts)) as m:
+        IceSatPts = annotate_dates(IceSatPts)
+        m.rows_out = len(IceSatPts)
+
+    # The join includes the lake-year stats updates. Quantile sketches per
+    # lake-year-date give 4.2 medians/IQRs without keeping the points around.
+    stats = {name: lake_stats.LakeYearStats(keys = (layer_sources[name][2], 'wtr_yr'), value = 'height')
+             for name in layers}
+    accumulators = {name: [stats[name]] for name in layers}
+    if 'GSWO' in layers:
+        sketches = quantile_sketch.GroupSketches(keys = ('area_rank_id', 'wtr_yr', 'obs_date'),
+                                                 value = 'height')
+        accumulators['GSWO'].append(sketches)
+    with metrics.stage('join', rows_in = len(IceSatPts)) as m:
+        joined = join_in_chunks(IceSatPts, {name: (lakes[name], *accumulators[name]) for name in layers},
+                                chunk_size = chunk_size, z_max = z_max)
+        m.rows_out = sum(len(j) for j in joined.values())
+    del(IceSatPts)
+    joined = {name: pts.drop(columns = drop_columns, errors = 'ignore') for name, pts in joined.items()}
+
+    bins_path = data_intermediate + 'IceSat2_ATL03_bins_v1.csv'
+    if 'GSWO' in layers and os.path.exists(bins_path):
+        with metrics.stage('atl03_bins', rows_in = len(joined['GSWO'])) as m:
+            joined['GSWO'] = add_atl03_bins(bins_path, joined['GSWO'], lakes['GSWO'], stats['GSWO'],
+                                            sketches, crs_proj, xy_crs, z_max)
+            m.rows_out = len(joined['GSWO'])
+
+    with metrics.stage('write', rows_in = sum(len(j) for j in joined.values())) as m:
+        for name in layers:
+            joined[name].to_file(data_intermediate + f'ICESat2_pts_{name}.shp', index = False)
+            stats[name].save(data_intermediate + f'lake_year_stats_{name}.pkl')
+            m.add_file_written(data_intermediate + f'ICESat2_pts_{name}.shp')
+        if 'GSWO' in layers:
+            sketches.save(data_intermediate + 'lake_date_sketches_GSWO.pkl')
+
+    return({name: (lakes[name], joined[name]) for name in layers})
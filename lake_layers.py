@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lake layer preparation (stage 3, section 2) with an on-disk cache. A prepared
+layer is only rebuilt when its source files or parameters change.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+
+import projection
+
+# Bump this when the preparation steps below change, it invalidates old entries
+prep_version = 3
+
+# %% 1. Preparation steps (moved from 3-Lakes-IceSat2-merge.py)
+
+
+def prepare_gswo (path, crs_proj):
+    LakesGSWO = gpd.read_file(path)
+
+    # Assinging CRS from documentation
+    LakesGSWO = LakesGSWO.set_crs(crs = 'EPSG:4326')
+
+    # Make a new area column old one was in decimal degrees. Always in the
+    # fixed equal-area CRS, so areas and IDs don't move with crs_proj
+    LakesGSWO['area_m2'] = LakesGSWO.geometry.to_crs(crs = projection.area_crs).area
+
+    # Make a id column from ranking lake area
+    LakesGSWO['area_rank_id'] = LakesGSWO['area_m2'].rank(method = 'first', ascending = False).astype(int)
+    LakesGSWO['area_rank_id'] = 'ID_' + LakesGSWO['area_rank_id'].astype(str)
+
+    LakesGSWO = LakesGSWO.to_crs(crs = crs_proj)
+
+    # Drop the original degrees area column
+    LakesGSWO = LakesGSWO.drop(columns = 'area')
+
+    return(LakesGSWO)
+
+
+def prepare_iiml (path, crs_proj):
+    LakesIIML = gpd.read_file(path)
+
+    # Designate the crs for LakesIIML, the file comes in UTM 24N
+    LakesIIML = LakesIIML.set_crs(crs = 'EPSG:32624')
+    LakesIIML = LakesIIML.to_crs(crs = crs_proj)
+    LakesIIML = LakesIIML.drop(columns = ['LakeName', 'Source', 'NumOfSate', 'Certainty', 'Satellites'])
+    LakesIIML = LakesIIML.rename(columns = {'Area':'area_m2', 'Length':'length_m', 'LakeID':'lake_id'})
+
+    return(LakesIIML)
+
+# %% 2. Cache
+
+
+def _source_files (path):
+    # A shapefile is several files, any of them changing should count
+    stem = os.path.splitext(path)[0]
+    files = sorted(glob.glob(glob.escape(stem) + '.*'))
+
+    return(files if files else [path])
+
+
+def fingerprint (sources, params):
+    # Size + modification time of every source file, plus the parameters.
+    # Cheap enough to run every time, no need to hash gigabytes of polygons.
+    h = hashlib.sha256()
+    for source in sources:
+        for file_path in _source_files(source):
+            st = os.stat(file_path)
+            h.update(f'{os.path.basename(file_path)}:{st.st_size}:{st.st_mtime_ns};'.encode())
+    h.update(json.dumps(params, sort_keys = True, default = str).encode())
+    h.update(f'v{prep_version}'.encode())
+
+    return(h.hexdigest()[:16])
+
+
+class LayerCache:
+
+    def __init__ (self, cache_dir, max_bytes = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def path_for (self, name, key):
+        return(os.path.join(self.cache_dir, f'{name}_{key}.parquet'))
+
+    def get (self, name, sources, params, build, *args):
+        # Returns (layer, hit). build(*args) is only called on a miss.
+        key = fingerprint(sources, params)
+        path = self.path_for(name, key)
+        if os.path.exists(path):
+            # Touch it so eviction knows it was used recently
+            os.utime(path)
+            return(gpd.read_parquet(path), True)
+
+        layer = build(*args)
+        layer.to_parquet(path)
+        self.evict(keep = path)
+
+        return(layer, False)
+
+    def evict (self, keep = None):
+        # Drop the least recently used variants until the cache fits max_bytes
+        # Two stage 3 runs (one per layer) can share the cache, files may
+        # disappear under us
+        entries = []
+        for f in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, f)
+            if f.endswith('.parquet'):
+                try:
+                    st = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, file_path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_path in entries:
+            if total <= self.max_bytes:
+                break
+            if file_path == keep:
+                continue
+            total -= size
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single-lake maps of the IceSat2 points, one marker style per date. Each
+date is drawn once, and a date with more points than max_points is averaged
+into screen-sized cells first, so a lake crossed by dense tracks draws
+about as fast as a sparse one.
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import shapely
+
+marker_styles = ['o', 's', '^', 'D', 'v', 'p', '>', '<', '*', 'h', '+', 'x']
+
+
+def bin_points (x, y, values, cell):
+    # Mean position and value per square cell, cells with no points dropped
+    ix = np.floor(x / cell).astype(np.int64)
+    iy = np.floor(y / cell).astype(np.int64)
+    binned = pd.DataFrame({'ix': ix, 'iy': iy, 'x': x, 'y': y, 'v': values})
+    binned = binned.groupby(['ix', 'iy'], sort = False)[['x', 'y', 'v']].mean()
+
+    return(binned['x'].to_numpy(), binned['y'].to_numpy(), binned['v'].to_numpy())
+
+
+def _outline (ax, lake_geometry):
+    # Exteriors of every polygon part, islands aren't drawn (same as before)
+    for part in shapely.get_parts(lake_geometry):
+        x, y = part.exterior.xy
+        ax.fill(x, y, facecolor = 'none', edgecolor = 'purple')
+
+
+def plot_lake_map (points, value, dates = None, lake_geometry = None, date_col = 'obs_date',
+                   max_points = 5000, cell_px = 2, ax = None, cmap = 'seismic', s = 5,
+                   markers = marker_styles, colorbar_label = 'Elevation_m'):
+    # points is a GeoDataFrame of one lake. dates defaults to every date in it.
+    if ax is None:
+        _, ax = plt.subplots()
+    if dates is None:
+        dates = sorted(points[date_col].unique())
+
+    x = points.geometry.x.to_numpy()
+    y = points.geometry.y.to_numpy()
+    values = points[value].to_numpy(dtype = 'float64')
+    # One color scale for every date, otherwise each scatter scales itself
+    vmin, vmax = np.nanmin(values), np.nanmax(values)
+
+    if lake_geometry is not None:
+        _outline(ax, lake_geometry)
+        minx, miny, maxx, maxy = lake_geometry.bounds
+    else:
+        minx, miny, maxx, maxy = x.min(), y.min(), x.max(), y.max()
+    # Data units per cell_px screen pixels on the current axes
+    width_px = ax.get_window_extent().width or 400
+    cell = max(maxx - minx, maxy - miny, 1.0) / width_px * cell_px
+
+    # Dates come as strings (obs_dates_list) or dates, compare them as text
+    dates_col = points[date_col].astype(str).to_numpy()
+    scatter = None
+    for i, date in enumerate(dates):
+        on_date = dates_col == str(date)
+        dx, dy, dv = x[on_date], y[on_date], values[on_date]
+        if len(dv) > max_points:
+            dx, dy, dv = bin_points(dx, dy, dv, cell)
+        scatter = ax.scatter(dx, dy, c = dv, cmap = cmap, vmin = vmin, vmax = vmax, s = s,
+                             label = f'Obs Date: {date}',
+                             marker = markers[i % len(markers)])
+
+    ax.legend(bbox_to_anchor = (1.05, 1), loc = 'upper left')
+    if scatter is not None:
+        plt.colorbar(scatter, ax = ax, label = colorbar_label)
+
+    return(ax)
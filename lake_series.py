@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-lake elevation time series. Every pass over a lake (date + beam) is
+reduced once to count, mean, median and spread, and the passes are kept as
+flat numpy columns sorted by lake and date, with an offsets array pointing
+at each lake's rows. A lake's series is a slice, and the seasonal, frozen vs
+liquid and year-over-year comparisons work on all lakes at once without
+going back to the points.
+"""
+
+import numpy as np
+import pandas as pd
+
+import lake_stats
+
+columns = ['obs_date', 'laser_id', 'count', 'z_mean', 'z_median', 'z_std']
+
+# %% 1. Building the store
+
+
+def pass_table (points, lake_col = 'area_rank_id', value = 'z', date = 'obs_date',
+                beam = 'laser_id'):
+    # One row per lake, date and beam. This is the only pass over the points.
+    grouped = points.groupby([lake_col, date, beam], sort = True)[value]
+    passes = pd.DataFrame({'count': grouped.count(), 'z_mean': grouped.mean(),
+                           'z_median': grouped.median(), 'z_std': grouped.std()})
+    passes = passes.reset_index().rename(columns = {lake_col: 'lake', date: 'obs_date',
+                                                    beam: 'laser_id'})
+
+    return(passes)
+
+
+class LakeSeries:
+
+    def __init__ (self, lake, offsets, data):
+        # lake: sorted lake ids, offsets: len(lake) + 1 row boundaries,
+        # data: {column: array} with one entry per pass
+        self.lake = lake
+        self.offsets = offsets
+        self.data = data
+        self._position = pd.Index(lake)
+
+    @classmethod
+    def from_points (cls, points, lake_col = 'area_rank_id', value = 'z', date = 'obs_date',
+                     beam = 'laser_id'):
+        return(cls.from_passes(pass_table(points, lake_col, value, date, beam)))
+
+    @classmethod
+    def from_passes (cls, passes):
+        passes = passes.sort_values(['lake', 'obs_date', 'laser_id'], kind = 'stable')
+        lake, starts = np.unique(passes['lake'].to_numpy(), return_index = True)
+        offsets = np.append(starts, len(passes)).astype(np.int64)
+        data = {'obs_date': passes['obs_date'].to_numpy(dtype = 'datetime64[D]'),
+                'laser_id': passes['laser_id'].to_numpy(dtype = str),
+                'count': passes['count'].to_numpy(dtype = np.int64),
+                'z_mean': passes['z_mean'].to_numpy(dtype = 'float64'),
+                'z_median': passes['z_median'].to_numpy(dtype = 'float64'),
+                'z_std': passes['z_std'].to_numpy(dtype = 'float64')}
+
+        return(cls(lake, offsets, data))
+
+    def __len__ (self):
+        return(len(self.lake))
+
+    def save (self, path):
+        # Plain .npz, no pickles, loads without pandas. Ids and beams go in as
+        # fixed-width unicode, object arrays would need allow_pickle to load.
+        np.savez_compressed(path, lake = np.asarray(self.lake, dtype = str), offsets = self.offsets,
+                            **{k: np.asarray(v, dtype = str) if v.dtype == object else v
+                               for k, v in self.data.items()})
+
+    @classmethod
+    def load (cls, path):
+        with np.load(path) as f:
+            data = {k: f[k] for k in columns}
+            return(cls(f['lake'], f['offsets'], data))
+
+    def lake_series (self, lake_id):
+        # One lake's passes, a slice of every column
+        i = self._position.get_loc(lake_id)
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+
+        return(pd.DataFrame({k: v[rows] for k, v in self.data.items()}))
+
+    def frame (self):
+        # Every pass with its lake, water year and lake phase
+        out = pd.DataFrame(self.data)
+        out.insert(0, 'lake', np.repeat(self.lake, np.diff(self.offsets)))
+        out['wtr_yr'] = lake_stats.wtr_yr_from_date(self.data['obs_date'])
+        out['lake_phase_est'] = lake_stats.lake_phase_from_date(self.data['obs_date'])
+
+        return(out)
+
+    def per_date (self):
+        # Beams of the same pass combined, means weighted by count
+        out = self.frame()
+        out['z_sum'] = out['z_mean'] * out['count']
+        dates = out.groupby(['lake', 'obs_date', 'wtr_yr', 'lake_phase_est'], sort = True)
+        dates = dates.agg(count = ('count', 'sum'), z_sum = ('z_sum', 'sum'),
+                          z_median = ('z_median', 'median'), n_beams = ('laser_id', 'nunique'))
+        dates['z_mean'] = dates.pop('z_sum') / dates['count']
+
+        return(dates.reset_index())
+
+    def seasonal_means (self):
+        # Count-weighted mean per lake, water year and lake phase
+        out = self.frame()
+        out['z_sum'] = out['z_mean'] * out['count']
+        seasons = out.groupby(['lake', 'wtr_yr', 'lake_phase_est'], sort = True)
+        seasons = seasons.agg(count = ('count', 'sum'), z_sum = ('z_sum', 'sum'),
+                              n_dates = ('obs_date', 'nunique'))
+        seasons['z_mean'] = seasons.pop('z_sum') / seasons['count']
+
+        return(seasons.reset_index())
+
+    def seasonal_difference (self):
+        # Each season minus the same season of the lake's previous water year
+        # that has one (gaps are allowed, wtr_yr_prev says which year it was)
+        seasons = self.seasonal_means()
+        grouped = seasons.groupby(['lake', 'lake_phase_est'], sort = False)
+        seasons['wtr_yr_prev'] = grouped['wtr_yr'].shift()
+        seasons['dz'] = seasons['z_mean'] - grouped['z_mean'].shift()
+
+        return(seasons.dropna(subset = ['dz']).reset_index(drop = True))
+
+    def frozen_liquid_anomaly (self, frozen = 'frozen', reference = 'liquid'):
+        # Frozen minus liquid mean surface per lake-year, the point estimate
+        # that snow_bootstrap.bootstrap_snow() puts error bars on
+        seasons = self.seasonal_means()
+        wide = seasons.pivot_table(index = ['lake', 'wtr_yr'], columns = 'lake_phase_est',
+                                   values = 'z_mean')
+        counts = seasons.pivot_table(index = ['lake', 'wtr_yr'], columns = 'lake_phase_est',
+                                     values = 'count', fill_value = 0)
+        out = pd.DataFrame({f'z_{frozen}': wide.get(frozen), f'z_{reference}': wide.get(reference),
+                            f'n_{frozen}': counts.get(frozen), f'n_{reference}': counts.get(reference)},
+                           index = wide.index)
+        out['dz'] = out[f'z_{frozen}'] - out[f'z_{reference}']
+
+        return(out.dropna(subset = ['dz']).reset_index())
+
+    def year_over_year (self, phase = None):
+        # Change in the count-weighted mean surface between consecutive water
+        # years of each lake, optionally for one lake phase only
+        seasons = self.seasonal_means()
+        if phase is not None:
+            seasons = seasons[seasons['lake_phase_est'] == phase]
+        seasons = seasons.assign(z_sum = seasons['z_mean'] * seasons['count'])
+        years = seasons.groupby(['lake', 'wtr_yr'], sort = True)[['count', 'z_sum']].sum()
+        years['z_mean'] = years.pop('z_sum') / years['count']
+        years = years.reset_index()
+        grouped = years.groupby('lake', sort = False)
+        years['wtr_yr_prev'] = grouped['wtr_yr'].shift()
+        years['dz'] = years['z_mean'] - grouped['z_mean'].shift()
+
+        return(years.dropna(subset = ['dz']).reset_index(drop = True))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Small local HTTP service over the GSWO results, so dashboards can ask for one
+lake instead of loading GSWO_robust_lakes.shp and GSWO_robust_points.shp
+whole. Everything is loaded and indexed once at startup (lakes in an
+STRtree, points and passes sorted by lake with offsets), and responses are
+kept in an LRU cache.
+
+GET /lakes/<id>                    lake attributes, bounds and lake-year summary
+GET /lakes?bbox=minx,miny,maxx,maxy[&crs=EPSG:4326]   lakes intersecting a box
+GET /lakes/<id>/series             per-date series (needs GSWO_lake_series.npz)
+GET /lakes/<id>/histogram?bins=50[&wtr_yr=WY2021]     elevation histogram
+
+The lake-year summary is the one 4.2 and `cli.py summary` report by
+default: stage 3's stats (every joined point below z_max) with the sketch
+medians/IQRs, not the use_robust_filter / --robust-filter variant.
+
+python cli.py serve --working-dir /path/to/IceSat2-Lakes --port 8765
+"""
+
+import functools
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import CRS, Transformer
+from pyproj.exceptions import CRSError
+
+import lake_series
+import lake_stats
+import quantile_sketch
+
+# %% 1. Store
+
+
+class LakeStore:
+
+    # Read-only, so one store is shared by every request thread
+    def __init__ (self, working_dir, layer = 'GSWO', z_max = 10000):
+        data_intermediate = os.path.join(working_dir, 'data_intermediate', '')
+        key = 'area_rank_id'
+
+        # Shapefiles truncate area_rank_id to 10 characters
+        lakes = gpd.read_file(data_intermediate + f'Lakes{layer}_v2.shp')
+        self.lakes = lakes.rename(columns = {'area_rank_': key})
+        self.lake_ids = pd.Index(self.lakes[key])
+        self.tree = shapely.STRtree(np.asarray(self.lakes.geometry))
+
+        stats_path = data_intermediate + f'lake_year_stats_{layer}.pkl'
+        self.summary = None
+        if os.path.exists(stats_path):
+            summary = lake_stats.LakeYearStats.load(stats_path).summary()
+            sketch_path = data_intermediate + f'lake_date_sketches_{layer}.pkl'
+            if os.path.exists(sketch_path):
+                sketches = quantile_sketch.GroupSketches.load(sketch_path).rollup([key, 'wtr_yr'])
+                summary = summary.merge(sketches.summary(), on = [key, 'wtr_yr'], how = 'left')
+            self.summary = {lake: rows.drop(columns = key) for lake, rows in summary.groupby(key)}
+
+        series_path = data_intermediate + f'{layer}_lake_series.npz'
+        self.series = lake_series.LakeSeries.load(series_path) if os.path.exists(series_path) else None
+
+        # Only what the histograms need, sorted by lake so a lake is one slice
+        points = gpd.read_file(data_intermediate + f'ICESat2_pts_{layer}.shp', ignore_geometry = True,
+                               columns = ['area_rank_', 'height', 'delta_time'])
+        points = points[points['height'] < z_max].sort_values('area_rank_', kind = 'stable')
+        self.z = points['height'].to_numpy(dtype = 'float64')
+        self.wtr_yr = lake_stats.wtr_yr_from_date(lake_stats.obs_date_from_delta(points['delta_time']))
+        ids, starts = np.unique(points['area_rank_'].to_numpy(), return_index = True)
+        self.point_rows = dict(zip(ids, zip(starts, np.append(starts[1:], len(points)))))
+
+    def lake (self, lake_id):
+        row = self.lakes.iloc[self.lake_ids.get_loc(lake_id)]
+        out = {k: v for k, v in row.drop(labels = 'geometry').items()}
+        out['bounds'] = list(row.geometry.bounds)
+        out['crs'] = self.lakes.crs.to_string()
+        if self.summary is not None and lake_id in self.summary:
+            out['lake_years'] = self.summary[lake_id].to_dict(orient = 'records')
+
+        return(out)
+
+    def lakes_in_bbox (self, bbox, crs = None):
+        # ValueError for anything but 4 finite numbers or an unknown crs
+        bbox = np.asarray(bbox, dtype = 'float64')
+        if bbox.shape != (4,) or not np.isfinite(bbox).all():
+            raise ValueError('bbox needs 4 finite numbers: minx,miny,maxx,maxy')
+        if crs is not None:
+            try:
+                crs = CRS.from_user_input(crs)
+            except CRSError:
+                raise ValueError(f'unknown crs: {crs}')
+        if crs is not None and crs != self.lakes.crs:
+            bbox = Transformer.from_crs(crs, self.lakes.crs, always_xy = True).transform_bounds(*bbox)
+        hits = np.sort(self.tree.query(shapely.box(*bbox), predicate = 'intersects'))
+        found = self.lakes.iloc[hits]
+
+        return([{'area_rank_id': i, 'area_m2': a}
+                for i, a in zip(found['area_rank_id'], found['area_m2'])])
+
+    def lake_series (self, lake_id):
+        if self.series is None:
+            raise LookupError('no lake series store, run 4.2 first')
+        return(self.series.lake_series(lake_id).to_dict(orient = 'records'))
+
+    def histogram (self, lake_id, bins = 50, wtr_yr = None):
+        start, stop = self.point_rows[lake_id]
+        z = self.z[start:stop]
+        if wtr_yr is not None:
+            z = z[self.wtr_yr[start:stop] == wtr_yr]
+        counts, edges = np.histogram(z, bins = bins)
+
+        return({'area_rank_id': lake_id, 'wtr_yr': wtr_yr, 'n': len(z),
+                'counts': counts.tolist(), 'edges': edges.tolist()})
+
+# %% 2. HTTP
+
+
+def _json_default (value):
+    # numpy scalars, dates and the like
+    if hasattr(value, 'item'):
+        return(value.item())
+
+    return(str(value))
+
+
+def _clean (value):
+    # JSON has no NaN/inf (browsers reject them), missing values become null
+    if isinstance(value, dict):
+        return({k: _clean(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return([_clean(v) for v in value])
+    if isinstance(value, (float, np.floating)) and not np.isfinite(value):
+        return(None)
+    if value is pd.NA or value is pd.NaT:
+        return(None)
+
+    return(value)
+
+
+def make_responder (store, cache_size = 1024):
+    # (path, sorted query) -> (status, body). Cached, the store never changes.
+    @functools.lru_cache(maxsize = cache_size)
+    def respond (path, query):
+        params = dict(query)
+        parts = [p for p in path.split('/') if p]
+        try:
+            if parts == ['lakes'] and 'bbox' in params:
+                bbox = [float(v) for v in params['bbox'].split(',')]
+                body = store.lakes_in_bbox(bbox, params.get('crs'))
+            elif len(parts) == 2 and parts[0] == 'lakes':
+                body = store.lake(parts[1])
+            elif len(parts) == 3 and parts[0] == 'lakes' and parts[2] == 'series':
+                body = store.lake_series(parts[1])
+            elif len(parts) == 3 and parts[0] == 'lakes' and parts[2] == 'histogram':
+                body = store.histogram(parts[1], int(params.get('bins', 50)), params.get('wtr_yr'))
+            else:
+                return(404, json.dumps({'error': f'unknown path {path}'}).encode())
+        except KeyError:
+            return(404, json.dumps({'error': f'not found: {path}'}).encode())
+        except (LookupError, ValueError) as e:
+            return(400, json.dumps({'error': str(e)}).encode())
+        except Exception as e:
+            # Anything else still gets an answer instead of a dropped connection
+            return(500, json.dumps({'error': f'{type(e).__name__}: {e}'}).encode())
+
+        return(200, json.dumps(_clean(body), default = _json_default, allow_nan = False).encode())
+
+    return(respond)
+
+
+def make_handler (respond):
+
+    class LakeHandler(BaseHTTPRequestHandler):
+
+        def do_GET (self):
+            url = urlsplit(self.path)
+            query = tuple(sorted((k, v[-1]) for k, v in parse_qs(url.query).items()))
+            status, body = respond(url.path, query)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message (self, format, *args):
+            # Quiet, dashboards poll a lot
+            pass
+
+    return(LakeHandler)
+
+
+def serve (store, host = '127.0.0.1', port = 8765, cache_size = 1024):
+    respond = make_responder(store, cache_size)
+    server = ThreadingHTTPServer((host, port), make_handler(respond))
+    print(f'Serving lakes on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return(respond.cache_info())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming, mergeable lake-year statistics. Points get added in batches as
+they are labelled with a lake, so the 4.2 Summary table exists as soon as
+the join is done.
+"""
+
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Per the ATL06 data dictionary delta_time is seconds since 2018-01-01
+ATL06_epoch = np.datetime64('2018-01-01T00:00:00', 'us')
+
+# %% 1. Vectorized date helpers
+
+
+def obs_date_from_delta (delta_time):
+    # Same thing as calendar_from_delta() in 4.x but for whole arrays at once
+    seconds = np.asarray(delta_time, dtype = 'float64')
+    stamps = ATL06_epoch + (seconds * 1e6).astype('timedelta64[us]')
+
+    return(stamps.astype('datetime64[D]'))
+
+
+def wtr_yr_from_date (obs_date):
+    # October onwards belongs to the next water year
+    obs_date = np.asarray(obs_date, dtype = 'datetime64[D]')
+    years = obs_date.astype('datetime64[Y]').astype(int) + 1970
+    months = obs_date.astype('datetime64[M]').astype(int) % 12 + 1
+    wtr_yr = np.where(months >= 10, years + 1, years)
+
+    return(np.char.add('WY', wtr_yr.astype(str)))
+
+
+def lake_phase_from_date (obs_date):
+    # Vectorized lake_phaser() from 4.1, same month ranges
+    obs_date = np.asarray(obs_date, dtype = 'datetime64[D]')
+    months = obs_date.astype('datetime64[M]').astype(int) % 12 + 1
+    phase = np.full(len(months), 'frozen', dtype = object)
+    phase[months == 5] = 'intermediate_spring'
+    phase[months == 10] = 'intermediate_fall'
+    phase[(months >= 6) & (months <= 9)] = 'liquid'
+
+    return(phase)
+
+# %% 2. Mean/variance accumulator (Welford, batched with Chan's formula)
+
+
+def _combine (a, b):
+    # a and b are DataFrames with n, mean, m2 on the same index
+    n = a['n'] + b['n']
+    delta = b['mean'] - a['mean']
+    safe_n = n.where(n > 0, 1)
+    out = pd.DataFrame(index = a.index)
+    out['n'] = n
+    out['mean'] = a['mean'] + delta * b['n'] / safe_n
+    out['m2'] = a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / safe_n
+
+    return(out)
+
+
+class LakeYearStats:
+
+    # Group keys and columns match the 4.2 Summary table
+    def __init__ (self, keys = ('area_rank_id', 'wtr_yr'), value = 'z',
+                  date = 'obs_date', first = ('area_m2',)):
+        self.keys = list(keys)
+        self.value = value
+        self.date = date
+        self.first = list(first)
+        index = pd.MultiIndex.from_arrays([[] for k in self.keys], names = self.keys)
+        self.moments = pd.DataFrame({'n': pd.Series(dtype = 'int64'),
+                                     'mean': pd.Series(dtype = 'float64'),
+                                     'm2': pd.Series(dtype = 'float64')}, index = index)
+        self.firsts = pd.DataFrame(columns = self.first, index = index)
+        self.dates = {}
+
+    def update (self, batch):
+        # Add a batch of labelled points. Only one groupby per batch.
+        batch = batch[batch[self.value].notna()]
+        if len(batch) == 0:
+            return(self)
+
+        grouped = batch.groupby(self.keys, sort = False)
+        part = pd.DataFrame({'n': grouped[self.value].count()})
+        part['mean'] = grouped[self.value].mean()
+        part['m2'] = grouped[self.value].var(ddof = 0) * part['n']
+        firsts = grouped[self.first].first() if self.first else None
+
+        pairs = batch[self.keys + [self.date]].drop_duplicates()
+        dates = {}
+        for key, group in pairs.groupby(self.keys, sort = False)[self.date]:
+            dates[key] = set(np.asarray(group, dtype = 'datetime64[D]').tolist())
+
+        return(self._absorb(part, firsts, dates))
+
+    def merge (self, other):
+        # Fold another worker's accumulator into this one
+        return(self._absorb(other.moments, other.firsts, other.dates))
+
+    def _absorb (self, moments, firsts, dates):
+        index = self.moments.index.union(moments.index)
+        a = self.moments.reindex(index, fill_value = 0)
+        b = moments.reindex(index, fill_value = 0)
+        self.moments = _combine(a, b)
+        self.moments['n'] = self.moments['n'].astype('int64')
+        if firsts is not None:
+            self.firsts = self.firsts.reindex(index).combine_first(firsts)
+        for key, values in dates.items():
+            self.dates.setdefault(key, set()).update(values)
+
+        return(self)
+
+    def summary (self):
+        # Same columns as the groupby().agg() Summary in 4.2
+        out = self.moments.copy()
+        out['z_mean'] = out['mean']
+        # Sample std like pandas, undefined for single observations
+        out['z_std'] = np.sqrt(out['m2'] / (out['n'] - 1).where(out['n'] > 1))
+        out['obs_count'] = out['n']
+        out = out.join(self.firsts)
+        out['obs_dates_list'] = [sorted(str(d) for d in self.dates.get(key, ()))
+                                 for key in out.index]
+        # Not .str.len(), an empty summary has no list values to infer from
+        out['obs_date_unique'] = np.array([len(d) for d in out['obs_dates_list']], dtype = 'int64')
+        out = out.drop(columns = ['n', 'mean', 'm2']).reset_index()
+
+        return(out)
+
+    def save (self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load (path):
+        with open(path, 'rb') as f:
+            stats = pickle.load(f)
+
+        return(stats)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Splits an IceSat2 order into spatial tiles and time chunks so large study
+areas don't become one huge, all-or-nothing NSIDC order.
+"""
+
+import datetime as dt
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import shapely
+
+# NSIDC granule names look like ATL06_20211015123456_03921305_006_01.h5
+# The 8 digit block is RGT (4), cycle (2) and orbit segment (2).
+
+
+def granule_parts (granule_id):
+    # Strip any 'processed_' prefix added by the subsetter
+    name = os.path.basename(granule_id).replace('processed_', '')
+    fields = name.split('_')
+    track_block = fields[2]
+
+    return({'product': fields[0],
+            'datetime': dt.datetime.strptime(fields[1], '%Y%m%d%H%M%S'),
+            'rgt': track_block[0:4],
+            'cycle': track_block[4:6],
+            'orbit_segment': track_block[6:8]})
+
+# %% 1. Tiles and chunks
+
+
+def make_tiles (study_polygon, tile_deg = 1.0):
+    # Grid the polygon's bounds into tile_deg boxes and keep the overlapping bits
+    minx, miny, maxx, maxy = study_polygon.bounds
+    tiles = []
+    x = minx
+    while x < maxx:
+        y = miny
+        while y < maxy:
+            cell = shapely.box(x, y, min(x + tile_deg, maxx), min(y + tile_deg, maxy))
+            piece = cell.intersection(study_polygon)
+            if not piece.is_empty:
+                tiles.append(piece)
+            y += tile_deg
+        x += tile_deg
+
+    return(tiles)
+
+
+def make_chunks (begining, end, chunk_days = 91):
+    # 91 days is one ICESat-2 repeat cycle, so a chunk rarely holds an RGT twice
+    start = dt.date.fromisoformat(begining)
+    stop = dt.date.fromisoformat(end)
+    chunks = []
+    while start < stop:
+        chunk_end = min(start + dt.timedelta(days = chunk_days), stop)
+        chunks.append((start.isoformat(), chunk_end.isoformat()))
+        start = chunk_end
+
+    return(chunks)
+
+# %% 2. Granule lists (live from CMR or from the offline cache)
+
+
+def _footprint (entry):
+    # CMR returns either 'polygons' (lat lon pairs) or 'boxes' (s w n e)
+    if entry.get('polygons'):
+        vals = [float(v) for v in entry['polygons'][0][0].split()]
+        return(shapely.Polygon(list(zip(vals[1::2], vals[0::2]))))
+    if entry.get('boxes'):
+        s, w, n, e = [float(v) for v in entry['boxes'][0].split()]
+        return(shapely.box(w, s, e, n))
+
+    return(None)
+
+
+def fetch_granule_list (product, coords_list, time, cache_path = None):
+    # Heavy import only when we actually talk to NSIDC
+    import icepyx as ipx
+
+    query = ipx.Query(product = product, spatial_extent = coords_list, date_range = time)
+    query.avail_granules()
+    # Only keep the fields the planner needs so the cache stays small
+    granules = [{'producer_granule_id': g['producer_granule_id'],
+                 'granule_size': float(g.get('granule_size', 0)),
+                 'time_start': g['time_start'],
+                 'polygons': g.get('polygons'),
+                 'boxes': g.get('boxes')}
+                for g in query.granules.avail]
+
+    if cache_path is not None:
+        with open(cache_path, 'w') as f:
+            json.dump(granules, f)
+
+    return(granules)
+
+
+def load_granule_list (cache_path):
+    with open(cache_path) as f:
+        granules = json.load(f)
+
+    return(granules)
+
+# %% 3. Build the plan
+
+
+def plan_orders (granules, study_polygon, time, tile_deg = 1.0, chunk_days = 91):
+    # Every granule is assigned to exactly one (chunk, tile) order, the first
+    # tile its footprint touches, so a granule crossing several tiles is never
+    # ordered twice. Each order's extent is the hull of its own granules'
+    # footprints inside the study polygon, not the whole polygon, and its
+    # tracks are kept per cycle so only the RGT/cycle pairs it holds are asked for.
+    tiles = make_tiles(study_polygon, tile_deg)
+    tile_tree = shapely.STRtree(tiles)
+    chunks = make_chunks(time[0], time[1], chunk_days)
+
+    orders = {}
+    seen = set()
+    n_duplicates = 0
+    for g in granules:
+        granule_id = g['producer_granule_id']
+        if granule_id in seen:
+            n_duplicates += 1
+            continue
+        seen.add(granule_id)
+
+        start = g['time_start'][:10]
+        chunk_idx = next((i for i, (c0, c1) in enumerate(chunks) if c0 <= start < c1),
+                         len(chunks) - 1)
+        footprint = _footprint(g)
+        if footprint is None:
+            # No footprint to go on, the order falls back to the whole polygon
+            tile_idx = 0
+            footprint = study_polygon
+        else:
+            hits = tile_tree.query(footprint, predicate = 'intersects')
+            # Granule doesn't touch the polygon at all
+            if len(hits) == 0:
+                continue
+            tile_idx = int(min(hits))
+
+        key = (chunk_idx, tile_idx)
+        if key not in orders:
+            orders[key] = {'name': f'chunk{chunk_idx:02d}_tile{tile_idx:03d}',
+                           'date_range': list(chunks[chunk_idx]),
+                           'granules': [], 'tracks_by_cycle': {},
+                           'footprints': [], 'size_mb': 0.0}
+        order = orders[key]
+        parts = granule_parts(granule_id)
+        order['granules'].append(granule_id)
+        order['tracks_by_cycle'].setdefault(parts['cycle'], set()).add(parts['rgt'])
+        order['footprints'].append(footprint)
+        order['size_mb'] += g.get('granule_size', 0)
+
+    plan = []
+    for key in sorted(orders):
+        order = orders[key]
+        order['tracks_by_cycle'] = {c: sorted(t) for c, t in sorted(order['tracks_by_cycle'].items())}
+        covered = shapely.union_all(order.pop('footprints')).intersection(study_polygon)
+        hull = shapely.convex_hull(covered) if not covered.is_empty else tiles[key[1]]
+        # A hull of a single track can collapse to a line, give it some width
+        if hull.geom_type != 'Polygon':
+            hull = shapely.convex_hull(hull.buffer(0.01))
+        order['extent'] = [(x, y) for x, y in hull.exterior.coords]
+        plan.append(order)
+
+    return(plan, n_duplicates)
+
+
+def summarize_plan (plan, n_duplicates = 0):
+    # Dry-run numbers: how many orders, granules and MB before anything is sent
+    n_granules = sum(len(o['granules']) for o in plan)
+    size_mb = sum(o['size_mb'] for o in plan)
+    largest = max((o['size_mb'] for o in plan), default = 0)
+
+    return({'n_orders': len(plan), 'n_granules': n_granules,
+            'n_duplicates_dropped': n_duplicates,
+            'total_size_mb': round(size_mb, 1),
+            'largest_order_mb': round(largest, 1)})
+
+# %% 4. Submit and download
+
+
+def _run_order (order, product, var_list, download_path):
+    import icepyx as ipx
+
+    # Each order downloads into its own staging folder so parallel orders
+    # can't trip over each other
+    staging = os.path.join(download_path, '_staging', order['name'])
+    os.makedirs(staging, exist_ok = True)
+
+    # One query per cycle with only the tracks seen in that cycle, a single
+    # tracks x cycles query would also pull every other combination
+    for cycle, tracks in order['tracks_by_cycle'].items():
+        query = ipx.Query(product = product,
+                          spatial_extent = order['extent'],
+                          date_range = order['date_range'],
+                          tracks = tracks,
+                          cycles = [cycle])
+        query.order_vars.append(var_list = var_list)
+        query.order_granules(Coverage = query.order_vars.wanted)
+        query.download_granules(path = staging)
+
+    # Only keep the granules the plan assigned here
+    wanted = {os.path.basename(g) for g in order['granules']}
+    moved = 0
+    for file_name in os.listdir(staging):
+        if file_name.replace('processed_', '') not in wanted:
+            continue
+        target = os.path.join(download_path, file_name)
+        if not os.path.exists(target):
+            shutil.move(os.path.join(staging, file_name), target)
+            moved += 1
+    shutil.rmtree(staging, ignore_errors = True)
+
+    return(order['name'], moved)
+
+
+def submit_orders (plan, product, var_list, download_path, max_workers = 4):
+    # NSIDC throttles heavy users, keep the pool small
+    os.makedirs(download_path, exist_ok = True)
+    results = {}
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        futures = {pool.submit(_run_order, order, product, var_list,
+                               download_path): order['name']
+                   for order in plan}
+        for future in as_completed(futures):
+            name = futures[future]
+            # A failed chunk shouldn't take the others down with it
+            try:
+                results[name] = future.result()[1]
+            except Exception as err:
+                print(f'Order {name} failed: {err}')
+                results[name] = None
+
+    return(results)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Grouped robust outlier filtering for IceSat2 lake points. Replaces the
+hard-coded z < 10000 / diff_from_mean queries with per lake-year (or
+lake-date) MAD or sigma clipping, done for all groups at once.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Scales the MAD so it matches a std for normally distributed data
+MAD_TO_STD = 1.4826
+
+# Rules are applied in order, a point keeps the name of the first rule that
+# rejected it. Methods:
+#   'range' - absolute min/max on a column
+#   'mad'   - iterative |x - median| > k * MAD per group
+#   'sigma' - iterative |x - mean| > k * std per group
+DEFAULT_RULES = [
+    {'name': 'z_above_max', 'method': 'range', 'column': 'z', 'max': 10000},
+    {'name': 'mad_lake_year', 'method': 'mad', 'column': 'z',
+     'by': ['area_rank_id', 'wtr_yr'], 'k': 5, 'iterations': 3},
+    {'name': 'mad_lake_date', 'method': 'mad', 'column': 'z',
+     'by': ['area_rank_id', 'wtr_yr', 'obs_date'], 'k': 3.5, 'iterations': 2},
+    ]
+
+
+def _clip_groups (values, codes, keep, method, k, iterations, min_count):
+    # values/codes/keep are flat arrays, the group statistics come from one
+    # groupby().transform() per iteration so there's no Python loop over lakes
+    rejected = np.zeros(len(values), dtype = bool)
+    codes = pd.Series(codes)
+    for _ in range(iterations):
+        current = pd.Series(np.where(keep & ~rejected, values, np.nan))
+        grouped = current.groupby(codes)
+        if method == 'mad':
+            center = grouped.transform('median')
+            spread = (current - center).abs().groupby(codes).transform('median') * MAD_TO_STD
+        else:
+            center = grouped.transform('mean')
+            spread = grouped.transform('std')
+        count = grouped.transform('count')
+
+        # Small groups or zero spread can't be judged, leave them alone
+        judged = (count >= min_count) & (spread > 0)
+        new = (keep & ~rejected & judged & ((current - center).abs() > k * spread)).to_numpy()
+        if not new.any():
+            break
+        rejected |= new
+
+    return(rejected)
+
+
+def robust_filter (points, rules = DEFAULT_RULES, min_count = 5):
+    # Returns (kept points, reject_reason Series). reject_reason is '' for kept
+    # points so the rejected ones can be looked at later.
+    keep = np.ones(len(points), dtype = bool)
+    reason = np.full(len(points), '', dtype = object)
+
+    for rule in rules:
+        values = points[rule['column']].to_numpy(dtype = 'float64')
+        if rule['method'] == 'range':
+            bad = np.zeros(len(points), dtype = bool)
+            if 'min' in rule:
+                bad |= values <= rule['min']
+            if 'max' in rule:
+                bad |= values >= rule['max']
+            bad |= np.isnan(values)
+            bad &= keep
+        elif rule['method'] in ('mad', 'sigma'):
+            codes = points.groupby(rule['by'], sort = False).ngroup().to_numpy()
+            bad = _clip_groups(values, codes, keep, rule['method'], rule['k'],
+                               rule.get('iterations', 1), min_count)
+        else:
+            raise ValueError(f"Unknown outlier method: {rule['method']}")
+
+        reason[bad] = rule['name']
+        keep &= ~bad
+
+    reject_reason = pd.Series(reason, index = points.index, name = 'reject_reason')
+
+    return(points[keep], reject_reason)
+
+
+def rejection_counts (reject_reason):
+    # How many points each rule threw out
+    counts = reject_reason[reject_reason != ''].value_counts()
+
+    return(counts)
+
+
+def rejection_table (points, reject_reason, by):
+    # Points per group and rule, 'kept' for the ones no rule rejected. One
+    # row per group so the filtering can be audited after the fact.
+    reason = reject_reason.replace('', 'kept')
+    table = pd.crosstab([points[c] for c in by], reason)
+    table.columns.name = None
+
+    return(table.reset_index())
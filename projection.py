@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project the points once, at ingest. Stage 2 adds x/y in the project CRS and
+x_web/y_web in EPSG:3857 (for the QGIS exports) next to lat/lon, using
+pyproj in chunks over a few threads (pyproj releases the GIL while it
+transforms). Later stages build geometries from those columns instead of
+calling to_crs on millions of points.
+
+The project CRS is picked once from the extent of the whole study area (one
+CRS per project, not one per region): the UTM zone of its center when the
+area is no wider than a zone, otherwise an equal-area EASE-Grid 2.0 grid:
+the polar Lambert azimuthal ones (EPSG:6931 / EPSG:6932) at high latitudes,
+the global cylindrical one (EPSG:6933) elsewhere. Stage 2 writes the choice,
+and the CRS its x/y columns are in, to data_intermediate/projection.json and
+stage 3 reads them back.
+
+Lake areas (and the GSWO area_rank_id built from them) don't depend on that
+choice, they are always measured in area_crs.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+from pyproj import Transformer
+
+web_crs = 'EPSG:3857'
+# Fixed equal-area CRS for lake areas, whatever the project CRS is
+area_crs = 'EPSG:6933'
+state_file = 'projection.json'
+
+# %% 1. Picking a projection
+
+
+def utm_epsg (lon, lat):
+    zone = int(np.floor((lon + 180) / 6) % 60) + 1
+
+    return(f'EPSG:{32600 + zone if lat >= 0 else 32700 + zone}')
+
+
+def pick_crs (minx, miny, maxx, maxy):
+    # Bounds in lon/lat degrees
+    lon_c, lat_c = (minx + maxx) / 2, (miny + maxy) / 2
+    if maxx - minx <= 6:
+        return(utm_epsg(lon_c, lat_c))
+    # Equal area, not polar stereographic (3413/3031 are conformal)
+    if lat_c >= 60:
+        return('EPSG:6931')
+    if lat_c <= -60:
+        return('EPSG:6932')
+
+    return('EPSG:6933')
+
+
+def save_crs (directory, crs_proj, xy_crs = None):
+    # xy_crs is the CRS of the x/y columns written at ingest, crs_proj by default
+    with open(os.path.join(directory, state_file), 'w') as f:
+        json.dump({'crs_proj': crs_proj, 'xy_crs': xy_crs or crs_proj}, f)
+
+
+def load_crs (directory, default = 'EPSG:32624'):
+    # The project CRS stage 2 used for x/y, or the old fixed one
+    path = os.path.join(directory, state_file)
+    if not os.path.exists(path):
+        return(default)
+    with open(path) as f:
+        return(json.load(f)['crs_proj'])
+
+
+def load_xy_crs (directory):
+    # CRS of the stored x/y columns, None when unknown (no projection.json,
+    # so the csv predates them and lat/lon gets projected instead)
+    path = os.path.join(directory, state_file)
+    if not os.path.exists(path):
+        return(None)
+    with open(path) as f:
+        state = json.load(f)
+
+    return(state.get('xy_crs', state['crs_proj']))
+
+# %% 2. Chunked, threaded transforms
+
+
+_local = threading.local()
+
+
+def _transformer (src, dst):
+    # Transformer objects aren't safe to share between threads, one each
+    cache = getattr(_local, 'transformers', None)
+    if cache is None:
+        cache = _local.transformers = {}
+    if (src, dst) not in cache:
+        cache[(src, dst)] = Transformer.from_crs(src, dst, always_xy = True)
+
+    return(cache[(src, dst)])
+
+
+def transform_xy (x, y, src, dst, chunk_size = 500_000, n_workers = 4):
+    # Returns projected (x, y) arrays. Chunks fill preallocated output.
+    x = np.asarray(x, dtype = 'float64')
+    y = np.asarray(y, dtype = 'float64')
+    out_x = np.empty_like(x)
+    out_y = np.empty_like(y)
+
+    def work (start):
+        stop = start + chunk_size
+        out_x[start:stop], out_y[start:stop] = _transformer(src, dst).transform(x[start:stop],
+                                                                                y[start:stop])
+
+    starts = range(0, len(x), chunk_size)
+    if n_workers <= 1 or len(starts) <= 1:
+        for start in starts:
+            work(start)
+    else:
+        with ThreadPoolExecutor(max_workers = n_workers) as pool:
+            list(pool.map(work, starts))
+
+    return(out_x, out_y)
+
+
+def ingest_targets (crs_proj):
+    # (crs, x column, y column) added at ingest. Names fit shapefile limits.
+    return([(crs_proj, 'x', 'y'), (web_crs, 'x_web', 'y_web')])
+
+
+def add_projected (frame, targets, lon = 'lon', lat = 'lat', chunk_size = 500_000, n_workers = 4):
+    # Adds the projected columns for every target to frame, in place
+    for crs, x_col, y_col in targets:
+        frame[x_col], frame[y_col] = transform_xy(frame[lon].to_numpy(), frame[lat].to_numpy(),
+                                                  'EPSG:4326', crs, chunk_size, n_workers)
+
+    return(frame)
+
+# %% 3. Geometries from stored coordinates
+
+
+def points_in (frame, crs, x_col, y_col):
+    # GeoDataFrame with point geometry from columns already in crs
+    return(gpd.GeoDataFrame(frame, geometry = gpd.points_from_xy(frame[x_col], frame[y_col]),
+                            crs = crs))
+
+
+def to_web (points):
+    # Points in EPSG:3857 for QGIS. Uses x_web/y_web from ingest when they are
+    # there, otherwise transforms the current coordinates (threaded, once).
+    if {'x_web', 'y_web'} <= set(points.columns):
+        return(points_in(points.drop(columns = points.geometry.name), web_crs, 'x_web', 'y_web'))
+    x, y = transform_xy(points.geometry.x.to_numpy(), points.geometry.y.to_numpy(),
+                        points.crs, web_crs)
+    out = gpd.GeoDataFrame(points.drop(columns = points.geometry.name),
+                           geometry = gpd.points_from_xy(x, y), crs = web_crs)
+
+    return(out)
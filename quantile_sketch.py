@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mergeable quantile sketches (t-digest) per group, e.g. per lake-year-date.
+Means and stds get dragged around by the z outliers, medians and IQRs don't,
+but exact ones need every point of a group in memory at once. A t-digest
+keeps at most ~compression/2 weighted centroids per group, small near the
+tails and larger in the middle, so percentiles stay accurate (to well under
+1% of rank in the tails) whatever the number of points.
+
+All groups live in one centroid table and are compressed together with
+groupby/cumsum, there is no per-group Python loop. Works like
+lake_stats.LakeYearStats: update() with batches during the join, merge()
+sketches from other chunks or workers, then quantiles() or summary().
+"""
+
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# %% 1. Compression
+
+
+def _compress (centroids, keys, compression):
+    # centroids has keys + mean, weight. Sort within each group, then put
+    # every centroid whose starting rank falls in the same unit of the k1
+    # scale function k(q) = compression / 2pi * asin(2q - 1) into one.
+    centroids = centroids.sort_values(keys + ['mean'], kind = 'stable')
+    weight = centroids['weight'].to_numpy(dtype = 'float64')
+    grouped = centroids.groupby(keys, sort = False)['weight']
+    total = grouped.transform('sum').to_numpy(dtype = 'float64')
+    q_left = (grouped.cumsum().to_numpy(dtype = 'float64') - weight) / total
+    k = compression / (2 * np.pi) * np.arcsin(np.clip(2 * q_left - 1, -1, 1))
+
+    work = centroids[keys].copy()
+    work['bucket'] = np.floor(k + compression / 4).astype(np.int64)
+    work['mw'] = centroids['mean'].to_numpy() * weight
+    work['weight'] = weight
+    # sort = False keeps the sorted order, buckets are contiguous in a group
+    merged = work.groupby(keys + ['bucket'], sort = False)[['mw', 'weight']].sum()
+    merged['mean'] = merged['mw'] / merged['weight']
+    merged = merged.reset_index()[keys + ['mean', 'weight']]
+
+    return(merged)
+
+
+def _extremes (frame, keys):
+    # Per-group min of the min column and max of the max column
+    grouped = frame.groupby(keys, sort = False)
+
+    return(pd.DataFrame({'min': grouped['min'].min(), 'max': grouped['max'].max()}).reset_index())
+
+# %% 2. Per-group sketches
+
+
+class GroupSketches:
+
+    # Same default keys as the lake-year stats, plus the date
+    def __init__ (self, keys = ('area_rank_id', 'wtr_yr', 'obs_date'), value = 'z',
+                  compression = 100):
+        self.keys = list(keys)
+        self.value = value
+        self.compression = compression
+        self.centroids = pd.DataFrame({k: [] for k in self.keys + ['mean', 'weight']})
+        # Exact min/max so the outermost percentiles don't extrapolate
+        self.extremes = pd.DataFrame({k: [] for k in self.keys + ['min', 'max']})
+
+    def update (self, batch):
+        # Every point starts as a centroid of weight 1
+        batch = batch.dropna(subset = self.keys + [self.value])
+        if len(batch) == 0:
+            return(self)
+        points = batch[self.keys].copy()
+        points['mean'] = batch[self.value].to_numpy(dtype = 'float64')
+        points['weight'] = 1.0
+        extremes = _extremes(points.rename(columns = {'mean': 'min'}).assign(max = points['mean']),
+                             self.keys)
+
+        return(self._absorb(points, extremes))
+
+    def merge (self, other):
+        # Fold in a sketch from another chunk or worker
+        return(self._absorb(other.centroids, other.extremes))
+
+    def _absorb (self, centroids, extremes):
+        # Only the groups that got new centroids need compressing again
+        new_keys = pd.MultiIndex.from_frame(extremes[self.keys])
+        touched = pd.MultiIndex.from_frame(self.centroids[self.keys]).isin(new_keys)
+        fresh = pd.concat([self.centroids[touched], centroids], ignore_index = True)
+        self.centroids = pd.concat([self.centroids[~touched],
+                                    _compress(fresh, self.keys, self.compression)],
+                                   ignore_index = True)
+        self.extremes = _extremes(pd.concat([self.extremes, extremes], ignore_index = True),
+                                  self.keys)
+
+        return(self)
+
+    def rollup (self, keys):
+        # Coarser groups from finer ones, e.g. lake-year from lake-year-date.
+        # Merging centroids is exactly what merge() does, so no accuracy is lost
+        # beyond what compressing again costs.
+        keys = list(keys)
+        out = GroupSketches(keys, self.value, self.compression)
+        out.centroids = _compress(self.centroids[keys + ['mean', 'weight']], keys,
+                                  self.compression)
+        out.extremes = _extremes(self.extremes, keys)
+
+        return(out)
+
+    def quantiles (self, qs):
+        # One row per group, one column per q. All groups in one np.interp:
+        # each group gets its own stretch of the x axis, from min at rank 0,
+        # through its centroids at their middle ranks, to max at rank n.
+        qs = np.atleast_1d(np.asarray(qs, dtype = 'float64'))
+        cent = self.centroids.sort_values(self.keys + ['mean'], kind = 'stable')
+        grouped = cent.groupby(self.keys, sort = False)['weight']
+        groups = grouped.sum().rename('total').reset_index()
+        groups = groups.merge(self.extremes, on = self.keys, how = 'left')
+        total = groups['total'].to_numpy()
+        # +1 gap between groups so one group's max never lands on the next one's min
+        offset = np.cumsum(total + 1) - (total + 1)
+
+        # ngroup() numbers groups in the same (sorted) order as groups
+        cent_offset = offset[grouped.ngroup().to_numpy()]
+        middle = grouped.cumsum().to_numpy() - cent['weight'].to_numpy() / 2
+        x = np.concatenate([offset, cent_offset + middle, offset + total])
+        y = np.concatenate([groups['min'].to_numpy(), cent['mean'].to_numpy(),
+                            groups['max'].to_numpy()])
+        order = np.argsort(x, kind = 'stable')
+        x, y = x[order], y[order]
+
+        out = groups[self.keys].copy()
+        for q in qs:
+            out[f'q{q * 100:g}'] = np.interp(offset + q * total, x, y)
+
+        return(out)
+
+    def summary (self):
+        # Robust counterparts of z_mean/z_std, keyed like the lake-year Summary
+        out = self.quantiles([0.25, 0.5, 0.75])
+        out = out.rename(columns = {'q25': 'z_q25', 'q50': 'z_median', 'q75': 'z_q75'})
+        out['z_iqr'] = out['z_q75'] - out['z_q25']
+
+        return(out)
+
+    def save (self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load (path):
+        with open(path, 'rb') as f:
+            sketches = pickle.load(f)
+
+        return(sketches)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pairs IceSat2 segments from different passes over the same spot of a lake,
+so elevation changes can be read off directly instead of from stacked
+histograms. Uses one KD-tree for all lakes, no O(n^2) comparisons.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+def track_direction (points, track_keys, time_col = 'delta_time'):
+    # Unit along-track vector for every point, from its neighbour on the same
+    # track (same pass and beam). Vectorized with groupby().diff().
+    order = points.sort_values(track_keys + [time_col])
+    x = order.geometry.x
+    y = order.geometry.y
+    grouped_x = x.groupby([order[k] for k in track_keys])
+    grouped_y = y.groupby([order[k] for k in track_keys])
+    # Forward difference, falling back on the backward one at the track end
+    dx = (-grouped_x.diff(-1)).fillna(grouped_x.diff())
+    dy = (-grouped_y.diff(-1)).fillna(grouped_y.diff())
+    norm = np.hypot(dx, dy)
+    # Single point tracks get a north-south direction, close to ICESat-2 in Greenland
+    ux = (dx / norm).where(norm > 0, 0.0)
+    uy = (dy / norm).where(norm > 0, 1.0)
+
+    return(ux.reindex(points.index).to_numpy(), uy.reindex(points.index).to_numpy())
+
+
+def pair_repeat_tracks (points, lake_col = 'area_rank_id', value = 'z',
+                        pass_col = 'obs_date', beam_col = 'laser_id',
+                        time_col = 'delta_time', rgt_col = 'rgt',
+                        max_along = 20.0, max_cross = 10.0, same_rgt = True):
+    # Returns one row per matched segment pair from two different passes over
+    # the same lake, with the later minus earlier elevation and time gap.
+    # points need a projected (metre) geometry.
+    points = points.reset_index(drop = True)
+    xy = np.column_stack([points.geometry.x.to_numpy(), points.geometry.y.to_numpy()])
+    ux, uy = track_direction(points, [pass_col, beam_col], time_col)
+
+    # Every candidate within the search radius, then trim with along/cross limits
+    tree = cKDTree(xy)
+    pairs = tree.query_pairs(r = np.hypot(max_along, max_cross), output_type = 'ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+
+    lake = points[lake_col].to_numpy()
+    passes = points[pass_col].to_numpy()
+    keep = (lake[i] == lake[j]) & (passes[i] != passes[j])
+    if same_rgt and rgt_col in points.columns:
+        rgt = points[rgt_col].to_numpy()
+        keep &= rgt[i] == rgt[j]
+    i, j = i[keep], j[keep]
+
+    # Along/cross components relative to the first segment's track
+    d = xy[j] - xy[i]
+    along = np.abs(d[:, 0] * ux[i] + d[:, 1] * uy[i])
+    cross = np.abs(d[:, 0] * uy[i] - d[:, 1] * ux[i])
+    keep = (along <= max_along) & (cross <= max_cross)
+    i, j, along, cross = i[keep], j[keep], along[keep], cross[keep]
+
+    # Put the earlier observation first so dz is always later minus earlier
+    t = points[time_col].to_numpy(dtype = 'float64')
+    swap = t[j] < t[i]
+    i, j = np.where(swap, j, i), np.where(swap, i, j)
+
+    z = points[value].to_numpy(dtype = 'float64')
+    Pairs = pd.DataFrame({lake_col: lake[i],
+                          'date_a': passes[i], 'date_b': passes[j],
+                          'beam_a': points[beam_col].to_numpy()[i],
+                          'beam_b': points[beam_col].to_numpy()[j],
+                          'z_a': z[i], 'z_b': z[j],
+                          'dz': z[j] - z[i],
+                          'dt_days': (t[j] - t[i]) / 86400,
+                          'along_m': along, 'cross_m': cross})
+
+    return(Pairs)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sensitivity of the 'robust' lake cut-offs. Instead of re-running one query
+per threshold choice, every combination in a grid is checked against the
+summary table at once: each column is compared to all its thresholds in
+one broadcast, combinations are ANDs of those boolean columns, and counts
+and stats come out of matrix sums.
+
+grid = {'z_std': ('<', [30, 50, 100]),
+        'obs_count': ('>', [25, 50, 100]),
+        'obs_date_unique': ('>', [3, 5, 8])}
+Sweep = robust_sweep.sweep_thresholds(Summary, grid)
+"""
+
+import itertools
+import operator
+import warnings
+
+import numpy as np
+import pandas as pd
+
+ops = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+# Caps the (rows x combinations) boolean block, about 50 MB
+max_block = 50_000_000
+
+
+def sweep_thresholds (summary, grid, lake_col = 'area_rank_id', count_col = 'obs_count',
+                      std_col = 'z_std', mean_col = 'z_mean'):
+    # One row per threshold combination: retained lake-years, lakes, points and
+    # the mean/median spread of what's retained. Same result as running
+    # summary.query() for each combination, in one pass.
+    names = list(grid)
+    # (rows x thresholds) per column, NaN compares False like in query()
+    masks = []
+    for name in names:
+        op, thresholds = grid[name]
+        values = summary[name].to_numpy(dtype = 'float64')
+        masks.append(ops[op](values[:, None], np.asarray(thresholds, dtype = 'float64')[None, :]))
+
+    combos = np.array(list(itertools.product(*[range(len(grid[n][1])) for n in names])))
+    lake_codes, lake_index = pd.factorize(summary[lake_col])
+    counts = summary[count_col].to_numpy(dtype = 'float64')
+    spread = np.nan_to_num(summary[std_col].to_numpy(dtype = 'float64'))
+    means = np.nan_to_num(summary[mean_col].to_numpy(dtype = 'float64'))
+    n_rows = len(summary)
+
+    out = {'n_lake_years': [], 'n_lakes': [], 'n_points': [], 'std_mean': [], 'std_median': [],
+           'z_mean_weighted': []}
+    step = max(1, max_block // max(n_rows, 1))
+    for start in range(0, len(combos), step):
+        block = combos[start:start + step]
+        keep = np.ones((n_rows, len(block)), dtype = bool)
+        for j, mask in enumerate(masks):
+            keep &= mask[:, block[:, j]]
+
+        n_kept = keep.sum(axis = 0)
+        points = counts @ keep
+        out['n_lake_years'].append(n_kept)
+        out['n_points'].append(points)
+        # A lake counts once if any of its years is kept
+        per_lake = np.zeros((len(lake_index), len(block)), dtype = bool)
+        np.logical_or.at(per_lake, lake_codes, keep)
+        out['n_lakes'].append(per_lake.sum(axis = 0))
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            out['std_mean'].append((spread @ keep) / n_kept)
+            out['z_mean_weighted'].append(((means * counts) @ keep) / points)
+        # Median needs the kept values, masked ones become NaN. Combinations
+        # that keep nothing get NaN, silence the all-NaN warning for those.
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            out['std_median'].append(np.nanmedian(np.where(keep, spread[:, None], np.nan), axis = 0)
+                                     if n_rows else np.full(len(block), np.nan))
+
+    Sweep = pd.DataFrame({name: np.asarray(grid[name][1])[combos[:, j]]
+                          for j, name in enumerate(names)})
+    for key, parts in out.items():
+        Sweep[key] = np.concatenate(parts) if parts else []
+    Sweep['share_points'] = Sweep['n_points'] / counts.sum()
+
+    return(Sweep)
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs the numbered scripts as one pipeline. Every stage declares the files it
+reads and writes, a stage is skipped when its script (and the repo modules
+it imports), inputs and parameters haven't changed since the last run, and
+stages that don't depend on each other run at the same time.
+
+A sweep runs the stages that share no swept parameter once, in working_dir,
+and every combination of the swept stages in its own
+working_dir/sweeps/<combination>/ with its own state file, so combinations
+neither overwrite each other's outputs nor evict each other's cache entries.
+
+python run_pipeline.py --working-dir /path/to/IceSat2-Lakes
+python run_pipeline.py --only analysis_GSWO --param analysis_GSWO.interior_only=true
+python run_pipeline.py --sweep analysis_GSWO.interior_only=true,false
+"""
+
+import argparse
+import ast
+import glob
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Paths are relative to the project working_dir. 'optional' outputs are only
+# written with some parameters (e.g. ingest_atl03), they are tracked when
+# present but a stage isn't rerun just because they are missing.
+# 'glob_params' name parameters holding a glob of extra input files (the DEM
+# tiles), whatever they match counts as an input too.
+# Stage 3 runs once per lake layer (same script, 'layers' parameter), the
+# GSWO and IIML joins don't depend on each other and run at the same time.
+def _merge_stage (layer, sources, extra_inputs = (), extra_outputs = ()):
+    return({'script': '3-Lakes-IceSat2-merge.py',
+            'inputs': ['data_intermediate/IceSat2_Dataframe_v1.csv', 'data_intermediate/projection.json',
+                       'data_intermediate/ingest_settings.json', *extra_inputs,
+                       *[f'data_raw/{source}' for source in sources], 'data_raw/study_bounds.kml'],
+            'outputs': [f'data_intermediate/Lakes{layer}_v2.shp', f'data_intermediate/ICESat2_pts_{layer}.shp',
+                        f'data_intermediate/lake_year_stats_{layer}.pkl', *extra_outputs],
+            'params': {'layers': [layer]}})
+
+
+stages = {
+    # A dry run only fetches and caches the granule list and prints the
+    # order plan, the granules themselves come with dry_run = false
+    'download': {
+        'script': '1-Download.py',
+        'inputs': ['data_raw/study_bounds.kml'],
+        'outputs': ['data_raw/ATL06_granules.json'],
+        'optional': ['data_raw/ATL06', 'data_raw/ATL03', 'data_raw/ATL03_granules.json'],
+        'params': {'dry_run': True, 'include_atl03': False}},
+    'dataframe': {
+        'script': '2-IceSat2-to-DataFrame.py',
+        'inputs': ['data_raw/ATL06', 'data_raw/ATL03', 'data_raw/study_bounds.kml'],
+        'outputs': ['data_intermediate/IceSat2_Dataframe_v1.csv',
+                    'data_intermediate/projection.json',
+                    'data_intermediate/ingest_settings.json'],
+        'optional': ['data_intermediate/IceSat2_ATL03_bins_v1.csv'],
+        'params': {'ingest_atl03': False, 'bin_m': 5.0, 'crs_proj': None,
+                   'quality_filter': True, 'max_sigma': None, 'z_max': 10000}},
+    'merge_GSWO': _merge_stage('GSWO', ['GSWO_raw_lakes.shp'],
+                               extra_inputs = ['data_intermediate/IceSat2_ATL03_bins_v1.csv'],
+                               extra_outputs = ['data_intermediate/lake_date_sketches_GSWO.pkl']),
+    'merge_IIML': _merge_stage('IIML', ['IIML_raw_lakes2017.shp']),
+    # 4-prelim-analysis-IIML.py and 4.1-prelim-analysis-GSW.py aren't stages:
+    # they read the old lake_pts_icesat / GSW_lake_pts_icesat exports that no
+    # stage writes anymore, so run them by hand.
+    'analysis_GSWO': {
+        'script': '4.2-analysis-GSW-v2.py',
+        'inputs': ['data_intermediate/LakesGSWO_v2.shp', 'data_intermediate/ICESat2_pts_GSWO.shp',
+                   'data_intermediate/lake_year_stats_GSWO.pkl',
+                   'data_intermediate/lake_date_sketches_GSWO.pkl'],
+        'glob_params': ['dem_glob'],
+        'outputs': ['data_output/GSWO_robust_lakes.shp', 'data_output/GSWO_robust_points.shp',
+                    'data_output/GSWO_snow_bootstrap.csv', 'data_output/GSWO_threshold_sweep.csv',
+                    'data_intermediate/GSWO_lake_series.npz'],
+        'optional': ['data_output/GSWO_outlier_rejections.csv'],
+        'params': {'use_robust_filter': False, 'interior_only': False, 'dem_glob': None}},
+    }
+
+state_file = 'data_intermediate/.pipeline_state.json'
+
+# %% 1. Parameters handed to the scripts
+
+
+def stage_params (defaults):
+    # Called from inside a script: the defaults, overridden by whatever the
+    # runner passed in ICESAT2_PARAMS. Running a script by hand gives the defaults.
+    params = dict(defaults)
+    params.update(json.loads(os.environ.get('ICESAT2_PARAMS', '{}')))
+
+    return(params)
+
+# %% 2. Fingerprints
+
+
+def _files_under (path):
+    # A directory counts as every file in it, a shapefile as all its sidecars
+    if os.path.isdir(path):
+        return(sorted(os.path.join(root, f) for root, dirs, files in os.walk(path) for f in files))
+    stem, ext = os.path.splitext(path)
+    if ext == '.shp':
+        return([stem + side for side in ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+                if os.path.exists(stem + side)])
+
+    return([path] if os.path.exists(path) else [])
+
+
+def fingerprint_paths (paths):
+    h = hashlib.sha256()
+    for path in paths:
+        for file_path in _files_under(path):
+            st = os.stat(file_path)
+            h.update(f'{file_path}:{st.st_size}:{st.st_mtime_ns};'.encode())
+
+    return(h.hexdigest())
+
+
+def local_imports (script):
+    # The script plus every repo module it imports, directly or through another
+    # repo module (e.g. 4.2 -> lake_stats, atl03_reader -> atl06_reader)
+    found = []
+    todo = [script]
+    while todo:
+        path = todo.pop()
+        if path in found:
+            continue
+        found.append(path)
+        with open(os.path.join(repo_dir, path), 'rb') as f:
+            tree = ast.parse(f.read(), filename = path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for module in names:
+                module_path = module.split('.')[0] + '.py'
+                # The runner only hands the parameters over, it isn't part of a stage
+                if module_path == 'run_pipeline.py':
+                    continue
+                if os.path.exists(os.path.join(repo_dir, module_path)):
+                    todo.append(module_path)
+
+    return(sorted(found))
+
+
+def stage_key (name, working_dir, params):
+    stage = stages[name]
+    h = hashlib.sha256()
+    for path in local_imports(stage['script']):
+        with open(os.path.join(repo_dir, path), 'rb') as f:
+            h.update(path.encode())
+            h.update(f.read())
+    h.update(fingerprint_paths([os.path.join(working_dir, p) for p in stage['inputs']]).encode())
+    for key in stage.get('glob_params', []):
+        if params.get(key):
+            h.update(fingerprint_paths(sorted(glob.glob(params[key]))).encode())
+    h.update(json.dumps(params, sort_keys = True).encode())
+
+    return(h.hexdigest())
+
+# %% 3. Graph
+
+
+def _all_outputs (stage):
+    return(stage['outputs'] + stage.get('optional', []))
+
+
+def dependencies ():
+    # A stage depends on whichever stage writes one of its inputs
+    producers = {out: name for name, stage in stages.items() for out in _all_outputs(stage)}
+    deps = {}
+    for name, stage in stages.items():
+        deps[name] = sorted({producers[p] for p in stage['inputs']
+                             if p in producers and producers[p] != name})
+
+    return(deps)
+
+
+def upstream_of (targets, deps):
+    # targets plus everything they need
+    needed = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(deps[name])
+
+    return(needed)
+
+
+def downstream_of (names, deps):
+    # names plus everything that needs them
+    found = set(names)
+    grew = True
+    while grew:
+        grew = False
+        for name, needs in deps.items():
+            if name not in found and found & set(needs):
+                found.add(name)
+                grew = True
+
+    return(found)
+
+# %% 4. Running
+
+
+def _run_script (name, working_dir, params, log_dir):
+    env = dict(os.environ)
+    env['ICESAT2_LAKES_DIR'] = working_dir
+    env['ICESAT2_PARAMS'] = json.dumps(params)
+    # Plots go nowhere when run headless
+    env.setdefault('MPLBACKEND', 'Agg')
+    env['PYTHONPATH'] = repo_dir + os.pathsep + env.get('PYTHONPATH', '')
+    log_path = os.path.join(log_dir, f'{name}.log')
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        result = subprocess.run([sys.executable, os.path.join(repo_dir, stages[name]['script'])],
+                                cwd = repo_dir, env = env, stdout = log,
+                                stderr = subprocess.STDOUT)
+
+    return(result.returncode, time.perf_counter() - start, log_path)
+
+
+def run (working_dir, targets = None, overrides = None, force = False, max_workers = 2,
+         upstream = True):
+    # Returns {stage: status}. status is 'skipped', 'ran', 'failed' or 'blocked'.
+    # upstream = False runs only targets and takes whatever they need as done.
+    overrides = overrides or {}
+    deps = dependencies()
+    if upstream:
+        needed = upstream_of(targets or list(stages), deps)
+    else:
+        needed = set(targets)
+        deps = {name: [d for d in needs if d in needed] for name, needs in deps.items()}
+
+    state_path = os.path.join(working_dir, state_file)
+    os.makedirs(os.path.dirname(state_path), exist_ok = True)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+    log_dir = os.path.join(working_dir, 'data_intermediate', 'pipeline_logs')
+    os.makedirs(log_dir, exist_ok = True)
+
+    status = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        while len(status) < len(needed):
+            for name in sorted(needed):
+                if name in status or name in [n for n, k in running.values()]:
+                    continue
+                if any(status.get(d) in ('failed', 'blocked') for d in deps[name]):
+                    status[name] = 'blocked'
+                    continue
+                if not all(status.get(d) in ('ran', 'skipped') for d in deps[name]):
+                    continue
+
+                # Keys are worked out only once upstream is done, so a rerun
+                # upstream shows up here as changed inputs
+                params = dict(stages[name].get('params', {}))
+                params.update(overrides.get(name, {}))
+                key = stage_key(name, working_dir, params)
+                outputs = [os.path.join(working_dir, p) for p in stages[name]['outputs']]
+                tracked = [os.path.join(working_dir, p) for p in _all_outputs(stages[name])]
+                previous = state.get(name, {})
+                if (not force and previous.get('key') == key
+                        and all(os.path.exists(p) for p in outputs)
+                        and previous.get('outputs') == fingerprint_paths(tracked)):
+                    status[name] = 'skipped'
+                    print(f'[skip] {name}')
+                    continue
+
+                print(f'[run ] {name}')
+                future = pool.submit(_run_script, name, working_dir, params, log_dir)
+                running[future] = (name, key)
+
+            if not running:
+                continue
+            done, _ = wait(list(running), return_when = FIRST_COMPLETED)
+            for future in done:
+                name, key = running.pop(future)
+                code, seconds, log_path = future.result()
+                if code == 0:
+                    status[name] = 'ran'
+                    tracked = [os.path.join(working_dir, p) for p in _all_outputs(stages[name])]
+                    state[name] = {'key': key, 'outputs': fingerprint_paths(tracked),
+                                   'seconds': round(seconds, 2)}
+                    with open(state_path, 'w') as f:
+                        json.dump(state, f, indent = 2)
+                    print(f'[done] {name} {seconds:.1f}s')
+                else:
+                    status[name] = 'failed'
+                    print(f'[fail] {name}, see {log_path}')
+
+    return(status)
+
+
+def sweep_dir (working_dir, combo):
+    # e.g. sweeps/analysis_GSWO.interior_only-true
+    slug = '__'.join(item.replace('=', '-').replace(os.sep, '_') for item in combo)
+
+    return(os.path.join(working_dir, 'sweeps', slug))
+
+
+def link_inputs (working_dir, combo_dir, names):
+    # Files the swept stages read but none of them write are linked in from
+    # working_dir, so a combination only ever writes inside combo_dir
+    written = {p for name in names for p in _all_outputs(stages[name])}
+    for sub in ('data_raw', 'data_intermediate', 'data_output'):
+        os.makedirs(os.path.join(combo_dir, sub), exist_ok = True)
+    for name in names:
+        for rel in stages[name]['inputs']:
+            if rel in written:
+                continue
+            source = os.path.join(working_dir, rel)
+            sources = [source] if os.path.isdir(source) else _files_under(source)
+            for src in sources:
+                dst = os.path.join(combo_dir, os.path.relpath(src, working_dir))
+                if not os.path.lexists(dst):
+                    os.symlink(src, dst)
+
+
+def _parse_value (text):
+    # true/false/numbers as JSON, anything else stays a string
+    try:
+        return(json.loads(text.lower() if text.lower() in ('true', 'false') else text))
+    except ValueError:
+        return(text)
+
+
+def _parse_params (items):
+    overrides = {}
+    for item in items or []:
+        target, value = item.split('=', 1)
+        name, key = target.split('.', 1)
+        overrides.setdefault(name, {})[key] = _parse_value(value)
+
+    return(overrides)
+
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = 'Run the IceSat2-Lakes pipeline')
+    parser.add_argument('--working-dir', default = os.environ.get('ICESAT2_LAKES_DIR'),
+                        required = 'ICESAT2_LAKES_DIR' not in os.environ)
+    parser.add_argument('--only', nargs = '+', choices = list(stages),
+                        help = 'run these stages and whatever they need')
+    parser.add_argument('--param', action = 'append', metavar = 'STAGE.KEY=VALUE')
+    parser.add_argument('--sweep', action = 'append', metavar = 'STAGE.KEY=V1,V2',
+                        help = 'run once per value (combinations for several sweeps)')
+    parser.add_argument('--force', action = 'store_true')
+    parser.add_argument('--workers', type = int, default = 2)
+    args = parser.parse_args(argv)
+
+    overrides = _parse_params(args.param)
+    sweeps = []
+    for item in args.sweep or []:
+        target, values = item.split('=', 1)
+        sweeps.append([f'{target}={v}' for v in values.split(',')])
+
+    if not sweeps:
+        results = [run(args.working_dir, args.only, overrides, args.force, args.workers)]
+    else:
+        # Stages without a swept parameter (and not downstream of one) run once
+        deps = dependencies()
+        needed = upstream_of(args.only or list(stages), deps)
+        swept = {item.split('=', 1)[0].split('.', 1)[0] for values in sweeps for item in values}
+        per_combo = downstream_of(swept, deps) & needed
+        shared = needed - per_combo
+        results = [run(args.working_dir, sorted(shared), overrides, args.force, args.workers)] if shared else []
+        if not any(s in ('failed', 'blocked') for r in results for s in r.values()):
+            for combo in itertools.product(*sweeps):
+                combo_overrides = {k: dict(v) for k, v in overrides.items()}
+                for name, params in _parse_params(combo).items():
+                    combo_overrides.setdefault(name, {}).update(params)
+                combo_dir = sweep_dir(args.working_dir, combo)
+                print(f'== {" ".join(combo)} -> {combo_dir}')
+                link_inputs(args.working_dir, combo_dir, per_combo)
+                results.append(run(combo_dir, sorted(per_combo), combo_overrides, args.force,
+                                   args.workers, upstream = False))
+
+    failed = any(s in ('failed', 'blocked') for r in results for s in r.values())
+
+    return(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
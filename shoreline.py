@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Distance from every joined IceSat2 point to its own lake's shoreline, so
+segments mixing in shoreline terrain can be flagged or dropped.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+
+def lake_shorelines (lake_geoms, include_islands = False):
+    # Exterior rings of every lake as one (Multi)LineString per lake.
+    # Multipolygons from the clip keep all of their outer rings.
+    lake_geoms = np.asarray(lake_geoms)
+    if include_islands:
+        return(shapely.boundary(lake_geoms))
+    parts, index = shapely.get_parts(lake_geoms, return_index = True)
+    rings = shapely.get_exterior_ring(parts)
+    # Empty or missing geometries have no parts, number the lakes that do 0..k-1
+    # since multilinestrings() wants consecutive indices
+    has_parts, dense = np.unique(index, return_inverse = True)
+    shores = np.full(len(lake_geoms), None, dtype = object)
+    shores[has_parts] = shapely.multilinestrings(rings, indices = dense)
+
+    return(shores)
+
+
+def distance_to_shore (points, lakes, lake_col = 'area_rank_id',
+                       include_islands = False, n_workers = None):
+    # Both layers need the same projected (metre) crs.
+    # Each point is measured against its own lake only, lakes are split across
+    # threads (shapely 2 drops the GIL inside vectorized calls).
+    shores = pd.Series(lake_shorelines(np.asarray(lakes.geometry), include_islands),
+                       index = lakes[lake_col].to_numpy())
+    shores = shores[~shores.index.duplicated()]
+
+    # Sort by lake so each thread mostly works on a handful of shorelines
+    codes, uniques = pd.factorize(points[lake_col])
+    order = np.argsort(codes, kind = 'stable')
+    pt_geoms = np.asarray(points.geometry)[order]
+    shore_geoms = shores.reindex(uniques).to_numpy()[codes[order]]
+
+    n_workers = n_workers or os.cpu_count()
+    splits = np.array_split(np.arange(len(order)), n_workers)
+    with ThreadPoolExecutor(max_workers = n_workers) as pool:
+        pieces = list(pool.map(lambda idx: shapely.distance(pt_geoms[idx], shore_geoms[idx]),
+                               splits))
+
+    dist = np.empty(len(order))
+    dist[order] = np.concatenate(pieces) if pieces else []
+
+    return(pd.Series(dist, index = points.index, name = 'shore_dist_m'))
+
+
+def edge_flags (shore_dist, min_dist = 30.0):
+    # True for points far enough from shore to be lake surface only.
+    # ATL06 segments are 40 m long, so 30 m keeps most of a segment off the edge.
+    return((shore_dist >= min_dist).rename('is_interior'))
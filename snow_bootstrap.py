@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bootstrap estimate of frozen-minus-liquid lake surface change per lake and
+water year. Frozen surface above the open water surface is the snow (+ ice)
+signal we are after.
+"""
+
+import hashlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Caps the size of one (n_boot x n_points) index block so big lakes don't blow up memory
+max_block = 5_000_000
+
+
+def _resample_stat (values, n_boot, rng, stat):
+    # Vectorized bootstrap: draw every resample as one index matrix, in blocks
+    n = len(values)
+    rows = max(1, max_block // max(n, 1))
+    out = np.empty(n_boot)
+    for start in range(0, n_boot, rows):
+        stop = min(start + rows, n_boot)
+        idx = rng.integers(0, n, size = (stop - start, n))
+        out[start:stop] = stat(values[idx], axis = 1)
+
+    return(out)
+
+
+def _lake_rng (seed, key):
+    # Each lake's own stream from (seed, key), so the draws don't depend on
+    # which batch or worker the lake lands in. sha256, not hash(), which
+    # changes between interpreter runs.
+    digest = hashlib.sha256(repr(tuple(str(k) for k in key)).encode()).digest()
+
+    return(np.random.default_rng(np.random.SeedSequence([seed, int.from_bytes(digest[:8], 'little')])))
+
+
+def _bootstrap_batch (batch, n_boot, ci, seed, statistic):
+    # One worker's share of lakes. batch is a list of (key, frozen, reference)
+    stat = np.median if statistic == 'median' else np.mean
+    alpha = (1 - ci) / 2
+    rows = []
+    for key, frozen, reference in batch:
+        rng = _lake_rng(seed, key)
+        boot = (_resample_stat(frozen, n_boot, rng, stat)
+                - _resample_stat(reference, n_boot, rng, stat))
+        rows.append(key + (len(frozen), len(reference),
+                           stat(frozen) - stat(reference),
+                           boot.std(ddof = 1),
+                           np.quantile(boot, alpha),
+                           np.quantile(boot, 1 - alpha)))
+
+    return(rows)
+
+
+def bootstrap_snow (points, keys = ('area_rank_id', 'wtr_yr'), value = 'z',
+                    phase = 'lake_phase_est', frozen = 'frozen', reference = 'liquid',
+                    n_boot = 1000, ci = 0.95, min_count = 10, statistic = 'median',
+                    n_workers = None, seed = 42):
+    # Returns one row per lake-year with the frozen-minus-reference change (dz)
+    # and its bootstrap standard error and confidence interval.
+    keys = list(keys)
+    points = points[points[phase].isin([frozen, reference])]
+
+    groups = []
+    for key, lake in points.groupby(keys, sort = False):
+        key = key if isinstance(key, tuple) else (key,)
+        is_frozen = (lake[phase] == frozen).to_numpy()
+        values = lake[value].to_numpy(dtype = 'float64')
+        # Need enough points in both phases to say anything
+        if is_frozen.sum() < min_count or (~is_frozen).sum() < min_count:
+            continue
+        groups.append((key, values[is_frozen], values[~is_frozen]))
+
+    columns = keys + ['n_frozen', 'n_reference', 'dz', 'dz_se', 'dz_ci_low', 'dz_ci_high']
+    if len(groups) == 0:
+        return(pd.DataFrame(columns = columns))
+
+    # Interleave lakes across workers so the big ones don't all land in one batch
+    n_workers = n_workers or mp.cpu_count()
+    batches = [groups[i::n_workers] for i in range(n_workers)]
+    batches = [b for b in batches if b]
+
+    # Worker processes only with fork. Under spawn (Windows) every worker would
+    # re-import the unguarded 4.x script that called us, so run the batches
+    # serially instead, same seeds and same results.
+    if len(batches) == 1 or 'fork' not in mp.get_all_start_methods():
+        results = [_bootstrap_batch(batch, n_boot, ci, seed, statistic) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers = len(batches),
+                                 mp_context = mp.get_context('fork')) as pool:
+            results = list(pool.map(_bootstrap_batch, batches,
+                                    [n_boot] * len(batches), [ci] * len(batches),
+                                    [seed] * len(batches), [statistic] * len(batches)))
+
+    # Undo the interleave, rows come out in lake order whatever n_workers is
+    rows = [None] * len(groups)
+    for i, batch in enumerate(results):
+        rows[i::n_workers] = batch
+
+    return(pd.DataFrame(rows, columns = columns))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timing and memory bookkeeping for the pipeline stages. Wrap a block in
+`with metrics.stage('join', rows_in = n) as m:` and set m.rows_out, then
+metrics.write(path) dumps a JSON run report.
+
+psutil is used for RSS and I/O counters when installed, otherwise /proc
+(Linux) or getrusage. Set profile = True on a stage to get a sampling
+profile from pyinstrument (cProfile if pyinstrument isn't installed).
+"""
+
+import datetime as dt
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# No resource module on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# %% 1. Memory and I/O probes
+
+
+def current_rss ():
+    # Resident memory in bytes right now
+    try:
+        import psutil
+        return(psutil.Process().memory_info().rss)
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'))
+    except (OSError, ValueError):
+        return(peak_rss())
+
+
+def peak_rss ():
+    # High water mark for the whole process. Linux reports KB, macOS bytes.
+    if resource is None:
+        try:
+            import psutil
+            return(psutil.Process().memory_info().peak_wset)
+        except (ImportError, AttributeError):
+            return(0)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return(peak if sys.platform == 'darwin' else peak * 1024)
+
+
+def io_bytes ():
+    # (read, written) bytes for the process, None where the OS won't say (macOS)
+    try:
+        import psutil
+        counters = psutil.Process().io_counters()
+        return(counters.read_bytes, counters.write_bytes)
+    except (ImportError, AttributeError, OSError):
+        pass
+    try:
+        fields = {}
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                fields[key] = int(value)
+        return(fields['rchar'], fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return(None)
+
+
+class _RssSampler:
+
+    # Polls RSS in a background thread so each stage gets its own peak,
+    # ru_maxrss only ever goes up over the whole run
+    def __init__ (self, interval = 0.05):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+
+    def _run (self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__ (self):
+        self._thread.start()
+        return(self)
+
+    def __exit__ (self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+# %% 2. Stage records and the run report
+
+
+class StageRecord:
+
+    def __init__ (self, name, rows_in = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss_mb = None
+        self.calls = 0
+        self.profile = None
+
+    def add_file_read (self, path):
+        self.bytes_read += os.path.getsize(path)
+
+    def add_file_written (self, path):
+        # Shapefiles are several files, count the whole set
+        stem, ext = os.path.splitext(path)
+        sidecars = ['.shp', '.shx', '.dbf', '.prj', '.cpg'] if ext == '.shp' else [ext]
+        for side in sidecars:
+            if os.path.exists(stem + side):
+                self.bytes_written += os.path.getsize(stem + side)
+
+    def as_dict (self):
+        return({'name': self.name, 'calls': self.calls,
+                'wall_s': round(self.wall_s, 4), 'cpu_s': round(self.cpu_s, 4),
+                'peak_rss_mb': self.peak_rss_mb,
+                'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                'profile': self.profile})
+
+
+class RunReport:
+
+    def __init__ (self, run_name, report_dir = None, profile = False):
+        self.run_name = run_name
+        self.report_dir = report_dir
+        # Turn profiling on for every stage, or pass profile = True per stage
+        self.profile = profile or bool(os.environ.get('ICESAT2_PROFILE'))
+        self.started = dt.datetime.now().isoformat(timespec = 'seconds')
+        self.stages = {}
+        self._open = {}
+
+    @contextmanager
+    def stage (self, name, rows_in = None, profile = None):
+        # Reusing a name (e.g. inside a loop) adds to the same record
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = StageRecord(name, rows_in)
+        elif rows_in is not None:
+            record.rows_in = (record.rows_in or 0) + rows_in
+
+        profiler = self._start_profiler() if (self.profile if profile is None else profile) else None
+        counted = (record.bytes_read, record.bytes_written)
+        io_start = io_bytes()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        with _RssSampler() as sampler:
+            try:
+                yield(record)
+            finally:
+                record.wall_s += time.perf_counter() - wall_start
+                record.cpu_s += time.process_time() - cpu_start
+                record.calls += 1
+        peak_mb = round(sampler.peak / 1024 ** 2, 1)
+        record.peak_rss_mb = peak_mb if record.peak_rss_mb is None else max(record.peak_rss_mb, peak_mb)
+
+        # Fall back on the OS counters when the stage didn't count its own files
+        io_end = io_bytes()
+        if io_start is not None and io_end is not None:
+            if record.bytes_read == counted[0]:
+                record.bytes_read += io_end[0] - io_start[0]
+            if record.bytes_written == counted[1]:
+                record.bytes_written += io_end[1] - io_start[1]
+
+        if profiler is not None:
+            record.profile = self._stop_profiler(profiler, name)
+
+    @contextmanager
+    def timer (self, name):
+        # Light version of stage() for hot loops, e.g. once per granule: wall
+        # time and the CPU time of this thread only. No RSS sampler thread, no
+        # I/O counters (those would count every other thread's reads too).
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = StageRecord(name)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield(record)
+        finally:
+            record.wall_s += time.perf_counter() - wall_start
+            record.cpu_s += time.thread_time() - cpu_start
+            record.calls += 1
+
+    # start()/stop() do the same as stage() for cell-based scripts, where
+    # indenting a whole cell under a with block isn't practical
+    def start (self, name, rows_in = None, profile = None):
+        context = self.stage(name, rows_in, profile)
+        self._open[name] = context
+
+        return(context.__enter__())
+
+    def stop (self, name, rows_out = None):
+        record = self.stages[name]
+        if rows_out is not None:
+            record.rows_out = rows_out
+        self._open.pop(name).__exit__(None, None, None)
+
+        return(record)
+
+    def _start_profiler (self):
+        try:
+            from pyinstrument import Profiler
+            profiler = Profiler()
+        except ImportError:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return(profiler)
+        profiler.start()
+
+        return(profiler)
+
+    def _stop_profiler (self, profiler, name):
+        out_dir = self.report_dir or '.'
+        os.makedirs(out_dir, exist_ok = True)
+        if hasattr(profiler, 'output_html'):
+            profiler.stop()
+            path = os.path.join(out_dir, f'{self.run_name}_{name}.html')
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = os.path.join(out_dir, f'{self.run_name}_{name}.prof')
+            profiler.dump_stats(path)
+
+        return(path)
+
+    def as_dict (self):
+        return({'run': self.run_name, 'started': self.started,
+                'host': platform.node(), 'python': platform.python_version(),
+                'process_peak_rss_mb': round(peak_rss() / 1024 ** 2, 1),
+                'stages': [r.as_dict() for r in self.stages.values()]})
+
+    def write (self, path = None):
+        if path is None:
+            stamp = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
+            path = os.path.join(self.report_dir or '.', f'{self.run_name}_{stamp}.json')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent = 2)
+
+        return(path)
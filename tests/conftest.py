@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat at the repo root, next to the stage scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _stage3_inputs (work, with_bins = True):
+    # A tiny project: two GSWO lakes and one IIML lake in UTM 24N, study
+    # bounds, and stage 2's outputs (points csv, projection.json, ATL03 bins)
+    import geopandas as gpd
+    import numpy as np
+    import pandas as pd
+    import shapely
+
+    import projection
+
+    crs = 'EPSG:32624'
+    raw, inter = work / 'data_raw', work / 'data_intermediate'
+    raw.mkdir()
+    inter.mkdir()
+    boxes = [shapely.box(500000, 7400000, 501000, 7401000), shapely.box(503000, 7400000, 503500, 7400500)]
+    gswo = gpd.GeoDataFrame({'area': [1.0, 2.0]}, geometry = boxes, crs = crs).to_crs('EPSG:4326')
+    gswo.to_file(raw / 'GSWO_raw_lakes.shp')
+    iiml = gpd.GeoDataFrame({'LakeName': ['x'], 'Source': ['s'], 'NumOfSate': [1], 'Certainty': [1],
+                             'Satellites': ['s'], 'Area': [1e6], 'Length': [4000.0], 'LakeID': [7]},
+                            geometry = boxes[:1])
+    iiml.to_file(raw / 'IIML_raw_lakes2017.shp')
+    bounds = gpd.GeoDataFrame({'Name': ['study']}, geometry = [shapely.box(499000, 7399000, 505000, 7402000)],
+                              crs = crs).to_crs('EPSG:4326')
+    bounds.to_file(raw / 'study_bounds.kml', driver = 'KML')
+
+    # Segments along x = 500500 (big lake), 503250 (small lake) and 507000 (no lake)
+    rng = np.random.default_rng(0)
+    x = np.repeat([500500.0, 503250.0, 507000.0], 40)
+    y = np.tile(np.linspace(7400010, 7400490, 40), 3)
+    delta_time = np.repeat([8.0e7, 8.05e7, 8.1e7, 9.0e7], 30)
+    height = 300 + rng.normal(0, 0.1, len(x))
+    height[3] = 3.0e38
+    lon, lat = projection.transform_xy(x, y, crs, 'EPSG:4326')
+    points = pd.DataFrame({'lat': lat, 'lon': lon, 'height': height, 'delta_time': delta_time,
+                           'x': x, 'y': y, 'laser_id': 'gt1l/', 'rgt': 1, 'cycle': 1})
+    points.to_csv(inter / 'IceSat2_Dataframe_v1.csv')
+    projection.save_crs(inter, crs)
+    if with_bins:
+        bins = points.iloc[:5].assign(n_photons = 10, h_std = 0.1, area_rank_id = 'ID_1')
+        bins.to_csv(inter / 'IceSat2_ATL03_bins_v1.csv')
+
+    return(work)
+
+
+@pytest.fixture
+def stage3_dir (tmp_path):
+    return(_stage3_inputs(tmp_path))
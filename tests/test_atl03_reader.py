@@ -0,0 +1,60 @@
+import geopandas as gpd
+import h5py
+import numpy as np
+import pandas as pd
+import shapely
+
+import atl03_reader
+
+
+def _write_granule (path, n_photons = 1000):
+    # One beam, photons going north along lon -30, 1 m apart, 10 per segment
+    rng = np.random.default_rng(0)
+    lat = 67.0 + np.arange(n_photons) / 111_000
+    conf = np.zeros((n_photons, 5), dtype = 'int8')
+    conf[:, atl03_reader.inland_water] = 4
+    conf[::10, atl03_reader.inland_water] = 0
+    with h5py.File(path, 'w') as f:
+        heights = f.create_group('gt1l/heights')
+        heights['lat_ph'] = lat
+        heights['lon_ph'] = np.full(n_photons, -30.0)
+        heights['h_ph'] = (100 + rng.normal(0, 0.1, n_photons)).astype('float32')
+        heights['delta_time'] = 8.0e7 + np.arange(n_photons) * 1e-4
+        heights['signal_conf_ph'] = conf
+        heights['dist_ph_along'] = (np.arange(n_photons) % 10).astype('float32')
+        geo = f.create_group('gt1l/geolocation')
+        geo['segment_ph_cnt'] = np.full(n_photons // 10, 10)
+        geo['ph_index_beg'] = np.arange(n_photons // 10) * 10 + 1
+        geo['segment_dist_x'] = np.arange(n_photons // 10) * 10.0
+
+    return(lat)
+
+
+def test_bins_only_inside_lakes (tmp_path):
+    path = str(tmp_path / 'processed_ATL03_20200715000000_01000605_006_01.h5')
+    lat = _write_granule(path)
+    # A lake over the first half of the track only
+    lake = gpd.GeoDataFrame({'area_rank_id': ['ID_1']},
+                            geometry = [shapely.box(-30.001, lat[0] - 1e-6, -29.999, lat[499])],
+                            crs = 'EPSG:4326').to_crs('EPSG:32624')
+    index = atl03_reader.LakeIndex(lake, 'area_rank_id')
+    bins = atl03_reader.bin_granule(path, index, bin_m = 50.0, chunk = 128, min_photons = 5)
+
+    assert set(bins['lake']) == {'ID_1'}
+    assert (bins['laser_id'] == 'gt1l/').all()
+    assert (bins['rgt'] == '0100').all()
+    # Low-confidence photons and those outside the lake never make it in
+    assert bins['n_photons'].sum() == 450
+    np.testing.assert_allclose(bins['height'], 100, atol = 0.1)
+    assert bins['lat'].max() < lat[500]
+
+
+def test_bin_sums_add_up_across_chunks ():
+    parts = [pd.DataFrame({'lake': ['a'], 'bin': [0], 'n': [2], 'h': [2.0], 'h2': [2.0],
+                           't': [2.0], 'lon': [0.0], 'lat': [0.0]}).set_index(['lake', 'bin']),
+             pd.DataFrame({'lake': ['a'], 'bin': [0], 'n': [2], 'h': [6.0], 'h2': [18.0],
+                           't': [2.0], 'lon': [0.0], 'lat': [0.0]}).set_index(['lake', 'bin'])]
+    bins = atl03_reader._finish_bins(parts, min_photons = 1)
+    assert bins['n_photons'].item() == 4
+    assert bins['height'].item() == 2.0
+    assert bins['h_std'].item() == 1.0
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import atl06_reader
+from benchmarks import synthetic_atl06
+
+
+@pytest.fixture
+def granules (tmp_path):
+    return(synthetic_atl06.make_granules(str(tmp_path / 'ATL06'), n_granules = 3, n_segments = 500,
+                                         missing_beam_prob = 0.3, seed = 1))
+
+
+def test_granule_tracks ():
+    assert atl06_reader.granule_tracks('processed_ATL06_20181014000000_00010105_006_01.h5') == ('0001', '01')
+
+
+def test_csv_matches_serial_read (granules, tmp_path):
+    out_path = tmp_path / 'pts.csv'
+    n_files, rows = atl06_reader.granules_to_csv(granules, out_path, n_readers = 2, prefetch = 2,
+                                                 progress = False)
+    expected = pd.concat([atl06_reader.granule_frame(g, atl06_reader.read_granule(g, in_memory = False))
+                          for g in granules])
+    assert n_files == 3
+    assert rows == len(expected)
+    written = pd.read_csv(out_path, index_col = 0)
+    np.testing.assert_allclose(written['height'], expected['height'], rtol = 1e-6)
+    assert written['laser_id'].tolist() == expected['laser_id'].tolist()
+
+
+def test_read_error_is_not_hidden (granules, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        atl06_reader.granules_to_csv(granules + [str(tmp_path / 'missing.h5')], tmp_path / 'pts.csv',
+                                     progress = False)
+
+
+def test_segment_mask_rules ():
+    fill = np.float32(3.4028235e38)
+    arrays = {'h_li': np.array([300, fill, 300, 300, 20000, 300, np.nan], dtype = 'float32'),
+              'atl06_quality_summary': np.array([0, 1, 1, 0, 0, 0, 0], dtype = 'int8'),
+              'h_li_sigma': np.array([0.1, 0.1, 0.1, fill, 0.1, 2.0, 0.1], dtype = 'float32')}
+    keep, counts = atl06_reader.segment_mask(arrays, z_max = 10000)
+    assert keep.tolist() == [True, False, False, False, False, True, False]
+    # The fill segment is flagged too, it only counts under the first rule
+    assert counts == {'fill': 2, 'quality_flag': 1, 'sigma': 1, 'z_max': 1}
+    keep, counts = atl06_reader.segment_mask(arrays, max_sigma = 1.0, z_max = 10000)
+    assert keep.tolist() == [True, False, False, False, False, False, False]
+    assert counts['sigma'] == 2
+
+
+def test_segment_mask_missing_quality_vars ():
+    arrays = {'h_li': np.array([300, 3.4028235e38, 300], dtype = 'float32')}
+    keep, counts = atl06_reader.segment_mask(arrays)
+    assert keep.tolist() == [True, False, True]
+    assert counts == {'fill': 1, 'missing_quality_vars': 3}
+
+
+def test_old_granules_warn (granules, tmp_path):
+    import h5py
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        atl06_reader.granules_to_csv(granules, tmp_path / 'pts.csv', progress = False, quality = {})
+    # Strip the quality variables from one granule, like an older release
+    with h5py.File(granules[0], 'r+') as f:
+        for beam in f:
+            group = f[f'{beam}/land_ice_segments']
+            for v in atl06_reader.quality_variables:
+                del group[v]
+    quality = {'z_max': 10000}
+    with pytest.warns(UserWarning, match = 'flag and sigma rules were skipped'):
+        atl06_reader.granules_to_csv(granules, tmp_path / 'pts.csv', progress = False, quality = quality)
+    n_missing = sum(c.get('missing_quality_vars', 0) for c in quality['rejections'].values())
+    n_old = sum(len(a['h_li']) for a in atl06_reader.read_granule(granules[0]).values())
+    assert n_missing == n_old > 0
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import bench_ingest
+import synthetic_atl06
+
+
+def test_paths_agree (tmp_path):
+    report = bench_ingest.main(['--granules', '2', '--segments', '200', '--repeats', '1'])
+    rows = {r['path']: r['segments'] for r in report['results']}
+    assert rows['serial_concat'] == rows['pipelined']
+    assert rows['pipelined_quality'] < rows['pipelined']
+
+
+def test_serial_concat_all_empty (tmp_path):
+    # Every beam missing, no granule has any rows
+    granules = synthetic_atl06.make_granules(str(tmp_path / 'ATL06'), n_granules = 2, n_segments = 10,
+                                             missing_beam_prob = 1.0)
+    assert bench_ingest.serial_concat(granules, str(tmp_path / 'out.csv')) == 0
+    assert os.path.exists(tmp_path / 'out.csv')
@@ -0,0 +1,19 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import bench_join_summary
+
+
+def test_scaling_exponents ():
+    cases = [{'n_points': n, 'seconds': {'join': n * 1e-6, 'flat': 1.0}} for n in (1000, 10000, 100000)]
+    out = bench_join_summary.scaling_exponents(cases, 'n_points')
+    assert out == {'join': 1.0, 'flat': 0.0}
+    assert bench_join_summary.scaling_exponents(cases[:1], 'n_points') == {}
+
+
+def test_small_case_runs ():
+    case = bench_join_summary.run_case(200, 20000, 16, repeats = 1)
+    assert 0 < case['n_joined'] <= 20000
+    assert set(case['seconds']) == {'clip', 'join', 'summary_groupby', 'summary_stream', 'threshold'}
@@ -0,0 +1,51 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import cli
+import lake_join
+import lake_stats
+import quantile_sketch
+
+
+def _working_dir (tmp_path):
+    rng = np.random.default_rng(0)
+    n = 60
+    # Three passes over one lake, plus one wild segment
+    delta_time = np.repeat([8.0e7, 8.05e7, 8.1e7], n // 3)
+    height = 300 + rng.normal(0, 0.1, n)
+    height[5] = 900.0
+    points = gpd.GeoDataFrame({'area_rank_': 'ID_1', 'height': height, 'delta_time': delta_time,
+                               'area_m2': 1e4},
+                              geometry = shapely.points(np.zeros(n), np.arange(n)), crs = 'EPSG:32624')
+    (tmp_path / 'data_intermediate').mkdir()
+    points.to_file(tmp_path / 'data_intermediate' / 'ICESat2_pts_GSWO.shp')
+    joined = lake_join.annotate_dates(pd.DataFrame(points.drop(columns = 'geometry')))
+    joined = joined.rename(columns = {'area_rank_': 'area_rank_id'})
+    stats = lake_stats.LakeYearStats(keys = ('area_rank_id', 'wtr_yr'), value = 'height').update(joined)
+    stats.save(tmp_path / 'data_intermediate' / 'lake_year_stats_GSWO.pkl')
+    sketches = quantile_sketch.GroupSketches(keys = ('area_rank_id', 'wtr_yr', 'obs_date'), value = 'height')
+    sketches.update(joined).save(tmp_path / 'data_intermediate' / 'lake_date_sketches_GSWO.pkl')
+
+    return(tmp_path)
+
+
+def test_summary_matches_4_2_default (tmp_path):
+    work = _working_dir(tmp_path)
+    assert cli.main(['--working-dir', str(work), 'summary', '--robust', 'obs_count > 10']) == 0
+    summary = pd.read_csv(work / 'data_output' / 'GSWO_lake_year_summary.csv')
+    # Stage 3's stats, nothing dropped but z_max
+    assert summary['obs_count'].item() == 60
+    assert summary['obs_date_unique'].item() == 3
+    assert summary['z_median'].notna().item()
+    assert summary['is_robust'].item()
+
+
+def test_summary_robust_filter (tmp_path):
+    work = _working_dir(tmp_path)
+    assert cli.main(['--working-dir', str(work), 'summary', '--robust-filter']) == 0
+    summary = pd.read_csv(work / 'data_output' / 'GSWO_lake_year_summary_filtered.csv')
+    assert summary['obs_count'].item() == 59
+    assert abs(summary['z_mean'].item() - 300) < 0.1
+    assert 'z_median' in summary.columns
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+from rasterio.transform import from_origin
+
+import dem_sampler
+
+crs = 'EPSG:32624'
+
+
+def _tile (path, x0, y0, values, nodata = -9999.0, res = 10.0):
+    # Tiled GeoTIFF with 16 x 16 blocks, top-left corner at (x0, y0)
+    height, width = values.shape
+    with rasterio.open(path, 'w', driver = 'GTiff', height = height, width = width, count = 1,
+                       dtype = 'float32', crs = crs, transform = from_origin(x0, y0, res, res),
+                       nodata = nodata, tiled = True, blockxsize = 16, blockysize = 16) as ds:
+        ds.write(values.astype('float32'), 1)
+
+    return(str(path))
+
+
+def test_plan_blocks (tmp_path):
+    path = _tile(tmp_path / 'a.tif', 500000, 7500000, np.zeros((40, 40)))
+    # Pixel centers at rows/cols (0, 0), (0, 17), (20, 35), (39, 39), plus two off the tile
+    x = 500000 + 10 * np.array([0, 17, 35, 39, -3, 45]) + 5
+    y = 7500000 - 10 * np.array([0, 0, 20, 39, 5, 5]) - 5
+    with rasterio.open(path) as ds:
+        blocks = dem_sampler.plan_blocks(ds, x, y, np.arange(len(x)))
+        assert dem_sampler.plan_blocks(ds, x, y, np.array([4, 5])) == []
+    windows = [b[0] for b in blocks]
+    # Edge blocks are cut to the raster
+    assert windows == [(0, 0, 16, 16), (0, 16, 16, 16), (16, 32, 16, 8), (32, 32, 8, 8)]
+    assert [b[1].tolist() for b in blocks] == [[0], [1], [2], [3]]
+    assert [(b[2].tolist(), b[3].tolist()) for b in blocks] == [([0], [0]), ([0], [1]),
+                                                                ([4], [3]), ([7], [7])]
+
+
+def test_sample_dem_tiles (tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    a_values = rng.uniform(0, 100, (40, 40))
+    a_values[:, :5] = -9999.0
+    b_values = rng.uniform(200, 300, (40, 40))
+    # b starts 300 m east of a, so they overlap by 10 columns
+    a = _tile(tmp_path / 'a.tif', 500000, 7500000, a_values)
+    b = _tile(tmp_path / 'b.tif', 500300, 7500000, b_values)
+
+    # Every handle the sampler opens has to be closed by the time it returns
+    opened = []
+    real_open = rasterio.open
+
+    def tracked_open (*args, **kwargs):
+        opened.append(real_open(*args, **kwargs))
+        return(opened[-1])
+
+    monkeypatch.setattr(rasterio, 'open', tracked_open)
+
+    col = np.array([2, 10, 35, 50, 80])
+    x = 500000 + 10 * col + 5.0
+    y = np.full(len(x), 7500000 - 10 * 7 - 5.0)
+    dem_z = dem_sampler.sample_dem(x, y, crs, [a, b], n_workers = 3, blocks_per_task = 1)
+    # Nodata on a only, a first where they overlap, b after, off both
+    expected = [np.nan, a_values[7, 10], a_values[7, 35], b_values[7, 20], np.nan]
+    np.testing.assert_allclose(dem_z, expected, rtol = 1e-6)
+    assert opened and all(ds.closed for ds in opened)
@@ -0,0 +1,70 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import lake_join
+import lake_stats
+
+
+def test_join_in_chunks_matches_single_join ():
+    lakes = gpd.GeoDataFrame({'area_rank_id': ['a', 'b'], 'area_m2': [100.0, 100.0]},
+                             geometry = [shapely.box(0, 0, 10, 10), shapely.box(20, 0, 30, 10)],
+                             crs = 'EPSG:32624')
+    x = np.linspace(1, 29, 50)
+    frame = pd.DataFrame({'lon': 0.0, 'lat': 0.0, 'x': x, 'y': 5.0, 'height': 100 + x,
+                          'delta_time': 8.0e7 + x})
+    frame.loc[3, 'height'] = 20000.0
+    points = lake_join.annotate_dates(lake_join.points_from_frame(frame, 'EPSG:32624', xy_crs = 'EPSG:32624'))
+
+    stats = lake_stats.LakeYearStats(keys = ('area_rank_id', 'wtr_yr'), value = 'height')
+    joined = lake_join.join_in_chunks(points, {'GSWO': (lakes, stats)}, chunk_size = 7)['GSWO']
+    whole = gpd.sjoin(points, lakes, how = 'inner', predicate = 'within')
+    assert sorted(joined.index) == sorted(whole.index)
+    # The z_max cut only applies to the stats
+    assert stats.summary()['obs_count'].sum() == len(whole) - 1
+
+
+def test_points_from_frame_reprojects_other_xy_crs ():
+    frame = pd.DataFrame({'lon': [-39.0, -38.0], 'lat': [67.0, 68.0], 'x': [1.0, 2.0], 'y': [3.0, 4.0]})
+    same = lake_join.points_from_frame(frame.copy(), 'EPSG:32624', xy_crs = 'EPSG:32624')
+    assert same.geometry.x.tolist() == [1.0, 2.0]
+    # x/y recorded in another CRS (or unknown) are ignored, lat/lon get projected
+    for xy_crs in ['EPSG:6931', None]:
+        moved = lake_join.points_from_frame(frame.copy(), 'EPSG:32624', xy_crs = xy_crs)
+        assert moved.crs == 'EPSG:32624'
+        assert abs(moved.geometry.x.iloc[0] - 500000) < 1
+
+
+def test_cli_join_writes_stage3_outputs (stage3_dir):
+    import cli
+    import quantile_sketch
+
+    inter = stage3_dir / 'data_intermediate'
+    assert cli.main(['--working-dir', str(stage3_dir), 'join', '--chunk-size', '50']) == 0
+    for name in ['LakesGSWO_v2.shp', 'LakesIIML_v2.shp', 'ICESat2_pts_GSWO.shp', 'ICESat2_pts_IIML.shp',
+                 'lake_year_stats_GSWO.pkl', 'lake_year_stats_IIML.pkl', 'lake_date_sketches_GSWO.pkl']:
+        assert (inter / name).exists(), name
+
+    gswo = gpd.read_file(inter / 'ICESat2_pts_GSWO.shp')
+    # 40 + 40 segments on the two lakes, plus the five ATL03 bins
+    assert gswo['source'].value_counts().to_dict() == {'ATL06': 80, 'ATL03': 5}
+    assert set(gswo['area_rank_']) == {'ID_1', 'ID_2'}
+    assert len(gpd.read_file(inter / 'ICESat2_pts_IIML.shp')) == 40
+    # Stats and sketches skip the fill-value height in the segments and the bins
+    stats = lake_stats.LakeYearStats.load(inter / 'lake_year_stats_GSWO.pkl').summary()
+    assert stats['obs_count'].sum() == 83
+    sketches = quantile_sketch.GroupSketches.load(inter / 'lake_date_sketches_GSWO.pkl')
+    assert sketches.rollup(['area_rank_id', 'wtr_yr']).summary()['z_median'].between(299, 301).all()
+
+
+def test_join_uses_stage2_z_max (stage3_dir):
+    import atl06_reader
+
+    inter = stage3_dir / 'data_intermediate'
+    atl06_reader.save_settings(inter, z_max = 300.0)
+    assert atl06_reader.load_z_max(inter) == 300.0
+    layers = lake_join.join_layers(str(stage3_dir / 'data_raw') + '/', str(inter) + '/', layers = ['GSWO'])
+    joined = layers['GSWO'][1]
+    stats = lake_stats.LakeYearStats.load(inter / 'lake_year_stats_GSWO.pkl').summary()
+    assert stats['obs_count'].sum() == (joined['height'] < 300.0).sum() < len(joined) - 1
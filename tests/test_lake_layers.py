@@ -0,0 +1,63 @@
+import os
+
+import geopandas as gpd
+import shapely
+
+import lake_layers
+
+
+def _layer (n = 3):
+    return(gpd.GeoDataFrame({'area_m2': range(n)}, geometry = [shapely.box(i, 0, i + 1, 1) for i in range(n)],
+                            crs = 'EPSG:32624'))
+
+
+def test_fingerprint_follows_sources_and_params (tmp_path):
+    source = tmp_path / 'lakes.shp'
+    source.write_text('a')
+    (tmp_path / 'lakes.dbf').write_text('b')
+    key = lake_layers.fingerprint([str(source)], {'crs': 'EPSG:32624'})
+    assert key == lake_layers.fingerprint([str(source)], {'crs': 'EPSG:32624'})
+    assert key != lake_layers.fingerprint([str(source)], {'crs': 'EPSG:3413'})
+    # A sidecar file changing counts too
+    (tmp_path / 'lakes.dbf').write_text('bb')
+    assert key != lake_layers.fingerprint([str(source)], {'crs': 'EPSG:32624'})
+
+
+def test_cache_hit_skips_build (tmp_path):
+    source = tmp_path / 'lakes.shp'
+    source.write_text('a')
+    cache = lake_layers.LayerCache(str(tmp_path / 'cache'))
+    calls = []
+
+    def build (n):
+        calls.append(n)
+        return(_layer(n))
+
+    layer, hit = cache.get('GSWO', [str(source)], {}, build, 3)
+    assert not hit and len(layer) == 3
+    layer, hit = cache.get('GSWO', [str(source)], {}, build, 3)
+    assert hit and len(layer) == 3
+    assert calls == [3]
+
+
+def test_evict_keeps_newest (tmp_path):
+    cache = lake_layers.LayerCache(str(tmp_path), max_bytes = 0)
+    old = cache.path_for('GSWO', 'old')
+    new = cache.path_for('GSWO', 'new')
+    _layer().to_parquet(old)
+    _layer().to_parquet(new)
+    cache.evict(keep = new)
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+
+
+def test_gswo_areas_and_ids_ignore_crs_proj (tmp_path):
+    # Two lakes whose area order flips between UTM 24N and 27N (scale error
+    # away from the central meridian), the IDs must not
+    boxes = [shapely.box(-38.01, 68.0, -37.99, 68.01), shapely.box(-20.01, 68.0, -19.99, 68.010005)]
+    gpd.GeoDataFrame({'area': [1.0, 2.0]}, geometry = boxes, crs = 'EPSG:4326').to_file(tmp_path / 'g.shp')
+    utm24 = lake_layers.prepare_gswo(str(tmp_path / 'g.shp'), 'EPSG:32624')
+    utm27 = lake_layers.prepare_gswo(str(tmp_path / 'g.shp'), 'EPSG:32627')
+    assert utm24.crs == 'EPSG:32624' and utm27.crs == 'EPSG:32627'
+    assert list(utm24['area_rank_id']) == list(utm27['area_rank_id'])
+    assert list(utm24['area_m2']) == list(utm27['area_m2'])
@@ -0,0 +1,37 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import geopandas as gpd
+import matplotlib.pyplot as plt
+import numpy as np
+import shapely
+
+import lake_maps
+
+
+def test_bin_points_means_per_cell ():
+    x = np.array([0.5, 1.5, 10.2, 10.8])
+    y = np.array([0.5, 1.5, 0.1, 0.9])
+    v = np.array([1.0, 3.0, 10.0, 20.0])
+    bx, by, bv = lake_maps.bin_points(x, y, v, cell = 5.0)
+    order = np.argsort(bx)
+    np.testing.assert_allclose(bx[order], [1.0, 10.5])
+    np.testing.assert_allclose(by[order], [1.0, 0.5])
+    np.testing.assert_allclose(bv[order], [2.0, 15.0])
+
+
+def test_plot_lake_map_bins_dense_dates ():
+    rng = np.random.default_rng(0)
+    n = 3000
+    dates = np.where(np.arange(n) < 2900, '2020-07-01', '2021-07-01')
+    points = gpd.GeoDataFrame({'height': rng.normal(300, 1, n), 'obs_date': dates},
+                              geometry = shapely.points(rng.uniform(0, 100, n), rng.uniform(0, 100, n)))
+    lake = shapely.box(0, 0, 100, 100)
+    ax = lake_maps.plot_lake_map(points, 'height', lake_geometry = lake, max_points = 500)
+    # One scatter per date, the dense date drawn from fewer binned points
+    sizes = [len(c.get_offsets()) for c in ax.collections]
+    assert len(sizes) == 2
+    assert sizes[0] < 2900 and sizes[1] == 100
+    assert [t.get_text() for t in ax.get_legend().get_texts()] == ['Obs Date: 2020-07-01',
+                                                                   'Obs Date: 2021-07-01']
+    plt.close('all')
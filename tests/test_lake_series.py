@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+import lake_series
+
+
+def _points ():
+    rows = []
+    for lake, offset in [('ID_1', 0.0), ('ID_2', 10.0)]:
+        for date, z in [('2020-01-10', 1.0), ('2020-07-10', 0.0), ('2021-01-10', 1.5),
+                        ('2021-07-10', 0.2)]:
+            for beam in ('gt1l/', 'gt2l/'):
+                for dz in (-0.1, 0.0, 0.1):
+                    rows.append({'area_rank_id': lake, 'obs_date': pd.Timestamp(date).date(),
+                                 'laser_id': beam, 'z': offset + z + dz})
+    return(pd.DataFrame(rows))
+
+
+def test_save_load_round_trip (tmp_path):
+    series = lake_series.LakeSeries.from_points(_points())
+    # The ids come out of pandas as an object array
+    assert series.lake.dtype == object
+    path = tmp_path / 'series.npz'
+    series.save(path)
+    loaded = lake_series.LakeSeries.load(path)
+
+    assert loaded.lake.tolist() == series.lake.tolist()
+    np.testing.assert_array_equal(loaded.offsets, series.offsets)
+    for lake in series.lake:
+        pd.testing.assert_frame_equal(loaded.lake_series(lake), series.lake_series(lake))
+    pd.testing.assert_frame_equal(loaded.frame(), series.frame())
+
+
+def test_lake_slices_and_anomaly ():
+    series = lake_series.LakeSeries.from_points(_points())
+    assert len(series) == 2
+    one = series.lake_series('ID_2')
+    assert len(one) == 8
+    np.testing.assert_allclose(one['z_mean'].iloc[0], 11.0)
+    anomaly = series.frozen_liquid_anomaly().set_index(['lake', 'wtr_yr'])
+    np.testing.assert_allclose(anomaly.loc[('ID_1', 'WY2021'), 'dz'], 1.3)
+
+
+def test_year_over_year ():
+    yoy = lake_series.LakeSeries.from_points(_points()).year_over_year(phase = 'liquid')
+    assert yoy['wtr_yr_prev'].tolist() == ['WY2020', 'WY2020']
+    np.testing.assert_allclose(yoy['dz'], 0.2)
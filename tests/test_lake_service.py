@@ -0,0 +1,110 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lake_service
+import projection
+
+
+class FakeStore:
+
+    def __init__ (self):
+        self.calls = 0
+
+    def lake (self, lake_id):
+        self.calls += 1
+        if lake_id != 'ID_1':
+            raise KeyError(lake_id)
+        return({'area_rank_id': lake_id, 'area_m2': np.float64(1200.0),
+                'lake_years': [{'wtr_yr': 'WY2021', 'z_mean': 301.5, 'z_std': np.nan},
+                               {'wtr_yr': 'WY2022', 'z_mean': np.float32('nan'), 'z_std': np.inf,
+                                'obs_date': pd.NaT, 'count': np.int64(3)}]})
+
+    def lakes_in_bbox (self, bbox, crs = None):
+        return([{'area_rank_id': 'ID_1', 'bbox': bbox, 'crs': crs}])
+
+    def lake_series (self, lake_id):
+        raise LookupError('no lake series store, run 4.2 first')
+
+    def histogram (self, lake_id, bins = 50, wtr_yr = None):
+        return({'area_rank_id': lake_id, 'bins': bins, 'wtr_yr': wtr_yr})
+
+
+def test_nan_becomes_null ():
+    store = FakeStore()
+    respond = lake_service.make_responder(store)
+    status, body = respond('/lakes/ID_1', ())
+    assert status == 200
+    # Strict JSON, NaN/Infinity would fail here
+    out = json.loads(body, parse_constant = lambda c: (_ for _ in ()).throw(ValueError(c)))
+    assert out['area_m2'] == 1200.0
+    assert out['lake_years'][0] == {'wtr_yr': 'WY2021', 'z_mean': 301.5, 'z_std': None}
+    assert out['lake_years'][1] == {'wtr_yr': 'WY2022', 'z_mean': None, 'z_std': None,
+                                    'obs_date': None, 'count': 3}
+
+
+def test_routes_and_errors ():
+    store = FakeStore()
+    respond = lake_service.make_responder(store)
+    status, body = respond('/lakes', (('bbox', '0,1,2,3'), ('crs', 'EPSG:4326')))
+    assert status == 200
+    assert json.loads(body) == [{'area_rank_id': 'ID_1', 'bbox': [0.0, 1.0, 2.0, 3.0], 'crs': 'EPSG:4326'}]
+    status, body = respond('/lakes/ID_1/histogram', (('bins', '10'), ('wtr_yr', 'WY2021')))
+    assert json.loads(body) == {'area_rank_id': 'ID_1', 'bins': 10, 'wtr_yr': 'WY2021'}
+    assert respond('/lakes/ID_9', ())[0] == 404
+    assert respond('/lakes/ID_1/series', ())[0] == 400
+    assert respond('/lakes', (('bbox', 'a,b'),))[0] == 400
+    assert respond('/nothing', ())[0] == 404
+
+
+def test_responses_cached ():
+    store = FakeStore()
+    respond = lake_service.make_responder(store)
+    first = respond('/lakes/ID_1', ())
+    assert respond('/lakes/ID_1', ()) == first
+    assert store.calls == 1
+    assert respond.cache_info().hits == 1
+
+
+@pytest.fixture
+def store (stage3_dir):
+    import lake_join
+    lake_join.join_layers(str(stage3_dir / 'data_raw') + '/', str(stage3_dir / 'data_intermediate') + '/')
+    return(lake_service.LakeStore(str(stage3_dir)))
+
+
+def test_store_lake_and_bbox (store):
+    respond = lake_service.make_responder(store)
+    status, body = respond('/lakes/ID_1', ())
+    assert status == 200
+    lake = json.loads(body)
+    assert lake['area_rank_id'] == 'ID_1' and lake['area_m2'] == pytest.approx(1e6, rel = 1e-3)
+    # Same lake-year table as cli summary by default: stage 3 stats plus sketch medians
+    # 39 ATL06 and 4 ATL03 points, the 3e38 height dropped from both
+    assert sum(y['obs_count'] for y in lake['lake_years']) == 43
+    assert all(y['z_median'] is not None for y in lake['lake_years'])
+
+    status, body = respond('/lakes', (('bbox', '502900,7399900,504000,7401000'),))
+    assert [l['area_rank_id'] for l in json.loads(body)] == ['ID_2']
+    lon, lat = projection.transform_xy([499500, 505000], [7399500, 7401500], 'EPSG:32624', 'EPSG:4326')
+    bbox = f'{lon[0]},{lat[0]},{lon[1]},{lat[1]}'
+    status, body = respond('/lakes', (('bbox', bbox), ('crs', 'EPSG:4326')))
+    assert sorted(l['area_rank_id'] for l in json.loads(body)) == ['ID_1', 'ID_2']
+
+
+def test_store_histogram_and_errors (store):
+    respond = lake_service.make_responder(store)
+    status, body = respond('/lakes/ID_2/histogram', (('bins', '5'),))
+    assert status == 200
+    hist = json.loads(body)
+    assert hist['n'] == 40 and sum(hist['counts']) == 40
+    assert respond('/lakes/ID_2/histogram', (('wtr_yr', 'WY1999'),))[0] == 200
+    assert respond('/lakes/ID_9', ())[0] == 404
+    # No lake series store yet
+    assert respond('/lakes/ID_1/series', ())[0] == 400
+    for bad in [(('bbox', '1,2,3'),), (('bbox', '1,2,3,nan'),), (('bbox', '1,2,3,4'), ('crs', 'EPSG:0'))]:
+        status, body = respond('/lakes', bad)
+        assert status == 400, bad
+        assert 'error' in json.loads(body)
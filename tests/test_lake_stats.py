@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+import lake_stats
+
+
+def _points (n = 200, seed = 0):
+    rng = np.random.default_rng(seed)
+    dates = np.array(['2020-09-30', '2020-10-01', '2021-06-15'], dtype = 'datetime64[D]')
+    return(pd.DataFrame({'area_rank_id': rng.choice(['a', 'b', 'c'], n),
+                         'wtr_yr': rng.choice(['WY2020', 'WY2021'], n),
+                         'obs_date': rng.choice(dates, n),
+                         'z': rng.normal(100, 5, n),
+                         'area_m2': 1.0}))
+
+
+def test_date_helpers ():
+    obs_date = lake_stats.obs_date_from_delta([0.0, 86400.0 * 31])
+    assert obs_date.tolist() == [np.datetime64('2018-01-01'), np.datetime64('2018-02-01')]
+    wtr_yr = lake_stats.wtr_yr_from_date(np.array(['2020-09-30', '2020-10-01'], dtype = 'datetime64[D]'))
+    assert wtr_yr.tolist() == ['WY2020', 'WY2021']
+    phase = lake_stats.lake_phase_from_date(np.array(['2021-01-10', '2021-05-10', '2021-07-10',
+                                                      '2021-10-10'], dtype = 'datetime64[D]'))
+    assert phase.tolist() == ['frozen', 'intermediate_spring', 'liquid', 'intermediate_fall']
+
+
+def test_batched_matches_groupby ():
+    points = _points()
+    stats = lake_stats.LakeYearStats()
+    for start in range(0, len(points), 30):
+        stats.update(points.iloc[start:start + 30])
+    summary = stats.summary().set_index(['area_rank_id', 'wtr_yr']).sort_index()
+
+    expected = points.groupby(['area_rank_id', 'wtr_yr'])['z'].agg(['mean', 'std', 'count'])
+    np.testing.assert_allclose(summary['z_mean'], expected['mean'])
+    np.testing.assert_allclose(summary['z_std'], expected['std'])
+    assert summary['obs_count'].tolist() == expected['count'].tolist()
+    n_dates = points.groupby(['area_rank_id', 'wtr_yr'])['obs_date'].nunique()
+    assert summary['obs_date_unique'].tolist() == n_dates.tolist()
+
+
+def test_merge_equals_single_pass ():
+    points = _points(seed = 1)
+    half = len(points) // 2
+    merged = lake_stats.LakeYearStats().update(points.iloc[:half])
+    merged.merge(lake_stats.LakeYearStats().update(points.iloc[half:]))
+    single = lake_stats.LakeYearStats().update(points)
+    pd.testing.assert_frame_equal(merged.summary().sort_values(['area_rank_id', 'wtr_yr'], ignore_index = True),
+                                  single.summary().sort_values(['area_rank_id', 'wtr_yr'], ignore_index = True),
+                                  check_dtype = False)
+
+
+def test_save_load (tmp_path):
+    stats = lake_stats.LakeYearStats().update(_points())
+    stats.save(tmp_path / 'stats.pkl')
+    loaded = lake_stats.LakeYearStats.load(tmp_path / 'stats.pkl')
+    pd.testing.assert_frame_equal(loaded.summary(), stats.summary())
+
+
+def test_empty_summary ():
+    summary = lake_stats.LakeYearStats().update(_points().iloc[:0]).summary()
+    assert len(summary) == 0
+    assert 'obs_date_unique' in summary.columns
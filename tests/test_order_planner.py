@@ -0,0 +1,57 @@
+import shapely
+
+import order_planner
+
+
+def _granule (name, time_start, box, size = 10.0):
+    w, s, e, n = box
+    return({'producer_granule_id': name, 'granule_size': size, 'time_start': time_start,
+            'polygons': None, 'boxes': [f'{s} {w} {n} {e}']})
+
+
+def test_granule_parts ():
+    parts = order_planner.granule_parts('processed_ATL06_20211015123456_03921305_006_01.h5')
+    assert parts['product'] == 'ATL06'
+    assert parts['rgt'] == '0392'
+    assert parts['cycle'] == '13'
+    assert parts['datetime'].year == 2021
+
+
+def test_make_chunks_covers_range ():
+    chunks = order_planner.make_chunks('2020-01-01', '2020-12-31', chunk_days = 91)
+    assert chunks[0][0] == '2020-01-01'
+    assert chunks[-1][1] == '2020-12-31'
+    assert all(a[1] == b[0] for a, b in zip(chunks[:-1], chunks[1:]))
+
+
+def test_make_tiles_clip_to_polygon ():
+    polygon = shapely.box(0, 0, 2.5, 1)
+    tiles = order_planner.make_tiles(polygon, tile_deg = 1.0)
+    assert len(tiles) == 3
+    assert abs(sum(t.area for t in tiles) - polygon.area) < 1e-9
+
+
+def test_plan_orders_per_tile_extent_and_cycles ():
+    polygon = shapely.box(0, 0, 4, 1)
+    granules = [_granule('ATL06_20200105000000_01000601_006_01.h5', '2020-01-05T00:00:00', (0.2, 0, 0.4, 1)),
+                _granule('ATL06_20200106000000_02000601_006_01.h5', '2020-01-06T00:00:00', (0.5, 0, 0.7, 1)),
+                # Same granule listed twice
+                _granule('ATL06_20200106000000_02000601_006_01.h5', '2020-01-06T00:00:00', (0.5, 0, 0.7, 1)),
+                _granule('ATL06_20200110000000_03000701_006_01.h5', '2020-01-10T00:00:00', (3.2, 0, 3.4, 1)),
+                # Nowhere near the study area
+                _granule('ATL06_20200110000000_04000701_006_01.h5', '2020-01-10T00:00:00', (10, 10, 11, 11))]
+    plan, n_duplicates = order_planner.plan_orders(granules, polygon, ['2020-01-01', '2020-03-01'])
+
+    assert n_duplicates == 1
+    assert [o['name'] for o in plan] == ['chunk00_tile000', 'chunk00_tile003']
+    first, last = plan
+    assert first['tracks_by_cycle'] == {'06': ['0100', '0200']}
+    assert last['tracks_by_cycle'] == {'07': ['0300']}
+    # Extents follow the order's own granules, not the whole polygon
+    assert shapely.Polygon(first['extent']).bounds == (0.2, 0, 0.7, 1)
+    assert shapely.Polygon(last['extent']).bounds == (3.2, 0, 3.4, 1)
+
+    summary = order_planner.summarize_plan(plan, n_duplicates)
+    assert summary['n_orders'] == 2
+    assert summary['n_granules'] == 3
+    assert summary['total_size_mb'] == 30.0
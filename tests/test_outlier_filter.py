@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import outlier_filter
+
+
+def _lake_points ():
+    rng = np.random.default_rng(0)
+    z = rng.normal(50, 0.2, 40)
+    z[3] = 80.0
+    z[7] = 20000.0
+    return(pd.DataFrame({'area_rank_id': 'a', 'wtr_yr': 'WY2021', 'obs_date': '2021-07-01', 'z': z}))
+
+
+def test_rules_tag_first_rejection ():
+    points = _lake_points()
+    kept, reason = outlier_filter.robust_filter(points)
+    assert reason.iloc[7] == 'z_above_max'
+    assert reason.iloc[3] == 'mad_lake_year'
+    assert len(kept) == (reason == '').sum()
+    assert 3 not in kept.index and 7 not in kept.index
+    counts = outlier_filter.rejection_counts(reason)
+    assert counts['z_above_max'] == 1
+
+
+def test_small_groups_left_alone ():
+    points = pd.DataFrame({'area_rank_id': ['a'] * 3, 'wtr_yr': 'WY2021',
+                           'obs_date': '2021-07-01', 'z': [1.0, 1.1, 50.0]})
+    kept, reason = outlier_filter.robust_filter(points, min_count = 5)
+    assert len(kept) == 3
+    assert (reason == '').all()
+
+
+def test_sigma_and_unknown_method ():
+    points = _lake_points()
+    rules = [{'name': 'sigma', 'method': 'sigma', 'column': 'z', 'by': ['area_rank_id'], 'k': 3}]
+    _, reason = outlier_filter.robust_filter(points, rules)
+    assert reason.iloc[7] == 'sigma'
+    with pytest.raises(ValueError):
+        outlier_filter.robust_filter(points, [{'name': 'x', 'method': 'nope', 'column': 'z'}])
+
+
+def test_rejection_table ():
+    points = pd.DataFrame({'area_rank_id': ['a', 'a', 'a', 'b'], 'wtr_yr': 'WY2021',
+                           'z': [1.0, 2.0, 20000.0, 3.0]})
+    kept, reason = outlier_filter.robust_filter(points, [outlier_filter.DEFAULT_RULES[0]])
+    table = outlier_filter.rejection_table(points, reason, ['area_rank_id', 'wtr_yr'])
+    assert table.to_dict(orient = 'records') == [
+        {'area_rank_id': 'a', 'wtr_yr': 'WY2021', 'kept': 2, 'z_above_max': 1},
+        {'area_rank_id': 'b', 'wtr_yr': 'WY2021', 'kept': 1, 'z_above_max': 0}]
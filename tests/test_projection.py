@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+from pyproj import CRS
+
+import projection
+
+
+def test_pick_crs ():
+    # Narrow: the UTM zone of the center
+    assert projection.pick_crs(-40, 66, -36, 69) == 'EPSG:32624'
+    assert projection.pick_crs(140, -70, 144, -68) == 'EPSG:32754'
+    # Wide: equal area, polar LAEA at high latitudes
+    for bounds, expected in [((-60, 60, -20, 83), 'EPSG:6931'),
+                             ((0, -85, 90, -65), 'EPSG:6932'),
+                             ((-20, 30, 20, 50), 'EPSG:6933')]:
+        crs = projection.pick_crs(*bounds)
+        assert crs == expected
+        assert 'Equal Area' in CRS(crs).coordinate_operation.method_name
+
+
+def test_save_and_load (tmp_path):
+    assert projection.load_crs(tmp_path) == 'EPSG:32624'
+    assert projection.load_xy_crs(tmp_path) is None
+    projection.save_crs(tmp_path, 'EPSG:6931')
+    assert projection.load_crs(tmp_path) == 'EPSG:6931'
+    assert projection.load_xy_crs(tmp_path) == 'EPSG:6931'
+    projection.save_crs(tmp_path, 'EPSG:6931', xy_crs = 'EPSG:32624')
+    assert projection.load_xy_crs(tmp_path) == 'EPSG:32624'
+    # Files from before xy_crs was recorded: x/y were written in crs_proj
+    (tmp_path / projection.state_file).write_text(json.dumps({'crs_proj': 'EPSG:32624'}))
+    assert projection.load_xy_crs(tmp_path) == 'EPSG:32624'
+
+
+def test_transform_xy_chunks_match_single ():
+    rng = np.random.default_rng(0)
+    lon, lat = rng.uniform(-50, -30, 1000), rng.uniform(60, 80, 1000)
+    whole = projection.transform_xy(lon, lat, 'EPSG:4326', 'EPSG:6931', n_workers = 1,
+                                    chunk_size = 10_000)
+    chunked = projection.transform_xy(lon, lat, 'EPSG:4326', 'EPSG:6931', n_workers = 4,
+                                      chunk_size = 97)
+    np.testing.assert_array_equal(whole[0], chunked[0])
+    np.testing.assert_array_equal(whole[1], chunked[1])
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import quantile_sketch
+
+
+def _points (n = 20000, seed = 0):
+    rng = np.random.default_rng(seed)
+    return(pd.DataFrame({'area_rank_id': rng.choice(['a', 'b'], n),
+                         'wtr_yr': 'WY2021',
+                         'obs_date': rng.choice(['2021-01-01', '2021-07-01', '2021-08-01'], n),
+                         'z': rng.lognormal(3, 0.5, n)}))
+
+
+def _exact (points, keys, q):
+    return(points.groupby(keys)['z'].quantile(q).sort_index().to_numpy())
+
+
+def test_quantiles_close_to_exact ():
+    points = _points()
+    sketch = quantile_sketch.GroupSketches()
+    for start in range(0, len(points), 3000):
+        sketch.update(points.iloc[start:start + 3000])
+    keys = ['area_rank_id', 'wtr_yr', 'obs_date']
+    out = sketch.quantiles([0.1, 0.5, 0.9]).sort_values(keys)
+    for q in (0.1, 0.5, 0.9):
+        np.testing.assert_allclose(out[f'q{q * 100:g}'], _exact(points, keys, q), rtol = 0.02)
+    # Stays small whatever the number of points
+    assert len(sketch.centroids) < 3 * 2 * sketch.compression
+
+
+def test_merge_and_rollup ():
+    points = _points(seed = 1)
+    half = len(points) // 2
+    merged = quantile_sketch.GroupSketches().update(points.iloc[:half])
+    merged.merge(quantile_sketch.GroupSketches().update(points.iloc[half:]))
+    summary = merged.rollup(['area_rank_id', 'wtr_yr']).summary().sort_values('area_rank_id')
+    np.testing.assert_allclose(summary['z_median'], _exact(points, ['area_rank_id', 'wtr_yr'], 0.5),
+                               rtol = 0.02)
+    assert (summary['z_iqr'] > 0).all()
+
+
+def test_extremes_are_exact ():
+    points = pd.DataFrame({'area_rank_id': 'a', 'wtr_yr': 'WY2021', 'obs_date': '2021-07-01',
+                           'z': [1.0, 2.0, 3.0, 100.0]})
+    out = quantile_sketch.GroupSketches().update(points).quantiles([0, 1])
+    assert out['q0'].item() == 1.0
+    assert out['q100'].item() == 100.0
+
+
+def test_save_load (tmp_path):
+    sketch = quantile_sketch.GroupSketches().update(_points(n = 500))
+    sketch.save(tmp_path / 's.pkl')
+    pd.testing.assert_frame_equal(quantile_sketch.GroupSketches.load(tmp_path / 's.pkl').summary(),
+                                  sketch.summary())
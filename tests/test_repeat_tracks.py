@@ -0,0 +1,40 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+import repeat_tracks
+
+
+def _two_passes ():
+    # Two north-going passes over the same lake, 3 m apart across track
+    y = np.arange(0, 200, 20.0)
+    frames = []
+    for date, x0, z, t0 in [('2021-01-01', 0.0, 10.0, 0.0), ('2021-04-01', 3.0, 10.5, 86400 * 90.0)]:
+        frames.append(pd.DataFrame({'area_rank_id': 'a', 'obs_date': date, 'laser_id': 'gt1l/',
+                                    'rgt': 100, 'z': z, 'x': x0, 'y': y,
+                                    'delta_time': t0 + y / 7000}))
+    points = pd.concat(frames, ignore_index = True)
+    return(gpd.GeoDataFrame(points, geometry = gpd.points_from_xy(points['x'], points['y']),
+                            crs = 'EPSG:32624'))
+
+
+def test_track_direction_follows_track ():
+    points = _two_passes()
+    ux, uy = repeat_tracks.track_direction(points, ['obs_date', 'laser_id'])
+    np.testing.assert_allclose(ux, 0.0, atol = 1e-12)
+    np.testing.assert_allclose(uy, 1.0)
+
+
+def test_pairs_are_later_minus_earlier ():
+    pairs = repeat_tracks.pair_repeat_tracks(_two_passes(), max_along = 5, max_cross = 5)
+    assert len(pairs) == 10
+    assert (pairs['date_a'] == '2021-01-01').all()
+    np.testing.assert_allclose(pairs['dz'], 0.5)
+    np.testing.assert_allclose(pairs['cross_m'], 3.0)
+    np.testing.assert_allclose(pairs['dt_days'], 90.0)
+
+
+def test_other_rgt_not_paired ():
+    points = _two_passes()
+    points.loc[points['obs_date'] == '2021-04-01', 'rgt'] = 200
+    assert len(repeat_tracks.pair_repeat_tracks(points, max_along = 5, max_cross = 5)) == 0
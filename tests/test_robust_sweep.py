@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+import robust_sweep
+
+
+def _summary (n = 300, seed = 0):
+    rng = np.random.default_rng(seed)
+    z_std = rng.uniform(0, 150, n)
+    z_std[::17] = np.nan
+    return(pd.DataFrame({'area_rank_id': rng.choice([f'ID_{i}' for i in range(40)], n),
+                         'wtr_yr': rng.choice(['WY2020', 'WY2021', 'WY2022'], n),
+                         'z_std': z_std,
+                         'z_mean': rng.normal(300, 10, n),
+                         'obs_count': rng.integers(1, 200, n),
+                         'obs_date_unique': rng.integers(1, 12, n)}))
+
+
+def test_sweep_matches_query ():
+    summary = _summary()
+    grid = {'z_std': ('<', [30, 50, 100]),
+            'obs_count': ('>', [25, 50]),
+            'obs_date_unique': ('>', [3, 5])}
+    # Small blocks so the chunking is exercised too
+    robust_sweep.max_block, old = 1000, robust_sweep.max_block
+    try:
+        sweep = robust_sweep.sweep_thresholds(summary, grid)
+    finally:
+        robust_sweep.max_block = old
+
+    assert len(sweep) == 3 * 2 * 2
+    for row in sweep.itertuples():
+        kept = summary.query(f'z_std < {row.z_std} & obs_count > {row.obs_count} & '
+                             f'obs_date_unique > {row.obs_date_unique}')
+        assert row.n_lake_years == len(kept)
+        assert row.n_lakes == kept['area_rank_id'].nunique()
+        assert row.n_points == kept['obs_count'].sum()
+        np.testing.assert_allclose(row.std_mean, kept['z_std'].mean())
+        np.testing.assert_allclose(row.std_median, kept['z_std'].median())
+        np.testing.assert_allclose(row.z_mean_weighted,
+                                   np.average(kept['z_mean'], weights = kept['obs_count']))
+        np.testing.assert_allclose(row.share_points, kept['obs_count'].sum() / summary['obs_count'].sum())
+
+
+def test_sweep_empty_combination ():
+    summary = _summary(50)
+    sweep = robust_sweep.sweep_thresholds(summary, {'obs_count': ('>', [1000])})
+    assert sweep['n_lake_years'].tolist() == [0]
+    assert sweep['n_lakes'].tolist() == [0]
+    assert np.isnan(sweep['std_median'].iloc[0])
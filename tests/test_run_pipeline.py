@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+import run_pipeline
+
+
+@pytest.fixture
+def pipeline (tmp_path, monkeypatch):
+    # Two tiny stages: 'make' writes a file, 'scale' reads it and a helper module
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    (repo / 'helper.py').write_text('factor = 2\n')
+    (repo / 'make.py').write_text(
+        'import os\n'
+        "out = os.path.join(os.environ['ICESAT2_LAKES_DIR'], 'data_intermediate', 'a.txt')\n"
+        "open(out, 'w').write('3')\n")
+    (repo / 'scale.py').write_text(
+        'import json, os\n'
+        'import helper\n'
+        "work = os.environ['ICESAT2_LAKES_DIR']\n"
+        "params = json.loads(os.environ['ICESAT2_PARAMS'])\n"
+        "a = int(open(os.path.join(work, 'data_intermediate', 'a.txt')).read())\n"
+        "open(os.path.join(work, 'data_output', 'b.txt'), 'w').write(str(a * helper.factor * params['k']))\n")
+    stages = {'make': {'script': 'make.py', 'inputs': [], 'outputs': ['data_intermediate/a.txt']},
+              'scale': {'script': 'scale.py', 'inputs': ['data_intermediate/a.txt'],
+                        'outputs': ['data_output/b.txt'], 'params': {'k': 1}}}
+    monkeypatch.setattr(run_pipeline, 'repo_dir', str(repo))
+    monkeypatch.setattr(run_pipeline, 'stages', stages)
+    work = tmp_path / 'work'
+    for sub in ('data_intermediate', 'data_output'):
+        (work / sub).mkdir(parents = True)
+
+    return(repo, work)
+
+
+def test_stage_params_from_env (monkeypatch):
+    monkeypatch.setenv('ICESAT2_PARAMS', json.dumps({'a': 2}))
+    assert run_pipeline.stage_params({'a': 1, 'b': 1}) == {'a': 2, 'b': 1}
+
+
+def test_key_follows_imported_modules (pipeline):
+    repo, work = pipeline
+    assert run_pipeline.local_imports('scale.py') == ['helper.py', 'scale.py']
+    key = run_pipeline.stage_key('scale', str(work), {'k': 1})
+    (repo / 'helper.py').write_text('factor = 3\n')
+    assert run_pipeline.stage_key('scale', str(work), {'k': 1}) != key
+
+
+def test_run_skips_unchanged (pipeline):
+    repo, work = pipeline
+    assert run_pipeline.run(str(work)) == {'make': 'ran', 'scale': 'ran'}
+    assert (work / 'data_output' / 'b.txt').read_text() == '6'
+    assert run_pipeline.run(str(work)) == {'make': 'skipped', 'scale': 'skipped'}
+    (repo / 'helper.py').write_text('factor = 3\n')
+    assert run_pipeline.run(str(work)) == {'make': 'skipped', 'scale': 'ran'}
+
+
+def test_sweep_combos_get_own_dirs (pipeline, capsys):
+    repo, work = pipeline
+    args = ['--working-dir', str(work), '--sweep', 'scale.k=1,5']
+    assert run_pipeline.main(args) == 0
+    one = run_pipeline.sweep_dir(str(work), ('scale.k=1',))
+    five = run_pipeline.sweep_dir(str(work), ('scale.k=5',))
+    assert open(os.path.join(one, 'data_output', 'b.txt')).read() == '6'
+    assert open(os.path.join(five, 'data_output', 'b.txt')).read() == '30'
+    # The shared stage ran once, in the working dir
+    assert os.path.islink(os.path.join(five, 'data_intermediate', 'a.txt'))
+    # Each combination keeps its own cache entry, a rerun skips both
+    capsys.readouterr()
+    assert run_pipeline.main(args) == 0
+    assert capsys.readouterr().out.count('[skip] scale') == 2
+    with open(os.path.join(five, run_pipeline.state_file)) as f:
+        assert list(json.load(f)) == ['scale']
+
+
+def test_layers_are_independent_branches ():
+    deps = run_pipeline.dependencies()
+    assert deps['merge_GSWO'] == ['dataframe'] and deps['merge_IIML'] == ['dataframe']
+    assert deps['analysis_GSWO'] == ['merge_GSWO']
+    assert run_pipeline.upstream_of(['analysis_GSWO'], deps) == {'download', 'dataframe', 'merge_GSWO',
+                                                                 'analysis_GSWO'}
+    # A dry run writes no granules, only the cached granule list
+    assert run_pipeline.stages['download']['outputs'] == ['data_raw/ATL06_granules.json']
+
+
+def test_dem_tiles_are_inputs (tmp_path):
+    dem = tmp_path / 'dem'
+    dem.mkdir()
+    (dem / 'a_dem.tif').write_text('a')
+    params = {'use_robust_filter': False, 'interior_only': False, 'dem_glob': str(dem / '*_dem.tif')}
+    key = run_pipeline.stage_key('analysis_GSWO', str(tmp_path), params)
+    assert run_pipeline.stage_key('analysis_GSWO', str(tmp_path), params) == key
+    (dem / 'b_dem.tif').write_text('b')
+    assert run_pipeline.stage_key('analysis_GSWO', str(tmp_path), params) != key
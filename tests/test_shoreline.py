@@ -0,0 +1,32 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import shoreline
+
+
+def test_shorelines_skip_missing_geometries ():
+    square = shapely.box(0, 0, 100, 100)
+    donut = square.difference(shapely.box(40, 40, 60, 60))
+    two_parts = shapely.MultiPolygon([shapely.box(200, 0, 210, 10), shapely.box(220, 0, 230, 10)])
+    shores = shoreline.lake_shorelines([None, square, None, two_parts, donut])
+    assert shores[0] is None and shores[2] is None
+    assert shores[1].length == 400
+    assert len(shores[3].geoms) == 2
+    # Islands are left out by default
+    assert shores[4].length == 400
+    assert shoreline.lake_shorelines([donut], include_islands = True)[0].length == 480
+
+
+def test_distance_to_own_lake ():
+    lakes = gpd.GeoDataFrame({'area_rank_id': ['a', 'b']},
+                             geometry = [shapely.box(0, 0, 100, 100), shapely.box(105, 0, 205, 100)],
+                             crs = 'EPSG:32624')
+    points = gpd.GeoDataFrame({'area_rank_id': ['a', 'b', 'a']},
+                              geometry = shapely.points([[50, 50], [106, 50], [95, 50]]),
+                              crs = 'EPSG:32624', index = [10, 11, 12])
+    dist = shoreline.distance_to_shore(points, lakes, n_workers = 2)
+    pd.testing.assert_index_equal(dist.index, points.index)
+    np.testing.assert_allclose(dist, [50, 1, 5])
+    assert shoreline.edge_flags(dist, min_dist = 30).tolist() == [True, False, False]
@@ -0,0 +1,52 @@
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+
+import snow_bootstrap
+
+
+def _points ():
+    rng = np.random.default_rng(3)
+    frames = []
+    for lake, offset in [('a', 0.5), ('b', 1.0), ('c', 0.0)]:
+        frames.append(pd.DataFrame({'area_rank_id': lake, 'wtr_yr': 'WY2021',
+                                    'lake_phase_est': ['frozen'] * 30 + ['liquid'] * 30,
+                                    'z': np.r_[rng.normal(10 + offset, 0.05, 30),
+                                               rng.normal(10, 0.05, 30)]}))
+    # Too few frozen points to use
+    frames.append(pd.DataFrame({'area_rank_id': 'd', 'wtr_yr': 'WY2021',
+                                'lake_phase_est': ['frozen'] * 2 + ['liquid'] * 30, 'z': 1.0}))
+    return(pd.concat(frames, ignore_index = True))
+
+
+def test_dz_per_lake ():
+    out = snow_bootstrap.bootstrap_snow(_points(), n_boot = 200, n_workers = 1)
+    out = out.set_index('area_rank_id')
+    assert list(out.index) == ['a', 'b', 'c']
+    np.testing.assert_allclose(out['dz'], [0.5, 1.0, 0.0], atol = 0.05)
+    assert (out['dz_ci_low'] <= out['dz']).all() and (out['dz'] <= out['dz_ci_high']).all()
+
+
+def test_serial_without_fork_matches (monkeypatch):
+    points = _points()
+    pooled = snow_bootstrap.bootstrap_snow(points, n_boot = 100, n_workers = 2)
+    monkeypatch.setattr(mp, 'get_all_start_methods', lambda: ['spawn'])
+    serial = snow_bootstrap.bootstrap_snow(points, n_boot = 100, n_workers = 2)
+    pd.testing.assert_frame_equal(pooled.sort_values('area_rank_id', ignore_index = True),
+                                  serial.sort_values('area_rank_id', ignore_index = True))
+
+
+def test_no_usable_lakes ():
+    points = _points()
+    out = snow_bootstrap.bootstrap_snow(points[points['area_rank_id'] == 'd'])
+    assert len(out) == 0
+    assert 'dz' in out.columns
+
+
+def test_same_result_for_any_worker_count ():
+    points = _points()
+    one = snow_bootstrap.bootstrap_snow(points, n_boot = 100, n_workers = 1)
+    for n_workers in (2, 3, 8):
+        pd.testing.assert_frame_equal(snow_bootstrap.bootstrap_snow(points, n_boot = 100,
+                                                                    n_workers = n_workers), one)
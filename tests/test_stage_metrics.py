@@ -0,0 +1,41 @@
+import json
+import threading
+
+import stage_metrics
+
+
+def test_stage_accumulates_and_writes (tmp_path):
+    metrics = stage_metrics.RunReport('test', report_dir = str(tmp_path))
+    for _ in range(2):
+        with metrics.stage('join', rows_in = 5) as m:
+            m.rows_out = 3
+    record = metrics.stages['join']
+    assert record.calls == 2
+    assert record.rows_in == 10
+    assert record.peak_rss_mb > 0
+
+    metrics.start('write')
+    out = tmp_path / 'x.csv'
+    out.write_text('abc')
+    metrics.stages['write'].add_file_written(str(out))
+    metrics.stop('write', rows_out = 1)
+    assert metrics.stages['write'].bytes_written == 3
+
+    with open(metrics.write()) as f:
+        report = json.load(f)
+    assert [s['name'] for s in report['stages']] == ['join', 'write']
+
+
+def test_timer_is_light ():
+    metrics = stage_metrics.RunReport('test')
+    n_threads = threading.active_count()
+    for _ in range(3):
+        with metrics.timer('dataframe_build') as m:
+            # No sampler thread started for the timer
+            assert threading.active_count() == n_threads
+            m.rows_out = (m.rows_out or 0) + 2
+    record = metrics.stages['dataframe_build']
+    assert record.calls == 3
+    assert record.rows_out == 6
+    assert record.peak_rss_mb is None
+    assert record.bytes_read == 0
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import shapely
+
+import vector_tiles
+
+
+def test_tile_bounds_cover_world ():
+    assert vector_tiles.tile_bounds(0, 0, 0) == (-vector_tiles.WORLD, -vector_tiles.WORLD,
+                                                 vector_tiles.WORLD, vector_tiles.WORLD)
+    minx, miny, maxx, maxy = vector_tiles.tile_bounds(1, 1, 0)
+    assert (minx, maxy) == (0, vector_tiles.WORLD)
+
+
+def test_points_land_in_their_tile ():
+    x = np.array([-1.0, 1.0, 1.0])
+    y = np.array([1.0, 1.0, -1.0])
+    tx, ty = vector_tiles._point_tiles(x, y, 1)
+    assert tx.tolist() == [0, 1, 1]
+    assert ty.tolist() == [0, 0, 1]
+
+
+def test_bin_points_keeps_counts ():
+    x = np.array([10.0, 11.0, 5e6])
+    y = np.array([10.0, 11.0, 5e6])
+    binned = vector_tiles._bin_points(x, y, np.array([1.0, 3.0, 5.0]), np.array(['a', 'a', 'b']),
+                                      zoom = 2, cell_px = 4)
+    assert sorted(binned['count']) == [1, 2]
+    assert binned.loc[binned['count'] == 2, 'value'].item() == 2.0
+
+
+def test_lake_lod_hides_tiny_lakes ():
+    lakes = np.array([shapely.box(0, 0, 10, 10), shapely.box(0, 0, 1e6, 1e6)])
+    _, visible = vector_tiles._lake_lod(lakes, zoom = 5)
+    assert visible.tolist() == [False, True]
+
+
+def test_export_mbtiles_decodes (tmp_path):
+    import gzip
+    import sqlite3
+    import geopandas as gpd
+    mvt = pytest.importorskip('mapbox_vector_tile')
+
+    # One lake and three points on it, in EPSG:3857, two dates
+    lake = shapely.box(-4e6, 1e7, -4e6 + 2000, 1e7 + 2000)
+    lakes = gpd.GeoDataFrame({'area_rank_id': ['ID_1']}, geometry = [lake], crs = 'EPSG:3857')
+    points = gpd.GeoDataFrame({'area_rank_id': 'ID_1', 'z_diff_from_lake_mean': [0.5, -0.5, 1.0],
+                               'obs_date': ['2021-01-05', '2021-01-05', '2021-07-05']},
+                              geometry = shapely.points([-4e6 + 500, -4e6 + 502, -4e6 + 1500],
+                                                        [1e7 + 500, 1e7 + 503, 1e7 + 1500]),
+                              crs = 'EPSG:3857')
+    path = tmp_path / 'lakes.mbtiles'
+    n_tiles = vector_tiles.export_mbtiles(lakes, points, str(path), min_zoom = 8, max_zoom = 14,
+                                          full_detail_zoom = 14, cell_px = 4)
+    assert n_tiles >= 7
+
+    con = sqlite3.connect(path)
+    metadata = dict(con.execute('SELECT name, value FROM metadata'))
+    assert metadata['minzoom'] == '8' and metadata['format'] == 'pbf'
+    tiles = {z: [] for z in range(8, 15)}
+    for zoom, data in con.execute('SELECT zoom_level, tile_data FROM tiles'):
+        tiles[zoom].append(mvt.decode(gzip.decompress(data)))
+    con.close()
+
+    def features (zoom, layer):
+        return([f for tile in tiles[zoom] for f in tile.get(layer, {}).get('features', [])])
+
+    # Deepest zoom: every segment, with its lake
+    full = features(14, 'points')
+    assert sorted(f['properties']['z_diff_from_lake_mean'] for f in full) == [-0.5, 0.5, 1.0]
+    assert {f['properties']['area_rank_id'] for f in full} == {'ID_1'}
+    assert all(f['properties']['count'] == 1 for f in full)
+    assert {f['properties']['area_rank_id'] for f in features(14, 'lakes')} == {'ID_1'}
+    # Zoom 13 bins to 4 px (~76 m): the two close points share a cell
+    binned = features(13, 'points')
+    assert sorted(f['properties']['count'] for f in binned) == [1, 2]
+    pair = [f for f in binned if f['properties']['count'] == 2][0]
+    assert pair['properties']['z_diff_from_lake_mean'] == 0.0
+    assert pair['properties']['obs_date'] == '2021-01-05'
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Writes the robust lakes and points as zoom-levelled vector tiles in one
+MBTiles file, so QGIS only draws what's on screen at a sensible detail.
+Low zooms get simplified lakes and points binned to screen pixels, the
+deepest zoom has every segment.
+
+Needs mapbox-vector-tile (pip install mapbox-vector-tile) for the encoding.
+"""
+
+import gzip
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# Half the width of the web mercator world in metres
+WORLD = 20037508.342789244
+tile_px = 256
+extent = 4096
+
+
+def _tile_size (zoom):
+    return(2 * WORLD / 2 ** zoom)
+
+
+def tile_bounds (zoom, x, y):
+    size = _tile_size(zoom)
+    minx = -WORLD + x * size
+    maxy = WORLD - y * size
+
+    return((minx, maxy - size, minx + size, maxy))
+
+
+def _point_tiles (x, y, zoom):
+    size = _tile_size(zoom)
+    n = 2 ** zoom
+    tx = np.clip(np.floor((x + WORLD) / size), 0, n - 1).astype(np.int64)
+    ty = np.clip(np.floor((WORLD - y) / size), 0, n - 1).astype(np.int64)
+
+    return(tx, ty)
+
+# %% 1. Level of detail
+
+
+def _bin_points (x, y, values, labels, zoom, cell_px):
+    # Average points falling in the same cell_px x cell_px screen cell.
+    # Keeps the count and the most common label, vectorized with groupby.
+    cell = _tile_size(zoom) / tile_px * cell_px
+    cx = np.floor((x + WORLD) / cell).astype(np.int64)
+    cy = np.floor((WORLD - y) / cell).astype(np.int64)
+    df = pd.DataFrame({'x': x, 'y': y, 'value': values, 'label': labels})
+    df['cell'] = pd.DataFrame({'cx': cx, 'cy': cy}).groupby(['cx', 'cy'], sort = False).ngroup()
+    out = df.groupby('cell').agg(x = ('x', 'mean'), y = ('y', 'mean'),
+                                 value = ('value', 'mean'), count = ('value', 'size'))
+    # Most common label per cell from one count per (cell, label), ties go to
+    # the smallest label like Series.mode()
+    labels = df.groupby(['cell', 'label']).size().rename('n').reset_index()
+    labels = labels.sort_values(['cell', 'n', 'label'], ascending = [True, False, True])
+    out['label'] = labels.drop_duplicates('cell').set_index('cell')['label']
+
+    return(out.reset_index(drop = True))
+
+
+def _lake_lod (lake_geoms, zoom):
+    # Simplify to about one pixel and drop lakes smaller than a pixel
+    pixel = _tile_size(zoom) / tile_px
+    simple = shapely.simplify(lake_geoms, tolerance = pixel, preserve_topology = True)
+    visible = shapely.area(lake_geoms) >= pixel ** 2
+
+    return(simple, visible)
+
+# %% 2. Encoding and writing
+
+
+def _encode_tile (layers, bounds):
+    # Heavy optional import only when we actually write tiles
+    import mapbox_vector_tile
+
+    data = mapbox_vector_tile.encode(layers, default_options = {'quantize_bounds': bounds,
+                                                                'extents': extent})
+
+    return(gzip.compress(data))
+
+
+def _open_mbtiles (path, name, min_zoom, max_zoom, bounds_lonlat, fields):
+    con = sqlite3.connect(path)
+    con.execute('DROP TABLE IF EXISTS metadata')
+    con.execute('DROP TABLE IF EXISTS tiles')
+    con.execute('CREATE TABLE metadata (name text, value text)')
+    con.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, '
+                'tile_row integer, tile_data blob)')
+    con.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+    vector_layers = [{'id': layer, 'fields': layer_fields,
+                      'minzoom': min_zoom, 'maxzoom': max_zoom}
+                     for layer, layer_fields in fields.items()]
+    metadata = {'name': name, 'format': 'pbf', 'type': 'overlay',
+                'minzoom': str(min_zoom), 'maxzoom': str(max_zoom),
+                'bounds': ','.join(str(round(b, 5)) for b in bounds_lonlat),
+                'json': json.dumps({'vector_layers': vector_layers})}
+    con.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+
+    return(con)
+
+
+def export_mbtiles (lakes, points, path, lake_col = 'area_rank_id',
+                    value = 'z_diff_from_lake_mean', label = 'obs_date',
+                    min_zoom = 6, max_zoom = 14, full_detail_zoom = 13, cell_px = 2,
+                    name = 'IceSat2-Lakes'):
+    # lakes/points are GeoDataFrames in EPSG:3857. Points keep every segment
+    # from full_detail_zoom down, above that they're binned to cell_px pixels.
+    lake_geoms = np.asarray(lakes.geometry)
+    lake_ids = lakes[lake_col].astype(str).to_numpy()
+    x = points.geometry.x.to_numpy()
+    y = points.geometry.y.to_numpy()
+    values = points[value].to_numpy(dtype = 'float64')
+    labels = points[label].astype(str).to_numpy()
+    pt_lakes = points[lake_col].astype(str).to_numpy()
+
+    # Bounds for the metadata, from the lakes' extent
+    minx, miny, maxx, maxy = lakes.total_bounds
+    lon = np.degrees(np.array([minx, maxx]) / 6378137.0)
+    lat = np.degrees(2 * np.arctan(np.exp(np.array([miny, maxy]) / 6378137.0)) - np.pi / 2)
+    fields = {'lakes': {lake_col: 'String'},
+              'points': {value: 'Number', label: 'String', 'count': 'Number'}}
+    con = _open_mbtiles(path, name, min_zoom, max_zoom,
+                        [lon[0], lat[0], lon[1], lat[1]], fields)
+
+    n_tiles = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        simple, visible = _lake_lod(lake_geoms, zoom)
+        tree = shapely.STRtree(simple)
+
+        if zoom >= full_detail_zoom:
+            zx, zy, zval, zlab = x, y, values, labels
+            zcount = np.ones(len(x), dtype = np.int64)
+            zlake = pt_lakes
+        else:
+            binned = _bin_points(x, y, values, labels, zoom, cell_px)
+            zx, zy = binned['x'].to_numpy(), binned['y'].to_numpy()
+            zval, zlab = binned['value'].to_numpy(), binned['label'].to_numpy()
+            zcount = binned['count'].to_numpy()
+            zlake = None
+
+        # Every tile touched by a point or a visible lake
+        tx, ty = _point_tiles(zx, zy, zoom)
+        tiles = set(zip(tx.tolist(), ty.tolist()))
+        lake_bounds = shapely.bounds(simple[visible])
+        x0, y1 = _point_tiles(lake_bounds[:, 0], lake_bounds[:, 1], zoom)
+        x1, y0 = _point_tiles(lake_bounds[:, 2], lake_bounds[:, 3], zoom)
+        for i0, i1, j0, j1 in zip(x0, x1, y0, y1):
+            tiles.update((i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1))
+
+        # Sort points by tile once, then slice
+        code = tx * 2 ** zoom + ty
+        order = np.argsort(code, kind = 'stable')
+        sorted_code = code[order]
+
+        rows = []
+        for tile_x, tile_y in sorted(tiles):
+            bounds = tile_bounds(zoom, tile_x, tile_y)
+            lake_features = []
+            for idx in tree.query(shapely.box(*bounds)):
+                if not visible[idx]:
+                    continue
+                piece = shapely.clip_by_rect(simple[idx], *bounds)
+                if not piece.is_empty:
+                    lake_features.append({'geometry': piece,
+                                          'properties': {lake_col: lake_ids[idx]}})
+
+            c = tile_x * 2 ** zoom + tile_y
+            lo, hi = np.searchsorted(sorted_code, [c, c + 1])
+            point_features = []
+            for k in order[lo:hi]:
+                props = {value: float(zval[k]), label: str(zlab[k]), 'count': int(zcount[k])}
+                if zlake is not None:
+                    props[lake_col] = zlake[k]
+                point_features.append({'geometry': shapely.Point(zx[k], zy[k]),
+                                       'properties': props})
+
+            if not lake_features and not point_features:
+                continue
+            layers = [{'name': 'lakes', 'features': lake_features},
+                      {'name': 'points', 'features': point_features}]
+            # MBTiles rows count from the bottom (TMS)
+            tms_y = 2 ** zoom - 1 - tile_y
+            rows.append((zoom, tile_x, tms_y, _encode_tile(layers, bounds)))
+
+        con.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', rows)
+        con.commit()
+        n_tiles += len(rows)
+
+    con.close()
+
+    return(n_tiles)